@@ -0,0 +1,138 @@
+"""
+啟動時間基準測試 (Startup benchmark)
+
+以 `python -X importtime` 匯入每個作業腳本 (不執行 __main__)，
+統計腳本本身的 import 累積時間 (扣掉直譯器啟動時就載入的 site 等模組) 與整體 wall time，
+並以 import 時間的中位數和 bench_startup_baseline.json 比較。wall time 含直譯器啟動，只供參考。
+
+用法:
+    python bench_startup.py              # 量測並和基準比較，退步超過容忍值或匯入失敗時 exit 1
+    python bench_startup.py --update     # 以本次結果覆寫基準
+    python bench_startup.py --runs 11    # 每個腳本量 11 次取中位數
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+BASELINE_FILE = ROOT / "bench_startup_baseline.json"
+
+SCRIPTS = [
+    "day2/hw2.py",
+    "day3/ch5_1.py",
+    "day3/ch5_2.py",
+    "day3/hw3.py",
+    "day4/ch7_1.py",
+    "day4/ch7_2.py",
+    "day4/hw4.py",
+    "day5/1111032091_RAG_HW_01.py",
+]
+
+# import time: self [us] | cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def startup_modules() -> set[str]:
+    """空的直譯器 (加上 measure 用到的 importlib.util) 啟動時就會載入的模組，不算進腳本的 import 時間"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import importlib.util, sys"],
+                          capture_output=True, text=True)
+    return {m.group(4) for m in map(_LINE.match, proc.stderr.splitlines()) if m}
+
+
+def measure(script: str, skip: set[str] = frozenset()) -> dict:
+    """匯入一次腳本，回傳 import 累積時間 (ms)、最重的模組與 wall time"""
+    path = ROOT / script
+    # 檔名不一定是合法模組名稱 (1111032091_RAG_HW_01)，改用 spec 直接載入
+    code = (
+        "import importlib.util, sys; "
+        f"sys.path.insert(0, {str(path.parent)!r}); "
+        f"spec = importlib.util.spec_from_file_location('bench_target', {str(path)!r}); "
+        "mod = importlib.util.module_from_spec(spec); "
+        "spec.loader.exec_module(mod)"
+    )
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=path.parent, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    total_us = 0
+    top = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        cumulative, indent, name = int(m.group(2)), m.group(3), m.group(4)
+        # 只加總最外層 (縮排最少) 的模組，避免重複計算
+        if len(indent) <= 1 and name not in skip:
+            total_us += cumulative
+            top.append((cumulative, name))
+    top.sort(reverse=True)
+    return {
+        "ok": proc.returncode == 0,
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else "",
+        "import_ms": total_us / 1000,
+        "wall_ms": wall_ms,
+        "heaviest": [f"{name} ({us / 1000:.0f} ms)" for us, name in top[:3]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="作業腳本啟動時間基準測試")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--update", action="store_true", help="以本次結果覆寫基準")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允許的退步比例 (預設 25%%)")
+    parser.add_argument("--floor", type=float, default=10.0,
+                        help="退步至少要超過基準幾 ms 才算 (小腳本的 25%% 只有幾 ms，在雜訊範圍內)")
+    args = parser.parse_args()
+
+    baseline = json.loads(BASELINE_FILE.read_text(encoding="utf-8")) if BASELINE_FILE.exists() else {}
+    results = {}
+    regressions = []
+    failures = []
+    skip = startup_modules()
+
+    print(f"{'script':<32}{'import ms':>12}{'wall ms':>12}{'base import':>12}")
+    for script in SCRIPTS:
+        runs = [measure(script, skip) for _ in range(args.runs)]
+        if not all(r["ok"] for r in runs):
+            error = next(r["error"] for r in runs if not r["ok"])
+            print(f"{script:<32}  匯入失敗: {error}")
+            failures.append(f"{script}: {error}")
+            continue
+        import_ms = statistics.median(r["import_ms"] for r in runs)
+        wall_ms = statistics.median(r["wall_ms"] for r in runs)
+        results[script] = {"import_ms": round(import_ms, 1), "wall_ms": round(wall_ms, 1)}
+
+        base = baseline.get(script, {}).get("import_ms")
+        base_str = f"{base:.1f}" if base else "-"
+        print(f"{script:<32}{import_ms:>12.1f}{wall_ms:>12.1f}{base_str:>12}")
+        print(f"{'':<32}最重: {', '.join(runs[-1]['heaviest'])}")
+        if base and import_ms > max(base * (1 + args.tolerance), base + args.floor):
+            regressions.append(f"{script}: {base:.1f} ms -> {import_ms:.1f} ms")
+        elif not base and not args.update:
+            print(f"{'':<32}沒有基準 (以 --update 建立)")
+
+    if failures:
+        print("\n匯入失敗:")
+        for f in failures:
+            print(f"  {f}")
+        sys.exit(1)
+    if args.update:
+        BASELINE_FILE.write_text(json.dumps(results, indent=4) + "\n", encoding="utf-8")
+        print(f"\n已更新基準: {BASELINE_FILE.name}")
+    elif regressions:
+        print("\n啟動時間退步 (import 時間中位數):")
+        for r in regressions:
+            print(f"  {r}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+大量主題的貼文批次生成
+
+    python bulk_posts.py topics.csv -o posts.jsonl --tps 3000 --in-flight 8
+    python bulk_posts.py topics.jsonl -o posts.jsonl          # 中斷後再執行同一指令即從上次進度繼續
+
+- 主題來源：CSV (欄位 topic，沒有就取第一欄；可選 id 欄) 或 JSONL ({"topic": ..., "id": ...})
+- 每個主題產生感性 / 理性兩種貼文 (hw2 的兩個 prompt)，兩個請求分開受限流控制：
+    * --in-flight：同時在路上的 LLM 請求數上限
+    * --tps：全域 token / 秒 的 token bucket；送出前先扣「提示詞估計 + max_tokens」，
+      回應後依實際用量多退少補
+- 每完成一個主題就追加一行 JSONL 並 flush；重新執行時略過輸出檔中已成功的主題，失敗的會重跑
+- 結束時輸出吞吐量、錯誤率與延遲百分位數
+"""
+import argparse
+import asyncio
+import csv
+import json
+import time
+from pathlib import Path
+
+from hw2 import MAX_TOKENS, STYLE_MESSAGES, get_prompts, llm
+from instrumentation import METRICS
+
+
+def load_topics(path: str) -> list[dict]:
+    """回傳 [{"id", "topic"}]；沒有 id 欄位時以主題文字當 id"""
+    rows = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".jsonl"):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            reader = csv.DictReader(f)
+            if not reader.fieldnames:  # 空檔案沒有標題列
+                raise SystemExit(f"{path} 是空的 CSV (沒有標題列)")
+            column = "topic" if "topic" in reader.fieldnames else reader.fieldnames[0]
+            records = ({"id": r.get("id"), "topic": r[column]} for r in reader)
+        for record in records:
+            topic = (record.get("topic") or "").strip()
+            if topic:
+                rows.append({"id": str(record.get("id") or topic), "topic": topic})
+    return rows
+
+
+def completed_ids(path: Path) -> set[str]:
+    """輸出檔中已成功的主題 id (最後一行可能因中斷而不完整，略過)"""
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+class TokenBucket:
+    """每秒補充 rate 個 token，最多存 capacity 個；可以暫時透支 (實際用量大於預估時)"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        amount = min(amount, self.capacity)  # 單一請求超過容量時也要能送出
+        async with self._lock:  # 先到先得，避免小請求一直插隊
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, delta: float):
+        """回應後依實際用量修正：delta > 0 表示多用了，< 0 表示退回"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class BulkGenerator:
+    def __init__(self, tps: float, in_flight: int):
+        self.bucket = TokenBucket(tps)
+        self.in_flight = asyncio.Semaphore(in_flight)
+        self.chain = {style: prompt | llm.get() for style, prompt in get_prompts().items()}
+        self.estimates = {}  # style -> 提示詞固定部分的估計 token 數
+
+    def estimate(self, style: str, topic: str) -> int:
+        """中文約 1 token/字；加上回應上限 max_tokens"""
+        if style not in self.estimates:
+            self.estimates[style] = sum(len(text) for _, text in STYLE_MESSAGES[style])
+        return self.estimates[style] + len(topic) + MAX_TOKENS
+
+    async def generate(self, style: str, topic: str) -> tuple[str, int]:
+        reserved = self.estimate(style, topic)
+        await self.bucket.acquire(reserved)
+        async with self.in_flight:
+            message = await self.chain[style].ainvoke({"topic": topic})
+        usage = message.usage_metadata or {}
+        used = usage.get("total_tokens", reserved)
+        self.bucket.adjust(used - reserved)
+        return message.content, used
+
+    async def run_topic(self, row: dict) -> dict:
+        start = time.perf_counter()
+        record = {"id": row["id"], "topic": row["topic"]}
+        results = await asyncio.gather(*(self.generate(style, row["topic"]) for style in STYLE_MESSAGES),
+                                       return_exceptions=True)
+        errors = [f"{style}: {r!r}" for style, r in zip(STYLE_MESSAGES, results) if isinstance(r, BaseException)]
+        if errors:
+            record["error"] = "; ".join(errors)
+        else:
+            record.update({style: text for style, (text, _) in zip(STYLE_MESSAGES, results)})
+            record["tokens"] = sum(used for _, used in results)
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        METRICS.observe("bulk_posts_topic_seconds", record["seconds"], status="error" if errors else "ok")
+        return record
+
+
+async def run(rows: list[dict], output: Path, tps: float, in_flight: int, progress_every: int = 50) -> dict:
+    generator = BulkGenerator(tps, in_flight)
+    queue = asyncio.Queue()
+    for row in rows:
+        queue.put_nowait(row)
+    stats = {"done": 0, "errors": 0, "tokens": 0, "latencies": []}
+    start = time.perf_counter()
+
+    with open(output, "a", encoding="utf-8") as out:
+        async def worker():
+            while not queue.empty():
+                record = await generator.run_topic(queue.get_nowait())
+                # 單一 event loop，寫檔不需要鎖；每行都 flush，中斷時最多損失寫到一半的那一行
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["done"] += 1
+                stats["latencies"].append(record["seconds"])
+                if "error" in record:
+                    stats["errors"] += 1
+                else:
+                    stats["tokens"] += record["tokens"]
+                if stats["done"] % progress_every == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"  進度 {stats['done']}/{len(rows)}  {stats['done'] / elapsed:.2f} 主題/秒  錯誤 {stats['errors']}")
+
+        # 每個主題同時送出兩個請求，worker 數與 in-flight 上限相同就足以塞滿
+        await asyncio.gather(*(worker() for _ in range(in_flight)))
+
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def report(stats: dict, skipped: int):
+    seconds = stats["seconds"] or 1e-9
+    done, errors, latencies = stats["done"], stats["errors"], stats["latencies"]
+    print("\n" + "=" * 30)
+    print("批次生成報告")
+    print("=" * 30)
+    print(f"本次處理: {done} 個主題 (略過先前已完成 {skipped})  錯誤: {errors} ({errors / max(done, 1):.1%})")
+    print(f"總耗時: {seconds:.1f} 秒  吞吐量: {done / seconds:.2f} 主題/秒, "
+          f"{(done - errors) * len(STYLE_MESSAGES) / seconds:.2f} 篇/秒, {stats['tokens'] / seconds:.0f} tokens/秒")
+    if latencies:
+        print(f"每個主題延遲: p50 {percentile(latencies, 0.5):.2f} 秒  p95 {percentile(latencies, 0.95):.2f} 秒  "
+              f"p99 {percentile(latencies, 0.99):.2f} 秒  最大 {max(latencies):.2f} 秒")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="大量主題的感性 / 理性貼文批次生成")
+    parser.add_argument("input", help="主題檔 (.csv 或 .jsonl)")
+    parser.add_argument("-o", "--output", help="輸出 JSONL (預設 <輸入檔名>.posts.jsonl)")
+    parser.add_argument("--tps", type=float, default=3000, help="全域 token / 秒 上限")
+    parser.add_argument("--in-flight", type=int, default=8, help="同時進行的 LLM 請求數上限")
+    parser.add_argument("--limit", type=int, help="只處理前 N 個尚未完成的主題")
+    args = parser.parse_args()
+
+    output = Path(args.output) if args.output else Path(args.input).with_suffix(".posts.jsonl")
+    rows = load_topics(args.input)
+    done = completed_ids(output)
+    pending = [row for row in rows if row["id"] not in done]
+    pending = list({row["id"]: row for row in pending}.values())  # 重複的主題只跑一次
+    if args.limit:
+        pending = pending[:args.limit]
+    skipped = sum(row["id"] in done for row in rows)
+    print(f"主題 {len(rows)} 個，已完成 {skipped}，本次處理 {len(pending)} -> {output}")
+    if pending:
+        stats = asyncio.run(run(pending, output, args.tps, args.in_flight))
+        report(stats, skipped)
@@ -1,76 +1,184 @@
-from langchain_openai import ChatOpenAI
+import argparse
+import asyncio
 import time
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableParallel
-
-# 1. 設定模型 (LLM)
-llm = ChatOpenAI(
-    model="Llama-3.3-70B-Instruct-NVFP4",
-    base_url="https://ws-03.wade0426.me/v1",
-    api_key="EMPTY", 
-    temperature=0,  
-    max_tokens=100
-)
+import sys
+from functools import cache
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from instrumentation import METRICS, measure
+
+# 1. 設定模型 (LLM) —— 第一次呼叫才建立
+MAX_TOKENS = 100
+llm = lazy_llm("Llama-3.3-70B-Instruct-NVFP4", endpoint="ws-03", temperature=0, max_tokens=MAX_TOKENS)
+
+# RunnableParallel 的分支名稱 -> 輸出標籤
+BRANCHES = {"sentimental": "📝 感性", "rational": "📊 理性"}
 
 # 2. 建立 Prompt Templates (提示詞模板)
 # 風格 1: 感性/情緒化
-prompt_sentimental = ChatPromptTemplate.from_messages([
+SENTIMENTAL_MESSAGES = [
     ("system", "你是一位充滿情感、語氣溫暖且富有感染力的社群小編。"),
     ("user", "請為主題「{topic}」寫一句話感性的貼文，著重於個人感受與情感連結，包含標籤。")
-])
+]
 
 # 風格 2: 理性/專業
-prompt_rational = ChatPromptTemplate.from_messages([
+RATIONAL_MESSAGES = [
     ("system", "你是一位專業、客觀且邏輯嚴謹的分析師。"),
     ("user", "請為主題「{topic}」寫一句理性的分析文，著重於事實、數據與邏輯推演，包含標籤")
-])
+]
+
+STYLE_MESSAGES = {"sentimental": SENTIMENTAL_MESSAGES, "rational": RATIONAL_MESSAGES}
+
+@cache
+def get_prompts():
+    """各風格的 ChatPromptTemplate (分支名稱 -> prompt)"""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return {style: ChatPromptTemplate.from_messages(messages) for style, messages in STYLE_MESSAGES.items()}
+
+@cache
+def get_map_chain():
+    """3~4. 建立鏈並平行處理 (延遲到第一次使用，避免啟動時載入 langchain)"""
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnableParallel
+
+    prompts = get_prompts()
+    return RunnableParallel(
+        sentimental=prompts["sentimental"] | llm.get() | StrOutputParser(),
+        rational=prompts["rational"] | llm.get() | StrOutputParser()
+    )
+
+class Demux:
+    """
+    RunnableParallel 串流時兩個分支的 token 會交錯出現。
+    每個分支各自緩衝到句尾 (或 FLUSH_CHARS 個字) 才輸出一段，換分支時換行並標上分支名稱。
+    """
+    FLUSH_CHARS = 40
+    SENTENCE_END = tuple("。！？!?\n")
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.current = None
+        self.pending = dict.fromkeys(BRANCHES, "")
 
-# 3. 建立鏈 (Chain)
-chain_sentimental = prompt_sentimental | llm | StrOutputParser()
-chain_rational = prompt_rational | llm | StrOutputParser()
+    def write(self, branch: str, token: str):
+        self.pending[branch] += token
+        if token.endswith(self.SENTENCE_END) or len(self.pending[branch]) >= self.FLUSH_CHARS:
+            self.flush(branch)
 
-# 4. 平行處理 (Parallel Execution)
-map_chain = RunnableParallel(
-    sentimental=chain_sentimental,
-    rational=chain_rational
-)
+    def flush(self, branch: str):
+        text, self.pending[branch] = self.pending[branch], ""
+        if not text:
+            return
+        if branch != self.current:
+            self.out.write(f"\n[{BRANCHES[branch]}] ")
+            self.current = branch
+        try:
+            self.out.write(text)
+        except UnicodeEncodeError:
+            self.out.write(text.encode('utf-8', 'replace').decode('utf-8'))
+        self.out.flush()
+
+    def close(self):
+        for branch in BRANCHES:
+            self.flush(branch)
+
+async def astream_topic(topic: str, demux: Demux | None = None) -> dict:
+    """
+    串流跑一次 map_chain，依分支拆開 token；同一次執行就量出每個分支的
+    time-to-first-token 與總耗時 (不再為了計時重跑一次 invoke)
+    """
+    chain = get_map_chain()
+    texts = dict.fromkeys(BRANCHES, "")
+    ttft, total = {}, {}
+    start = time.perf_counter()
+    with measure("hw2_map_chain", mode="stream"):
+        async for chunk in chain.astream({"topic": topic}):
+            now = time.perf_counter() - start
+            for branch, token in chunk.items():
+                if not token:
+                    continue
+                ttft.setdefault(branch, now)
+                total[branch] = now
+                texts[branch] += token
+                if demux:
+                    demux.write(branch, token)
+    if demux:
+        demux.close()
+    for branch in ttft:
+        METRICS.observe("hw2_branch_ttft_seconds", ttft[branch], branch=branch)
+        METRICS.observe("hw2_branch_seconds", total[branch], branch=branch)
+    return {"topic": topic, **texts, "ttft": ttft, "total": total, "elapsed": time.perf_counter() - start}
+
+def run_batch(topics: list[str], max_concurrency: int = 4) -> list:
+    """多個主題用 abatch 同時跑，最多 max_concurrency 個主題同時在串流；失敗的主題回傳例外物件"""
+    from langchain_core.runnables import RunnableLambda
+
+    runner = RunnableLambda(astream_topic)
+    return asyncio.run(runner.abatch(topics, config={"max_concurrency": max_concurrency}, return_exceptions=True))
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+def print_timings(results: list[dict]):
+    """每個分支的 TTFT 與總耗時 (多個主題時列 p50 / p95)"""
+    for branch, label in BRANCHES.items():
+        ttft = [r["ttft"][branch] for r in results if branch in r["ttft"]]
+        total = [r["total"][branch] for r in results if branch in r["total"]]
+        if not ttft:
+            print(f"{label}: 沒有輸出")
+        elif len(results) == 1:
+            print(f"{label}: 首個 token {ttft[0]:.3f} 秒, 完成 {total[0]:.3f} 秒")
+        else:
+            print(f"{label}: 首個 token p50 {percentile(ttft, 0.5):.3f} / p95 {percentile(ttft, 0.95):.3f} 秒, "
+                  f"完成 p50 {percentile(total, 0.5):.3f} / p95 {percentile(total, 0.95):.3f} 秒")
 
 # 5. 執行調用
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同一主題平行生成感性 / 理性兩種貼文")
+    parser.add_argument("topics", nargs="*", help="主題 (不給則互動輸入；多個主題走批次模式)")
+    parser.add_argument("--file", help="主題清單檔，一行一個主題 (批次模式)")
+    parser.add_argument("--concurrency", type=int, default=4, help="批次模式同時處理的主題數")
+    args = parser.parse_args()
+
+    prewarm("ws-03")
+    topics = list(args.topics)
+    if args.file:
+        topics += [line.strip() for line in Path(args.file).read_text(encoding="utf-8").splitlines() if line.strip()]
     try:
-        topic = input("請輸入主題: ")
-        print(f"\n正在為主題「{topic}」生成貼文...\n")
-
-        # --- Streaming (串流執行) ---
-        print("===" * 10)
-        print(" [Stream 模式] ")
-        print("===" * 10)
-
-        print("(正在串流輸出... 格式為 raw chunks)")
-        for chunk in map_chain.stream({"topic": topic}):
-            # chunk 是一個字典，包含部分生成的內容
-            try:
-                print(chunk,end='',flush=True)
-            except UnicodeEncodeError:
-                print(chunk.encode('utf-8','replace').decode('utf-8'),end='',flush=True)
-        # --- Batch Invoke (批次執行) ---
-        print("===" * 10)
-        print(" [Batch Invoke 模式] ")
-        print("===" * 10)
-        
-        start_time = time.time()
-        result = map_chain.invoke({"topic": topic})
-        end_time = time.time()
-        print(f"耗時: {end_time - start_time:.4f} 秒")
-        
-        print("\n📝 [感性風格]:")
-        print(result["sentimental"])
-        print("\n📊 [理性風格]:")
-        print(result["rational"])
-        print("\n")
-
-        
+        if len(topics) <= 1:
+            topic = topics[0] if topics else input("請輸入主題: ")
+            print(f"\n正在為主題「{topic}」生成貼文...\n")
+
+            # --- Streaming (串流執行，兩個分支分開顯示) ---
+            print("===" * 10)
+            print(" [Stream 模式] ")
+            print("===" * 10)
+            result = asyncio.run(astream_topic(topic, Demux()))
+            print("\n")
+            print(f"耗時: {result['elapsed']:.4f} 秒")
+            print_timings([result])
+        else:
+            # --- Batch (abatch + max_concurrency) ---
+            print("===" * 10)
+            print(f" [Batch 模式] {len(topics)} 個主題, 同時 {args.concurrency} 個")
+            print("===" * 10)
+            start_time = time.perf_counter()
+            results = run_batch(topics, args.concurrency)
+            elapsed = time.perf_counter() - start_time
+            ok = [r for r in results if isinstance(r, dict)]
+            for topic, result in zip(topics, results):
+                if isinstance(result, dict):
+                    print(f"\n# {topic}")
+                    for branch, label in BRANCHES.items():
+                        print(f"[{label}] {result[branch]}")
+                else:
+                    print(f"\n# {topic}\n發生錯誤: {result}")
+            print(f"\n完成 {len(ok)}/{len(topics)} 個主題, 耗時 {elapsed:.2f} 秒 ({len(topics) / elapsed:.2f} 主題/秒)")
+            if ok:
+                print_timings(ok)
 
     except Exception as e:
-        print(f"發生錯誤: {e}")
\ No newline at end of file
+        print(f"發生錯誤: {e}")
@@ -0,0 +1,223 @@
+"""
+批次 ASR：把整個資料夾 (或清單檔) 的音檔送去轉錄
+
+    python asr_batch.py podcasts/ --uploads 4
+    python asr_batch.py manifest.txt          # 每行一個音檔路徑
+
+- 上傳以 ThreadPoolExecutor 限制同時數量
+- 任務狀態寫在 out/asr_jobs.json，中斷後重跑會接續：已完成的略過、已上傳的直接輪詢
+- 所有未完成任務在同一個迴圈裡輪詢 (hw_asr.TaskPoller，各自指數退避)，不是一個任務一條執行緒
+- 結果存成 out/<檔名>_<內容 SHA-256 前 12 碼>.txt / .srt (不同資料夾的同名檔不會互相覆蓋)，
+  最後輸出吞吐量與每個檔案的延遲
+- iter_transcripts() 以 generator 方式邊完成邊交出結果，hw3.py --batch 直接串接
+"""
+import argparse
+import json
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from hw_asr import AsrClient, AsrResult, audio_hash, load_cached, out_dir, store_cached
+
+AUDIO_SUFFIXES = {".wav", ".mp3", ".m4a", ".flac", ".ogg"}
+JOB_TABLE = out_dir / "asr_jobs.json"
+
+
+def load_inputs(source) -> list[Path]:
+    """資料夾 -> 其中的音檔；清單檔 (.txt 每行一個 / .json 陣列) -> 列出的檔案"""
+    source = Path(source)
+    if source.is_dir():
+        return sorted(p for p in source.iterdir() if p.suffix.lower() in AUDIO_SUFFIXES)
+    text = source.read_text(encoding="utf-8")
+    if source.suffix == ".json":
+        entries = json.loads(text)
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    return [(source.parent / e).resolve() if not Path(e).is_absolute() else Path(e) for e in entries]
+
+
+def output_stem(path, digest: str) -> str:
+    """輸出檔名：只用檔名的話 a/x.wav 與 b/x.wav 會寫到同一個檔，所以接上內容 hash"""
+    return f"{Path(path).stem}_{digest[:12]}"
+
+
+class JobTable:
+    """以 JSON 檔保存每個音檔的任務狀態：pending / uploaded / done / failed"""
+
+    def __init__(self, path: Path = JOB_TABLE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if path.exists():
+            try:
+                self.jobs = json.loads(path.read_text(encoding="utf-8"))
+            except json.JSONDecodeError:
+                self.jobs = {}
+
+    def get(self, key: str) -> dict:
+        with self.lock:
+            return dict(self.jobs.get(key, {}))
+
+    def update(self, key: str, **fields):
+        with self.lock:
+            self.jobs.setdefault(key, {}).update(fields)
+            self.path.parent.mkdir(exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.jobs, ensure_ascii=False, indent=4), encoding="utf-8")
+            tmp.replace(self.path)
+
+
+class BatchTranscriber:
+    def __init__(self, client: AsrClient | None = None, max_uploads: int = 4,
+                 job_table: JobTable | None = None):
+        self.client = client or AsrClient()
+        self.max_uploads = max_uploads
+        self.jobs = job_table or JobTable()
+        self.latencies = {}  # 路徑 -> 本次從送出到完成的秒數
+        self.digests = {}    # 路徑 -> 音檔內容 SHA-256 (快取與輸出檔名共用，每個檔案只算一次)
+        self.failed = []
+        self.resumed = 0  # 先前已完成或命中快取、直接讀檔的數量
+        self.started_at = None
+        self.finished_at = None
+
+    def _digest(self, key) -> str:
+        key = str(key)
+        if key not in self.digests:
+            self.digests[key] = audio_hash(key)
+        return self.digests[key]
+
+    def _upload(self, path: Path, events: queue.Queue):
+        key = str(path)
+        self.jobs.update(key, status="pending", submitted_at=time.time())
+        try:
+            task_id = self.client.create_task(path)
+        except Exception as e:
+            events.put((key, None, e))
+            return
+        self.jobs.update(key, status="uploaded", task_id=task_id, uploaded_at=time.time())
+        events.put((key, task_id, None))
+
+    def _finish(self, key: str, task_id: str, txt: str, srt: str | None) -> AsrResult:
+        digest = self._digest(key)
+        stem = output_stem(key, digest)
+        out_dir.mkdir(exist_ok=True)
+        txt_path = out_dir / f"{stem}.txt"
+        txt_path.write_text(txt, encoding="utf-8")
+        srt_path = None
+        if srt is not None:
+            srt_path = out_dir / f"{stem}.srt"
+            srt_path.write_text(srt, encoding="utf-8")
+        store_cached(digest, AsrResult(task_id, txt, srt))
+        job = self.jobs.get(key)
+        self.jobs.update(key, status="done", done_at=time.time(), digest=digest,
+                         txt_path=str(txt_path), srt_path=str(srt_path) if srt_path else None)
+        self.latencies[key] = time.time() - job.get("submitted_at", time.time())
+        return AsrResult(task_id, txt, srt)
+
+    def run(self, paths):
+        """
+        generator：依完成順序 yield (path, AsrResult)。
+        上傳在背景進行，輪詢則在這個迴圈裡，由呼叫端拉動。
+        """
+        self.started_at = time.time()
+        events = queue.Queue()
+        poller = self.client.poller()
+        to_upload = []
+
+        for path in map(Path, paths):
+            key = str(path)
+            job = self.jobs.get(key)
+            if (job.get("status") == "done" and job.get("txt_path") and Path(job["txt_path"]).exists()
+                    and job.get("digest") == self._digest(path)):
+                # 先前已完成且音檔沒變：直接讀檔交出 (舊版以檔名命名的紀錄沒有 digest，重新處理)
+                srt_path = job.get("srt_path")
+                srt = Path(srt_path).read_text(encoding="utf-8") if srt_path and Path(srt_path).exists() else None
+                self.resumed += 1
+                yield path, AsrResult(job["task_id"], Path(job["txt_path"]).read_text(encoding="utf-8"), srt)
+            elif (cached := load_cached(self._digest(path))) is not None:
+                # 同內容的音檔轉錄過 (內容 hash 快取)：不必上傳
+                self.resumed += 1
+                yield path, cached
+            elif job.get("status") == "uploaded" and job.get("task_id"):
+                # 先前已上傳但沒等到結果：接續輪詢
+                events.put((key, job["task_id"], None))
+            else:
+                to_upload.append(path)
+
+        upload_keys = {str(p) for p in to_upload}
+        pending_uploads = len(to_upload)
+        pool = ThreadPoolExecutor(max_workers=self.max_uploads, thread_name_prefix="asr-upload")
+        for path in to_upload:
+            pool.submit(self._upload, path, events)
+
+        try:
+            while pending_uploads or poller or not events.empty():
+                # 1) 收上傳結果 (等到最近一個該輪詢的任務為止，有上傳完成會提早醒來)
+                try:
+                    key, task_id, error = events.get(timeout=poller.next_wait())
+                    if key in upload_keys:
+                        pending_uploads -= 1
+                    if error is not None:
+                        print(f"[batch] 上傳失敗 {Path(key).name}: {error}")
+                        self.jobs.update(key, status="failed", error=str(error))
+                        self.failed.append(key)
+                    else:
+                        print(f"[batch] {Path(key).name} -> task {task_id}")
+                        poller.add(key, task_id)
+                    continue
+                except queue.Empty:
+                    pass
+
+                # 2) 輪詢到期的任務
+                for key, result in poller.poll():
+                    if result.srt is not None:
+                        yield Path(key), self._finish(key, result.task_id, result.txt, result.srt)
+                        continue
+                    print(f"[batch] 轉錄逾時 {Path(key).name}")
+                    if result.txt is not None:
+                        yield Path(key), self._finish(key, result.task_id, result.txt, None)
+                    else:
+                        self.jobs.update(key, status="failed", error="timeout")
+                        self.failed.append(key)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.finished_at = time.time()
+
+    def report(self):
+        elapsed = (self.finished_at or time.time()) - (self.started_at or time.time())
+        done = len(self.latencies)
+        print("\n" + "=" * 30)
+        print("批次轉錄報告")
+        print("=" * 30)
+        print(f"完成: {done}  沿用先前結果: {self.resumed}  失敗: {len(self.failed)}  總耗時: {elapsed:.1f} 秒")
+        if elapsed > 0:
+            print(f"吞吐量: {done / elapsed * 60:.2f} 檔/分鐘")
+        if self.latencies:
+            values = sorted(self.latencies.values())
+            print(f"單檔延遲: 中位數 {statistics.median(values):.1f} 秒 / 最大 {values[-1]:.1f} 秒")
+            for name, seconds in sorted(self.latencies.items(), key=lambda kv: -kv[1]):
+                print(f"  {name}: {seconds:.1f} 秒")
+
+
+def iter_transcripts(source, max_uploads: int = 4, client: AsrClient | None = None):
+    """給其他腳本用：依完成順序 yield (path, AsrResult)，結束時印出報告"""
+    batch = BatchTranscriber(client=client, max_uploads=max_uploads)
+    try:
+        yield from batch.run(load_inputs(source))
+    finally:
+        batch.report()
+        if client is None:
+            batch.client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批次 ASR 轉錄")
+    parser.add_argument("source", help="音檔資料夾，或清單檔 (.txt 每行一個路徑 / .json 陣列)")
+    parser.add_argument("--uploads", type=int, default=4, help="同時上傳數量")
+    args = parser.parse_args()
+
+    for path, result in iter_transcripts(args.source, max_uploads=args.uploads):
+        print(f"[batch] 完成 {path.name} (task {result.task_id})")
@@ -0,0 +1,198 @@
+"""
+長音檔分段轉錄
+
+    python asr_segment.py long.wav --segment 60 --overlap 2
+
+- 在本機把 WAV 切成有重疊的片段：切點優先選在目標位置前 silence_search 秒內最安靜的地方，
+  找不到合適的就退回固定長度切割
+- 各片段平行上傳 (AsrClient 的執行緒池)；輪詢全部在同一個迴圈裡進行 (hw_asr.TaskPoller，與 asr_batch 共用)，
+  片段再多也不會被執行緒池大小卡住
+- 回來的 SRT 依片段起點平移時間軸後拼接；重疊區的字幕依「中點落在哪個片段的主要範圍」去重
+- 片段依序完成就先輸出，量測第一句字幕出現時間 (time-to-first-subtitle) 與總耗時
+"""
+import argparse
+import array
+import shutil
+import tempfile
+import time
+import wave
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from pathlib import Path
+
+from hw_asr import AsrClient
+from srt import parse_srt, to_srt
+
+FRAME_SECONDS = 0.05  # 計算音量用的小窗長度
+
+
+@dataclass
+class Segment:
+    index: int
+    path: Path
+    offset: float      # 片段檔案在原音檔中的起點 (秒)，含前面的重疊
+    core_start: float  # 這個片段「負責」的範圍，用於重疊區去重
+    core_end: float
+
+
+def wav_duration(path) -> float:
+    with wave.open(str(path), "rb") as w:
+        return w.getnframes() / w.getframerate()
+
+
+def _quietest_point(w: wave.Wave_read, start: float, end: float) -> float | None:
+    """回傳 [start, end) 之間平均音量最低的小窗位置 (秒)；不支援的取樣格式回傳 None"""
+    width = w.getsampwidth()
+    if width not in (1, 2, 4):
+        return None
+    rate = w.getframerate()
+    frame_len = max(int(rate * FRAME_SECONDS), 1)
+    w.setpos(int(start * rate))
+    raw = w.readframes(int((end - start) * rate))
+    samples = array.array({1: "B", 2: "h", 4: "i"}[width], raw)
+    step = frame_len * w.getnchannels()
+    bias = 128 if width == 1 else 0
+
+    best, best_energy = None, None
+    for i in range(0, len(samples) - step + 1, step):
+        chunk = samples[i:i + step]
+        energy = sum(abs(s - bias) for s in chunk[::4]) / max(len(chunk) // 4, 1)
+        if best_energy is None or energy < best_energy:
+            best, best_energy = i // w.getnchannels(), energy
+    return None if best is None else start + best / rate
+
+
+def split_wav(path, segment_seconds: float = 60, overlap_seconds: float = 2,
+              silence_search: float = 5, workdir=None) -> list[Segment]:
+    """把 WAV 切成片段檔；回傳 Segment 列表 (依時間排序)"""
+    workdir = Path(workdir or tempfile.mkdtemp(prefix="asr_seg_"))
+    segments = []
+    with wave.open(str(path), "rb") as w:
+        rate = w.getframerate()
+        duration = w.getnframes() / rate
+        params = w.getparams()
+
+        # 1) 決定切點
+        cuts = [0.0]
+        while duration - cuts[-1] > segment_seconds:
+            target = cuts[-1] + segment_seconds
+            quiet = _quietest_point(w, max(target - silence_search, cuts[-1] + 1), target) if silence_search else None
+            cuts.append(quiet or target)
+        cuts.append(duration)
+
+        # 2) 輸出片段 (每段往前多帶 overlap 秒，避免切在字中間漏字)
+        for i in range(len(cuts) - 1):
+            offset = max(cuts[i] - overlap_seconds, 0) if i else 0.0
+            w.setpos(int(offset * rate))
+            frames = w.readframes(int((cuts[i + 1] - offset) * rate))
+            seg_path = workdir / f"{Path(path).stem}_{i:04d}.wav"
+            with wave.open(str(seg_path), "wb") as out:
+                out.setparams(params)
+                out.writeframes(frames)
+            segments.append(Segment(i, seg_path, offset, cuts[i], cuts[i + 1]))
+    return segments
+
+
+def shift_cues(srt_text: str, segment: Segment):
+    """片段 SRT -> 平移到原音檔時間軸，只保留中點落在本片段主要範圍內的字幕"""
+    kept = []
+    for cue in parse_srt(srt_text or ""):
+        cue.start += segment.offset
+        cue.end += segment.offset
+        if segment.core_start <= (cue.start + cue.end) / 2 < segment.core_end:
+            kept.append(cue)
+    return kept
+
+
+def iter_segment_cues(segments: list[Segment], client: AsrClient):
+    """
+    所有片段同時上傳；依片段順序 yield (segment, cues)，前面的片段一完成就交出。
+    上傳用 client 的執行緒池，TXT / SRT 的輪詢則由 client.poller() 全部在這個迴圈裡進行 (各自指數退避)，
+    不會每個片段各佔兩條執行緒等待。
+    """
+    uploads = {seg.index: client.executor.submit(client.create_task, seg.path) for seg in segments}
+    poller = client.poller()
+    ready = {}   # index -> SRT 文字 (逾時但有 TXT 時為 None)
+    next_index = 0
+    try:
+        while next_index < len(segments):
+            # 1) 收上傳結果 (上傳失敗直接拋出)
+            for index, upload in list(uploads.items()):
+                if upload.done():
+                    del uploads[index]
+                    task_id = upload.result()
+                    print("task_id:", task_id)
+                    poller.add(index, task_id)
+
+            # 2) 輪詢到期的任務
+            for index, result in poller.poll():
+                if result.txt is None:
+                    raise TimeoutError(f"片段 {index} 轉錄逾時or錯誤")
+                ready[index] = result.srt  # 只有 SRT 逾時時為 None：這段沒有字幕
+
+            # 3) 依片段順序交出
+            while next_index in ready:
+                seg = segments[next_index]
+                yield seg, shift_cues(ready.pop(next_index), seg)
+                next_index += 1
+
+            # 4) 等到最近一個該輪詢的任務；有上傳完成會提早醒來
+            timeout = poller.next_wait()
+            if uploads:
+                wait(list(uploads.values()), timeout=timeout, return_when=FIRST_COMPLETED)
+            elif next_index < len(segments):
+                time.sleep(timeout)
+    finally:
+        for upload in uploads.values():
+            upload.cancel()
+
+
+def transcribe_long(path, client: AsrClient | None = None, segment_seconds: float = 60,
+                    overlap_seconds: float = 2, silence_search: float = 5, on_piece=None):
+    """
+    分段轉錄整個音檔，回傳 (srt_text, stats)。
+    on_piece(segment, cues) 會在每個片段 (依序) 可用時被呼叫。
+    """
+    own_client = client is None
+    client = client or AsrClient()
+    start = time.perf_counter()
+    segments = split_wav(path, segment_seconds, overlap_seconds, silence_search)
+    workdir = segments[0].path.parent
+    stats = {"segments": len(segments), "split_seconds": time.perf_counter() - start}
+
+    all_cues = []
+    try:
+        for seg, cues in iter_segment_cues(segments, client):
+            if not all_cues and cues:
+                stats["time_to_first_subtitle"] = time.perf_counter() - start
+            all_cues.extend(cues)
+            if on_piece:
+                on_piece(seg, cues)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if own_client:
+            client.close()
+
+    stats["total_seconds"] = time.perf_counter() - start
+    return to_srt(all_cues), stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="長音檔分段平行轉錄")
+    parser.add_argument("wav")
+    parser.add_argument("--segment", type=float, default=60, help="每段長度 (秒)")
+    parser.add_argument("--overlap", type=float, default=2, help="片段間重疊 (秒)")
+    parser.add_argument("--silence-search", type=float, default=5, help="往前找靜音切點的範圍 (秒)，0 = 固定切割")
+    args = parser.parse_args()
+
+    def show(seg, cues):
+        print(f"\n[片段 {seg.index + 1}] {seg.core_start:.1f}s - {seg.core_end:.1f}s, {len(cues)} 句")
+        print(to_srt(cues) if cues else "(無字幕)")
+
+    srt_text, stats = transcribe_long(args.wav, segment_seconds=args.segment,
+                                      overlap_seconds=args.overlap,
+                                      silence_search=args.silence_search, on_piece=show)
+    print(f"\n片段數: {stats['segments']}")
+    if "time_to_first_subtitle" in stats:
+        print(f"第一句字幕: {stats['time_to_first_subtitle']:.1f} 秒")
+    print(f"總耗時: {stats['total_seconds']:.1f} 秒")
@@ -0,0 +1,120 @@
+"""
+本機 ASR stub server：模擬 3090api 的字幕任務 API 與排隊延遲
+
+    python asr_stub_server.py --port 8765 --delay 5 --srt-delay 1
+    ASR_BASE=http://127.0.0.1:8765 python hw_asr.py
+
+- POST /api/v1/subtitle/tasks                     建立任務，回傳 {"id": ...}
+- GET  /api/v1/subtitle/tasks/<id>/subtitle?type=  還沒好回 404，好了回 TXT / SRT
+任務完成時間 = 建立時間 + delay (+ srt-delay)，delay 可加上 ±jitter 秒的隨機量。
+"""
+import argparse
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SAMPLE_SRT = """1
+00:00:00,000 --> 00:00:02,500
+大家好，歡迎收聽本集節目。
+
+2
+00:00:02,500 --> 00:00:05,000
+今天我們要聊的是語音辨識。
+"""
+
+
+class StubState:
+    def __init__(self, delay: float, srt_delay: float, jitter: float):
+        self.delay = delay
+        self.srt_delay = srt_delay
+        self.jitter = jitter
+        self.tasks = {}  # id -> {"ready_at": float, "bytes": int}
+        self.requests = {"create": 0, "poll": 0}
+        self.lock = threading.Lock()
+
+    def create(self, size: int) -> str:
+        task_id = uuid.uuid4().hex[:12]
+        delay = max(self.delay + random.uniform(-self.jitter, self.jitter), 0)
+        with self.lock:
+            self.tasks[task_id] = {"ready_at": time.monotonic() + delay, "bytes": size}
+            self.requests["create"] += 1
+        return task_id
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: str, content_type="text/plain; charset=utf-8"):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if urlparse(self.path).path.rstrip("/") != "/api/v1/subtitle/tasks":
+                return self._send(404, "not found")
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            task_id = state.create(length)
+            self._send(200, f'{{"id": "{task_id}"}}', "application/json")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            m = re.fullmatch(r"/api/v1/subtitle/tasks/([^/]+)/subtitle", url.path)
+            if not m:
+                return self._send(404, "not found")
+            kind = parse_qs(url.query).get("type", ["TXT"])[0].upper()
+            with state.lock:
+                state.requests["poll"] += 1
+                task = state.tasks.get(m.group(1))
+            if task is None:
+                return self._send(404, "no such task")
+            ready_at = task["ready_at"] + (state.srt_delay if kind == "SRT" else 0)
+            if time.monotonic() < ready_at:
+                return self._send(404, "processing")
+            if kind == "SRT":
+                return self._send(200, SAMPLE_SRT)
+            text = "\n".join(line for line in SAMPLE_SRT.splitlines()
+                             if line and not line[0].isdigit())
+            self._send(200, text)
+
+    return Handler
+
+
+def serve(port: int = 8765, delay: float = 5.0, srt_delay: float = 0.0, jitter: float = 0.0):
+    """啟動 stub server (回傳 server, state)，可在測試中以執行緒方式使用"""
+    state = StubState(delay, srt_delay, jitter)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    return server, state
+
+
+def serve_in_thread(**kwargs):
+    server, state = serve(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機 ASR stub server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5.0, help="排隊 + 轉錄延遲 (秒)")
+    parser.add_argument("--srt-delay", type=float, default=0.0, help="SRT 比 TXT 晚多久完成 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲的隨機變動幅度 (秒)")
+    args = parser.parse_args()
+
+    server, _ = serve(args.port, args.delay, args.srt_delay, args.jitter)
+    print(f"ASR stub server: http://127.0.0.1:{args.port} (delay={args.delay}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,18 +1,29 @@
 import json
+import operator
+import os
+import time
+from functools import cache
 from typing import Annotated, TypedDict
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import BaseMessage, HumanMessage
-from langgraph.graph import StateGraph, END, add_messages
-from langgraph.prebuilt import ToolNode
-
-llm = ChatOpenAI(
-    base_url = "https://ws-02.wade0426.me/v1",
-    api_key = "EMPTY",
-    model = "Llama-3.3-70B-Instruct-NVFP4",
-    temperature = 0,
-    max_tokens = 4096
-)
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langgraph.graph import add_messages
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from startup import maybe_show_graph
+from instrumentation import instrument_node
+from tool_fastpath import TurnStats, ToolPolicy, make_after_tools, make_respond_node, make_tools_node
+from memory import MemoryManager, message_tokens
+from order_extract import extract_rules, fill_missing, looks_like_order, missing_fields
+
+llm = lazy_llm("Llama-3.3-70B-Instruct-NVFP4", endpoint="ws-02", temperature=0, max_tokens=4096)
+
+# session 模式：多輪對話共用同一份 State (checkpointer)，由 MemoryManager 控制視窗大小
+SESSION = "--session" in sys.argv or os.getenv("CH5_SESSION") == "1"
+memory = MemoryManager(llm)
+# 先用規則抽訂單欄位，抽齊就不經 LLM，缺的欄位才讓 LLM 補 (order_extract.py)；CH5_PRE_EXTRACT=0 關閉
+PRE_EXTRACT = os.getenv("CH5_PRE_EXTRACT", "1") != "0"
 
 @tool
 def extract_order_data(name: str, phone: str, product: str, quantity: int, address: str):
@@ -22,51 +33,145 @@ def extract_order_data(name: str, phone: str, product: str, quantity: int, addre
     """
     return {"name": name, "phone": phone, "product": product, "quantity": quantity, "address": address}
 
-llm_with_tools = llm.bind_tools([extract_order_data])
+# 提取結果用樣板直接回覆，不必再呼叫一次 LLM 換句話說 (見 tool_fastpath.py)
+TOOL_POLICIES = {
+    "extract_order_data": ToolPolicy(
+        "extract_order_data", mode="template",
+        template="已收到訂單：{name} 訂購 {product} x {quantity}，電話 {phone}，寄送至 {address}。\n{result}",
+    ),
+}
+
+@cache
+def get_llm_with_tools():
+    return llm.bind_tools([extract_order_data])
+
+@cache
+def get_order_extractor():
+    """強制呼叫 extract_order_data，只用來補規則抽不到的欄位"""
+    return llm.bind_tools([extract_order_data], tool_choice="extract_order_data")
 
 class AgentState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
+    llm_calls: Annotated[int, operator.add]
+    summary: str        # session 模式下移出視窗的舊對話摘要 (memory.py)
+    prompt_tokens: int  # 本次送給 LLM 的估計 token 數
 
+@instrument_node(name="agent")
 def call_model(state: AgentState):
-    messages = state["messages"]
-    response = llm_with_tools.invoke(messages)
-    return {"messages": [response]}
+    messages = memory.context(state)
+    response = get_llm_with_tools().invoke(messages)
+    return {"messages": [response], "llm_calls": 1, "prompt_tokens": sum(map(message_tokens, messages))}
 
-tool_node = ToolNode([extract_order_data])
+@instrument_node(name="pre_extract")
+def pre_extract(state: AgentState):
+    """
+    看起來是訂單 (有電話或地址) 就直接產生 extract_order_data 的 tool call，
+    之後走 tools -> respond，整輪不必讓 agent 呼叫 LLM。
+    規則加上 LLM 補欄位後仍有缺的欄位時交給 agent，由它照原本的方式向使用者詢問。
+    """
+    message = state["messages"][-1]
+    if not PRE_EXTRACT or message.type != "human":
+        return {}
+    text = message.content
+    found = extract_rules(text)
+    if not looks_like_order(found):
+        return {}
+    llm_calls = 0
+    if missing_fields(found):
+        found = fill_missing(text, found, get_order_extractor())
+        llm_calls = 1
+        if missing_fields(found):
+            return {"llm_calls": llm_calls}
+    call = {"name": "extract_order_data", "args": found, "id": f"pre_extract_{len(state['messages'])}"}
+    return {"messages": [AIMessage(content="", tool_calls=[call])], "llm_calls": llm_calls}
+
+def after_pre_extract(state: AgentState):
+    return "tools" if getattr(state["messages"][-1], "tool_calls", None) else "agent"
 
 def should_continue(state: AgentState):
+    from langgraph.graph import END
+
     messages = state["messages"]
     last_message = messages[-1]
     if last_message.tool_calls:
         return "tools"
     return END
 
-workflow = StateGraph(AgentState)
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", tool_node)
+@cache
+def get_app(session: bool = SESSION):
+    """第一次使用時才組裝並編譯 Graph；session 模式掛上 checkpointer"""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("memory", instrument_node(memory.compact, name="memory"))
+    workflow.add_node("pre_extract", pre_extract)
+    workflow.add_node("agent", call_model)
+    workflow.add_node("tools", instrument_node(make_tools_node([extract_order_data]), name="tools"))
+    workflow.add_node("respond", instrument_node(make_respond_node(TOOL_POLICIES), name="respond"))
+
+    workflow.set_entry_point("memory")
+    workflow.add_edge("memory", "pre_extract")
+    workflow.add_conditional_edges(
+        "pre_extract",
+        after_pre_extract,
+        {"tools": "tools", "agent": "agent"}
+    )
+
+    workflow.add_conditional_edges(
+        "agent",
+        should_continue,
+        {"tools": "tools", END: END}
+    )
+    workflow.add_conditional_edges(
+        "tools",
+        make_after_tools(TOOL_POLICIES),
+        {"respond": "respond", "agent": "agent"}
+    )
+    workflow.add_edge("respond", END)
+
+    if session:
+        from langgraph.checkpoint.memory import MemorySaver
 
-workflow.set_entry_point("agent")
+        return workflow.compile(checkpointer=MemorySaver())
+    return workflow.compile()
 
-workflow.add_conditional_edges(
-    "agent",
-    should_continue,
-    {"tools": "tools", END: END}
-)
-workflow.add_edge("tools", "agent")
+def stream_turn(user_input: str, config=None) -> tuple[int, int]:
+    """CLI 的一輪對話：逐節點印出更新，回傳 (LLM 呼叫次數, 最大 prompt tokens)"""
+    llm_calls = prompt_tokens = 0
+    for event in get_app().stream({"messages": [HumanMessage(content=user_input)]}, config):
+        for key, value in event.items():
+            if not value:  # memory 節點沒有壓縮時不會更新 State
+                continue
+            llm_calls += value.get("llm_calls", 0)
+            prompt_tokens = max(prompt_tokens, value.get("prompt_tokens", 0))
+            if "messages" not in value:  # pre_extract 補不齊欄位時只回報 llm_calls，交給 agent
+                continue
+            print(f"\n-- Node: {key} --")
+            if key == "memory":
+                print(f"已將 {len(value['messages'])} 則舊訊息併入摘要")
+                continue
+            last_msg = value["messages"][-1]
+            print(last_msg.content or last_msg.tool_calls)
+    return llm_calls, prompt_tokens
 
-app = workflow.compile()
-print(app.get_graph().draw_ascii())
+if __name__ == "__main__":
+    prewarm("ws-02")
+    maybe_show_graph(get_app)
+    print("工具回應模式:", {name: policy.mode for name, policy in TOOL_POLICIES.items()})
+    stats = TurnStats("ch5_1")
+    config = {"configurable": {"thread_id": "cli"}} if SESSION else None
+    if SESSION:
+        print(f"Session 模式：近期訊息上限約 {memory.budget} tokens，較舊的對話併入摘要")
 
-while True:
-    try:
-        user_input = input("User: ")
-        if user_input.lower() == "exit":
+    while True:
+        try:
+            user_input = input("User: ")
+            if user_input.lower() == "exit":
+                break
+            start = time.perf_counter()
+            llm_calls, prompt_tokens = stream_turn(user_input, config)
+            stats.record(llm_calls, time.perf_counter() - start, prompt_tokens)
+        except Exception as e:
+            print(f"Error: {e}")
             break
-        for event in app.stream({"messages": [HumanMessage(content=user_input)]}):
-            for key, value in event.items():
-                print(f"\n-- Node: {key} --")
-                last_msg = value["messages"][-1]
-                print(last_msg.content or last_msg.tool_calls)
-    except Exception as e:
-        print(f"Error: {e}")
-        break
\ No newline at end of file
+    stats.summary()
@@ -1,19 +1,27 @@
 import json
+import operator
+import os
+import time
+from functools import cache
 from typing import Annotated, TypedDict, Literal
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage
-from langgraph.graph import StateGraph, END, add_messages
-from langgraph.prebuilt import ToolNode
-
-# 1. 設定模型 (LLM)
-llm = ChatOpenAI(
-    base_url="https://ws-02.wade0426.me/v1",
-    api_key="EMPTY",
-    model="Llama-3.3-70B-Instruct-NVFP4",
-    temperature=0,
-    max_tokens=4096
-)
+from langgraph.graph import add_messages
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from startup import maybe_show_graph
+from instrumentation import instrument_node
+from tool_fastpath import TurnStats, ToolPolicy, make_after_tools, make_respond_node, make_tools_node
+from memory import MemoryManager, message_tokens
+
+# 1. 設定模型 (LLM) —— 第一次呼叫才建立
+llm = lazy_llm("Llama-3.3-70B-Instruct-NVFP4", endpoint="ws-02", temperature=0, max_tokens=4096)
+
+# session 模式：多輪對話共用同一份 State (checkpointer)，由 MemoryManager 控制視窗大小
+SESSION = "--session" in sys.argv or os.getenv("CH5_SESSION") == "1"
+memory = MemoryManager(llm)
 
 # 2. 定義工具 (Tools)
 @tool
@@ -29,21 +37,32 @@ def get_weather(city: str):
         return "資料庫沒有這個城市的資料"
 
 tools = [get_weather]
-llm_with_tools = llm.bind_tools(tools)
+
+# 天氣查詢結果本身就是答案，套樣板直接回覆 (見 tool_fastpath.py)
+TOOL_POLICIES = {
+    "get_weather": ToolPolicy("get_weather", mode="template", template="{city}：{result}"),
+}
+
+@cache
+def get_llm_with_tools():
+    return llm.bind_tools(tools)
 
 class AgentState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
+    llm_calls: Annotated[int, operator.add]
+    summary: str        # session 模式下移出視窗的舊對話摘要 (memory.py)
+    prompt_tokens: int  # 本次送給 LLM 的估計 token 數
 
 # ================= 3. 定義節點 (Nodes) =================
+@instrument_node(name="agent")
 def chatbot_node(state: AgentState):
     """思考節點：負責呼叫 LLM"""
-    # 傳入目前的對話紀錄，LLM 決定要回話還是呼叫工具
-    response = llm_with_tools.invoke(state["messages"])
-    
-    # 回傳的 dict 會自動合併進 State
-    return {"messages": [response]}
+    # 傳入摘要 + 近期對話紀錄，LLM 決定要回話還是呼叫工具
+    messages = memory.context(state)
+    response = get_llm_with_tools().invoke(messages)
 
-tool_node_executor = ToolNode(tools)
+    # 回傳的 dict 會自動合併進 State
+    return {"messages": [response], "llm_calls": 1, "prompt_tokens": sum(map(message_tokens, messages))}
 
 # ================= 4. 定義邊 (Edges & Router) =================
 def router(state: AgentState) -> Literal["tools", "end"]:
@@ -58,48 +77,83 @@ def router(state: AgentState) -> Literal["tools", "end"]:
         return "end"
 
 # ================= 5. 組裝 Graph =================
-workflow = StateGraph(AgentState)
+@cache
+def get_app(session: bool = SESSION):
+    """第一次使用時才組裝並編譯 Graph；session 模式掛上 checkpointer"""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(AgentState)
 
-# (1) 加入節點
-workflow.add_node("agent", chatbot_node)
-workflow.add_node("tools", tool_node_executor)
+    # (1) 加入節點
+    workflow.add_node("memory", instrument_node(memory.compact, name="memory"))
+    workflow.add_node("agent", chatbot_node)
+    # 同一輪多個 tool_calls 同時執行
+    workflow.add_node("tools", instrument_node(make_tools_node(tools), name="tools"))
+    workflow.add_node("respond", instrument_node(make_respond_node(TOOL_POLICIES), name="respond"))
 
-# (2) 設定入口
-workflow.set_entry_point("agent")
+    # (2) 設定入口：先整理記憶 (超過預算才摘要) 再交給 Agent
+    workflow.set_entry_point("memory")
+    workflow.add_edge("memory", "agent")
 
-# (3) 設定條件邊 (Conditional Edge)
-workflow.add_conditional_edges(
-    "agent",       # 從 agent 出發
-    router,        # 經過 router 判斷
-    {
-        "tools": "tools",  # 如果 router 回傳 "tools", 走向 tools 節點
-        "end": END         # 如果 router 回傳 "end", 走向結束
-    }
-)
+    # (3) 設定條件邊 (Conditional Edge)
+    workflow.add_conditional_edges(
+        "agent",       # 從 agent 出發
+        router,        # 經過 router 判斷
+        {
+            "tools": "tools",  # 如果 router 回傳 "tools", 走向 tools 節點
+            "end": END         # 如果 router 回傳 "end", 走向結束
+        }
+    )
 
-# (4) 設定一般邊 (Edge) - 工具執行完後回到 Agent
-workflow.add_edge("tools", "agent")
+    # (4) 工具執行完：全部工具都能直接回覆就結束，否則回到 Agent
+    workflow.add_conditional_edges(
+        "tools",
+        make_after_tools(TOOL_POLICIES),
+        {"respond": "respond", "agent": "agent"}
+    )
+    workflow.add_edge("respond", END)
 
-# (5) 編譯
-app = workflow.compile()
-print(app.get_graph().draw_ascii())
+    # (5) 編譯
+    if session:
+        from langgraph.checkpoint.memory import MemorySaver
+
+        return workflow.compile(checkpointer=MemorySaver())
+    return workflow.compile()
 
 # ================= 6. 執行 =================
 if __name__ == "__main__":
+    prewarm("ws-02")
+    maybe_show_graph(get_app)
+    print("工具回應模式:", {name: policy.mode for name, policy in TOOL_POLICIES.items()})
+    stats = TurnStats("ch5_2")
+    config = {"configurable": {"thread_id": "cli"}} if SESSION else None
+    if SESSION:
+        print(f"Session 模式：近期訊息上限約 {memory.budget} tokens，較舊的對話併入摘要")
     while True:
         try:
             user_input = input("User: ")
             if user_input.lower() in ["exit", "quit"]:
                 break
-            
-            for event in app.stream({"messages": [HumanMessage(content=user_input)]}):
+
+            start = time.perf_counter()
+            llm_calls = prompt_tokens = 0
+            for event in get_app().stream({"messages": [HumanMessage(content=user_input)]}, config):
                 for key, value in event.items():
+                    if not value:  # memory 節點沒有壓縮時不會更新 State
+                        continue
                     print(f"\n-- Node: {key} --")
+                    if key == "memory":
+                        print(f"已將 {len(value['messages'])} 則舊訊息併入摘要")
+                        continue
                     last_msg = value["messages"][-1]
                     to_print = last_msg.content or str(last_msg.tool_calls)
                     try:
                         print(to_print)
                     except UnicodeEncodeError:
                         print(to_print.encode('utf-8', 'replace').decode('utf-8'))
+                    llm_calls += value.get("llm_calls", 0)
+                    prompt_tokens = max(prompt_tokens, value.get("prompt_tokens", 0))
+            stats.record(llm_calls, time.perf_counter() - start, prompt_tokens)
         except Exception as e:
             print(f"Error: {e}")
+    stats.summary()
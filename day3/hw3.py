@@ -1,77 +1,210 @@
+import os
 import json
+import time
+import asyncio
+import operator
+from functools import cache
 from typing import Annotated, TypedDict
-from langchain_core.messages import BaseMessage
-from langgraph.graph import StateGraph, END, add_messages
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-
-# Import the provided ASR tool
-import hw_asr
-
-# 1. 設定模型 (LLM)
-llm = ChatOpenAI(
-    base_url="https://ws-02.wade0426.me/v1",
-    api_key="EMPTY",
-    model="Llama-3.3-70B-Instruct-NVFP4",
-    temperature=0,
-    max_tokens=4096
-)
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from startup import maybe_show_graph
+from instrumentation import instrument_node, record_cache
+from map_reduce import WindowCache, map_reduce
+from srt import CueList, format_timestamp, parse_srt, to_srt, window_cues
+
+# 1. 設定模型 (LLM) —— 第一次呼叫才建立
+llm = lazy_llm("Llama-3.3-70B-Instruct-NVFP4", endpoint="ws-02", temperature=0, max_tokens=4096)
+
+# Map-Reduce 模式：長逐字稿依時間視窗切段，分段摘要再合併
+# --map-reduce 強制開啟；否則逐字稿超過門檻字數時自動開啟
+MAP_REDUCE = "--map-reduce" in sys.argv or os.getenv("HW3_MAP_REDUCE") == "1"
+MAP_REDUCE_THRESHOLD = int(os.getenv("HW3_MAP_REDUCE_THRESHOLD", "12000"))
+WINDOW_SECONDS = float(os.getenv("HW3_WINDOW_SECONDS", "300"))
+MAX_CONCURRENCY = int(os.getenv("HW3_MAX_CONCURRENCY", "4"))  # 每個分支同時送出的請求上限
+REDUCE_FAN_IN = int(os.getenv("HW3_REDUCE_FAN_IN", "4"))
+WINDOW_CACHE_FILE = "out/hw3_window_cache.jsonl"
+# 串流模式：ASR 邊轉錄邊把 cue 交給下游，摘要從最早完成的時間視窗開始 (隱含 map-reduce)
+STREAM = "--stream" in sys.argv or os.getenv("HW3_STREAM") == "1"
 
 # 2. 定義 State (狀態)
 class AgentState(TypedDict):
-    # transcript: 原始逐字稿 (SRT format)
+    # transcript: 外部提供的原始逐字稿 (SRT format，批次模式用)；ASR 節點會解析成 cues
     transcript: str
+    # cues: 解析後的逐字稿 (array-backed CueList，節點間只傳參考，不重複解析)
+    cues: CueList
+    # stream: 串流模式下仍在產生中的逐字稿 (TranscriptStream)，否則為 None
+    stream: object
     # detailed_notes: 詳細的逐字稿 (時間軸+台詞)
     detailed_notes: str
     # summary: 重點摘要
     summary: str
     # final_output: 最終合併結果
     final_output: str
+    # timings: 各節點耗時 (秒)，平行分支各自寫入後合併
+    timings: Annotated[dict, operator.or_]
+
+# 兩個分支共用同一段開頭 (逐字稿放最前面)，只有最後的指示不同，
+# 讓 server 端的 prefix caching 可以重用逐字稿那段的 KV cache
+TRANSCRIPT_PREFIX = "以下是一段會議/Podcast 的逐字稿 (SRT 格式)：\n\n{transcript}"
+
+MINUTES_INSTRUCTION = "你是一位專業的會議記錄員。請將上述逐字稿整理成詳細的記錄，需要按時間軸與對應台詞逐一列出。"
+SUMMARY_INSTRUCTION = "你是一位專業的重點分析師。請閱讀上述逐字稿，整理出精簡的重點摘要。"
+
+@cache
+def get_chains():
+    """預先建好 (並重用) 兩個分支的 chain，不必每次呼叫節點都重建"""
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+
+    def build(instruction):
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", TRANSCRIPT_PREFIX),
+            ("user", instruction)
+        ])
+        return prompt | llm.get() | StrOutputParser()
+
+    reduce_prompt = ChatPromptTemplate.from_messages([
+        ("system", "你是一位專業的重點分析師。"),
+        ("user", "以下是同一段逐字稿各時段的重點摘要，請合併成一份精簡的重點摘要，去除重複的內容:\n\n{parts}")
+    ])
+    return {
+        "minutes_taker": build(MINUTES_INSTRUCTION),
+        "summarizer": build(SUMMARY_INSTRUCTION),
+        "summarizer_reduce": reduce_prompt | llm.get() | StrOutputParser(),
+    }
+
+@cache
+def get_window_cache():
+    return WindowCache(WINDOW_CACHE_FILE)
+
+def use_map_reduce(state: AgentState) -> bool:
+    return MAP_REDUCE or state.get("stream") is not None or state["cues"].char_count > MAP_REDUCE_THRESHOLD
+
+async def run_map_reduce(node: str, state: AgentState, reduce_chain=None) -> str:
+    """把逐字稿切成時間視窗後做 map-reduce，每個視窗完成就先印出來"""
+    stream = state.get("stream")
+    labels = []
+
+    async def windows():
+        # 串流模式：視窗一完整就交出；否則直接從 CueList 切
+        source = stream.windows(WINDOW_SECONDS) if stream is not None else _aiter(window_cues(state["cues"], WINDOW_SECONDS))
+        async for window in source:
+            labels.append(f"{format_timestamp(window.start)} - {format_timestamp(window.end)}")
+            yield window.to_srt()
+
+    print(f"[{node}] Map-Reduce: 每段 {WINDOW_SECONDS:.0f} 秒, 並行 {MAX_CONCURRENCY}{' (串流)' if stream else ''}")
+
+    def on_partial(i, total, text):
+        print(f"\n[{node}] 視窗 {i + 1} ({labels[i]}) 完成:\n{text}")
+
+    cache = get_window_cache()
+    hits, misses = cache.hits, cache.misses
+    result = await map_reduce(
+        windows(),
+        get_chains()[node],
+        reduce_chain,
+        kind=node,
+        max_concurrency=MAX_CONCURRENCY,
+        fan_in=REDUCE_FAN_IN,
+        cache=cache,
+        on_partial=on_partial,
+    )
+    print(f"[{node}] {len(labels)} 個視窗, 快取命中 {cache.hits - hits} / 未命中 {cache.misses - misses}")
+    record_cache("window", True, cache.hits - hits)
+    record_cache("window", False, cache.misses - misses)
+    return result
+
+async def _aiter(items):
+    for item in items:
+        yield item
 
 # 3. 定義節點 (Nodes)
 
-def asr_node(state: AgentState):
+@instrument_node
+async def asr_node(state: AgentState):
     """
-    ASR 節點: 呼叫 hw_asr.main() 取得轉錄結果
+    ASR 節點: 呼叫 hw_asr 取得轉錄結果並解析成 CueList
     """
+    # Import the provided ASR tool (用到才載入)
+    import hw_asr
+
+    if state.get("transcript"):
+        # 批次模式：逐字稿已由 asr_batch 提供，不再呼叫 ASR
+        print("\n[Node] ASR Skipped (transcript provided)")
+        return {"cues": parse_srt(state["transcript"]), "stream": None}
+
     print("\n[Node] ASR Running...")
+    start = time.perf_counter()
+    # 先查內容 hash 快取，同一個音檔不必再上傳/轉錄
+    digest = await asyncio.to_thread(hw_asr.audio_hash, hw_asr.WAV_PATH)
+    cached = hw_asr.load_cached(digest)
+    record_cache("asr", cached is not None)
+    if cached is not None:
+        print(f"[Node] ASR 快取命中 ({digest[:12]})")
+        return {"cues": parse_srt(cached.srt), "stream": None,
+                "timings": {"asr": time.perf_counter() - start}}
+
+    if STREAM:
+        # 轉錄在背景執行緒進行，這個節點立即返回，下游邊收 cue 邊處理
+        from transcript_stream import TranscriptStream
+
+        stream = TranscriptStream()
+
+        def produce():
+            try:
+                if hw_asr.is_long_wav(hw_asr.WAV_PATH):
+                    hw_asr.transcribe_segmented(
+                        hw_asr.WAV_PATH, digest,
+                        on_piece=lambda seg, cues: stream.feed(to_srt(cues) + "\n"),
+                    )
+                else:
+                    stream.feed(hw_asr.main(use_cache=False, digest=digest) or "")
+                stream.close()
+            except Exception as e:
+                stream.close(e)
+
+        stream.task = asyncio.create_task(asyncio.to_thread(produce))
+        return {"cues": stream.cues, "stream": stream}
+
     # hw_asr.main() returns the SRT text string
-    srt_text = hw_asr.main()
-    return {"transcript": srt_text}
+    srt_text = await asyncio.to_thread(hw_asr.main, use_cache=False, digest=digest)
+    return {"cues": parse_srt(srt_text or ""), "stream": None,
+            "timings": {"asr": time.perf_counter() - start}}
 
-def minutes_taker_node(state: AgentState):
+@instrument_node
+async def minutes_taker_node(state: AgentState):
     """
     Minutes Taker 節點: 整理詳細逐字稿
     """
     print("\n[Node] Minutes Taker Running...")
-    transcript = state["transcript"]
+    chain = get_chains()["minutes_taker"]
+    start = time.perf_counter()
+    if use_map_reduce(state):
+        # 詳細記錄不需要再濃縮，各視窗結果依時間順序串接
+        result = await run_map_reduce("minutes_taker", state)
+    else:
+        result = await chain.ainvoke({"transcript": state["cues"].to_srt()})
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "你是一位專業的會議記錄員。"),
-        ("user", "請將以下逐字稿(SRT格式)整理成詳細的記錄，需要按時間軸與對應台詞逐一列出:\n\n{transcript}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    result = chain.invoke({"transcript": transcript})
-    
-    return {"detailed_notes": result}
+    return {"detailed_notes": result, "timings": {"minutes_taker": time.perf_counter() - start}}
 
-def summarizer_node(state: AgentState):
+@instrument_node
+async def summarizer_node(state: AgentState):
     """
     Summarizer 節點: 整理重點摘要
     """
     print("\n[Node] Summarizer Running...")
-    transcript = state["transcript"]
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "你是一位專業的重點分析師。"),
-        ("user", "請閱讀以下逐字稿，整理出精簡的重點摘要:\n\n{transcript}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    result = chain.invoke({"transcript": transcript})
+    chains = get_chains()
+    start = time.perf_counter()
+    if use_map_reduce(state):
+        result = await run_map_reduce("summarizer", state, chains["summarizer_reduce"])
+    else:
+        result = await chains["summarizer"].ainvoke({"transcript": state["cues"].to_srt()})
     
-    return {"summary": result}
+    return {"summary": result, "timings": {"summarizer": time.perf_counter() - start}}
 
+@instrument_node
 def writer_node(state: AgentState):
     """
     Writer 節點: 合併結果
@@ -79,6 +212,15 @@ def writer_node(state: AgentState):
     print("\n[Node] Writer Running...")
     detailed_notes = state["detailed_notes"]
     summary = state["summary"]
+
+    timings = dict(state.get("timings", {}))
+    if state.get("stream") is not None and state["stream"].elapsed is not None:
+        timings["asr (串流, 與摘要重疊)"] = state["stream"].elapsed
+    branches = [timings[k] for k in ("minutes_taker", "summarizer") if k in timings]
+    if branches:
+        for name, seconds in timings.items():
+            print(f"  {name}: {seconds:.2f} 秒")
+        print(f"  平行分支耗時: {max(branches):.2f} 秒 (若循序執行為 {sum(branches):.2f} 秒)")
     
     final_report = f"""
 # 會議/Podcast 轉錄報告
@@ -93,40 +235,91 @@ def writer_node(state: AgentState):
     """
     return {"final_output": final_report}
 
-# 4. 組裝 Graph
-workflow = StateGraph(AgentState)
+# 4. 組裝 Graph (第一次使用時才編譯)
+@cache
+def get_app():
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(AgentState)
 
-# 加入節點
-workflow.add_node("asr", asr_node)
-workflow.add_node("minutes_taker", minutes_taker_node)
-workflow.add_node("summarizer", summarizer_node)
-workflow.add_node("writer", writer_node)
+    # 加入節點
+    workflow.add_node("asr", asr_node)
+    workflow.add_node("minutes_taker", minutes_taker_node)
+    workflow.add_node("summarizer", summarizer_node)
+    workflow.add_node("writer", writer_node)
 
-# 設定入口
-workflow.set_entry_point("asr")
+    # 設定入口
+    workflow.set_entry_point("asr")
 
-# 設定邊(Edges)
-# ASR 完成後，同時進行 Minutes Taker 和 Summarizer (平行)
-workflow.add_edge("asr", "minutes_taker")
-workflow.add_edge("asr", "summarizer")
+    # 設定邊(Edges)
+    # ASR 完成後，同時進行 Minutes Taker 和 Summarizer (平行)
+    workflow.add_edge("asr", "minutes_taker")
+    workflow.add_edge("asr", "summarizer")
 
-# 兩者都完成後，匯聚到 Writer
-workflow.add_edge("minutes_taker", "writer")
-workflow.add_edge("summarizer", "writer")
+    # 兩者都完成後，匯聚到 Writer (兩個分支都是 async 節點，會在同一個 event loop 上並行)
+    workflow.add_edge("minutes_taker", "writer")
+    workflow.add_edge("summarizer", "writer")
 
-# Writer 完成後結束
-workflow.add_edge("writer", END)
+    # Writer 完成後結束
+    workflow.add_edge("writer", END)
 
-# 編譯
-app = workflow.compile()
-print(app.get_graph().draw_ascii())
+    # 編譯
+    return workflow.compile()
 
 # 5. 執行
+async def run_batch(source: str):
+    """
+    批次模式：asr_batch 每完成一個音檔就立刻送進 Graph，
+    ASR 輪詢 (背景執行緒) 與 LLM 摘要同時進行，報告存成 out/<檔名>_<內容 hash>_report.md
+    """
+    import asr_batch
+    from hw_asr import audio_hash
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Queue()
+
+    def pump():
+        # generator 內含阻塞的輪詢，放在執行緒裡跑，完成一筆就丟進 queue
+        try:
+            for path, asr_result in asr_batch.iter_transcripts(source):
+                stem = asr_batch.output_stem(path, audio_hash(path))  # 與 ASR 輸出同名，同名音檔不會互相覆蓋
+                loop.call_soon_threadsafe(ready.put_nowait, (path, asr_result, stem))
+        finally:
+            loop.call_soon_threadsafe(ready.put_nowait, None)
+
+    async def process(path, asr_result, stem):
+        print(f"\n[batch] 開始處理 {path.name}")
+        result = await get_app().ainvoke({"transcript": asr_result.srt, "timings": {}})
+        report_path = Path("out") / f"{stem}_report.md"
+        report_path.write_text(result["final_output"], encoding="utf-8")
+        print(f"[batch] 報告已存: {report_path}")
+
+    producer = asyncio.create_task(asyncio.to_thread(pump))
+    tasks = []
+    while (item := await ready.get()) is not None:
+        path, asr_result, stem = item
+        if not asr_result.srt:
+            print(f"[batch] {path.name} 沒有 SRT，略過")
+            continue
+        tasks.append(asyncio.create_task(process(path, asr_result, stem)))
+    await producer
+    await asyncio.gather(*tasks)
+
 if __name__ == "__main__":
+    maybe_show_graph(get_app)
+    # ASR 需要時間，趁這段時間先把 LLM 連線建好
+    prewarm("ws-02")
+    get_chains()
     try:
         print("Starting Pipeline...")
+        if "--batch" in sys.argv:
+            # python hw3.py --batch <音檔資料夾或清單檔>
+            asyncio.run(run_batch(sys.argv[sys.argv.index("--batch") + 1]))
+            sys.exit(0)
         # 初始狀態為空，ASR 會自己去 fetch 資料
-        result = app.invoke({"transcript": ""})
+        start = time.perf_counter()
+        result = asyncio.run(get_app().ainvoke({"transcript": "", "timings": {}}))
+        print(f"\n[Pipeline] 總耗時: {time.perf_counter() - start:.2f} 秒")
         
         print("\n\n" + "="*30)
         print("FINAL OUTPUT")
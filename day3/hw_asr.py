@@ -1,55 +1,342 @@
+import os
 import time
-import requests
+import hashlib
+import random
+import asyncio
+import threading
+import uuid
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
-BASE = "https://3090api.huannago.com"
-CREATE_URL = f"{BASE}/api/v1/subtitle/tasks"
+import requests
+from requests.adapters import HTTPAdapter
+
+from srt import parse_srt
+
+# ASR_BASE 可指向本機 stub server (asr_stub_server.py) 做測試
+BASE = os.getenv("ASR_BASE", "https://3090api.huannago.com")
 WAV_PATH = "Podcast_EP14_30s.wav" # 請更改為測試音檔路徑
 auth = ("nutc2504", "nutc2504")
 
 out_dir = Path("./out")
-out_dir.mkdir(exist_ok=True)
-
-# 1) 建立任務
-with open(WAV_PATH, "rb") as f:
-    r = requests.post(CREATE_URL, files={"audio": f}, timeout=60, auth=auth)
-r.raise_for_status()
-task_id = r.json()["id"]
-print("task_id:", task_id)
-print("等待轉文字...")
-txt_url = f"{BASE}/api/v1/subtitle/tasks/{task_id}/subtitle?type=TXT" 
-srt_url = f"{BASE}/api/v1/subtitle/tasks/{task_id}/subtitle?type=SRT"
-
-def wait_download(url: str, max_tries=600):  # 等下載完成
-    for _ in range(max_tries):
+
+# ASR 結果快取：以音檔內容的 SHA-256 為 key，存成 out/cache/<hash>.txt / .srt
+CACHE_DIR = out_dir / "cache"
+
+# 超過這個長度 (秒) 的 WAV 改走分段平行轉錄 (asr_segment.py)；0 = 停用
+SEGMENT_THRESHOLD = float(os.getenv("ASR_SEGMENT_THRESHOLD", "300"))
+SEGMENT_SECONDS = float(os.getenv("ASR_SEGMENT_SECONDS", "60"))
+
+
+class MultipartFile:
+    """
+    multipart/form-data 的串流 body：邊讀檔邊送出，不必把整個音檔載入記憶體。
+    有 __len__，requests 會帶 Content-Length 並逐塊送出。
+    """
+
+    def __init__(self, path, field: str = "audio", chunk_size: int = 256 * 1024):
+        boundary = uuid.uuid4().hex
+        self.path = path
+        self.chunk_size = chunk_size
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{Path(path).name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.size = os.path.getsize(path)
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        with open(self.path, "rb") as f:
+            while chunk := f.read(self.chunk_size):
+                yield chunk
+        yield self.tail
+
+
+@dataclass
+class AsrResult:
+    task_id: str
+    txt: str | None
+    srt: str | None
+
+
+class AsrClient:
+    """
+    ASR 任務客戶端
+    - 共用一個 requests.Session (keep-alive 連線池)
+    - 輪詢採指數退避 + 隨機抖動，不再固定每 2 秒打一次
+    - TXT 與 SRT 同時輪詢，完成時以 Future 通知 (也可 await)
+    """
+
+    def __init__(self, base: str = BASE, auth=auth, pool_size: int = 8,
+                 initial_delay: float = 0.5, max_delay: float = 10.0,
+                 backoff: float = 1.6, jitter: float = 0.3,
+                 wait_timeout: float = 1200.0, upload_timeout: float = 60.0):
+        self.base = base.rstrip("/")
+        self.create_url = f"{self.base}/api/v1/subtitle/tasks"
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.wait_timeout = wait_timeout
+        self.upload_timeout = upload_timeout
+
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="asr")
+        self._stopped = threading.Event()
+
+    # ---------- 基本操作 ----------
+    def create_task(self, wav_path) -> str:
+        """1) 串流上傳音檔建立任務，回傳 task_id (timeout 是每次讀寫的上限，不是整體上傳時間)"""
+        body = MultipartFile(wav_path)
+        r = self.session.post(self.create_url, data=body, headers={"Content-Type": body.content_type},
+                              timeout=(5, self.upload_timeout))
+        r.raise_for_status()
+        return r.json()["id"]
+
+    def subtitle_url(self, task_id: str, kind: str) -> str:
+        return f"{self.base}/api/v1/subtitle/tasks/{task_id}/subtitle?type={kind}"
+
+    def next_delay(self, delay: float) -> float:
+        return min(delay * self.backoff, self.max_delay)
+
+    def jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _sleep(self, delay: float) -> bool:
+        """睡 delay (含抖動)；若 client 已關閉則提早回傳 False"""
+        return not self._stopped.wait(self.jittered(delay))
+
+    def fetch_once(self, url: str) -> str | None:
+        """打一次字幕 URL：完成回傳文字，還沒好 (通常 404) 或連線逾時回傳 None"""
         try:
-            resp = requests.get(url, timeout=(5, 60), auth=auth)
+            resp = self.session.get(url, timeout=(5, 60))
             if resp.status_code == 200:
                 return resp.text
-            # 還沒好通常 404
-        except requests.exceptions.ReadTimeout:
+        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
             pass
-        time.sleep(2)
-    return None
-def main():
-    # 2) 等 TXT(純文字)
-    txt_text = wait_download(txt_url, max_tries=600)
-    if txt_text is None:
-        raise TimeoutError("轉錄逾時or錯誤")
-        
-    # 3) 等 SRT(有時間軸+文字)
-    srt_text = wait_download(srt_url, max_tries=600)
+        return None
+
+    def wait_download(self, url: str, timeout: float | None = None) -> str | None:
+        """等下載完成：以指數退避重試 fetch_once 直到逾時"""
+        deadline = time.monotonic() + (timeout or self.wait_timeout)
+        delay = self.initial_delay
+        while time.monotonic() < deadline:
+            text = self.fetch_once(url)
+            if text is not None:
+                return text
+            if not self._sleep(min(delay, max(deadline - time.monotonic(), 0))):
+                return None
+            delay = self.next_delay(delay)
+        return None
+
+    # ---------- Future / async 介面 ----------
+    def result_future(self, task_id: str) -> Future:
+        """同時輪詢 TXT 與 SRT，兩者都結束時完成的 Future[AsrResult]"""
+        txt_future = self.executor.submit(self.wait_download, self.subtitle_url(task_id, "TXT"))
+        srt_future = self.executor.submit(self.wait_download, self.subtitle_url(task_id, "SRT"))
+        combined = Future()
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                if combined.done() or not (txt_future.done() and srt_future.done()):
+                    return
+                for f in (txt_future, srt_future):
+                    if f.exception() is not None:
+                        combined.set_exception(f.exception())
+                        return
+                if txt_future.result() is None:
+                    combined.set_exception(TimeoutError("轉錄逾時or錯誤"))
+                    return
+                combined.set_result(AsrResult(task_id, txt_future.result(), srt_future.result()))
+
+        txt_future.add_done_callback(on_done)
+        srt_future.add_done_callback(on_done)
+        return combined
+
+    def submit(self, wav_path) -> Future:
+        """上傳 + 等待結果，整段包成一個 Future[AsrResult]"""
+        outer = Future()
+
+        def chain(upload: Future):
+            try:
+                task_id = upload.result()
+            except Exception as e:
+                outer.set_exception(e)
+                return
+            print("task_id:", task_id)
+            inner = self.result_future(task_id)
+            inner.add_done_callback(
+                lambda f: outer.set_exception(f.exception()) if f.exception() else outer.set_result(f.result())
+            )
+
+        self.executor.submit(self.create_task, wav_path).add_done_callback(chain)
+        return outer
+
+    async def transcribe(self, wav_path) -> AsrResult:
+        """async 版本：await client.transcribe(path)"""
+        return await asyncio.wrap_future(self.submit(wav_path))
+
+    def poller(self) -> "TaskPoller":
+        """多任務輪詢器：大量任務在呼叫端的同一個迴圈裡輪詢 (asr_batch / asr_segment 用)"""
+        return TaskPoller(self)
+
+    def close(self):
+        self._stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+class TaskPoller:
+    """
+    多個任務在同一個迴圈裡輪詢 TXT / SRT，各自指數退避，不必一個任務佔一條執行緒。
+    每次 GET 丟到 client.executor 執行，某個任務的請求卡住 (讀取逾時 60 秒) 也不會拖住其他任務。
+    呼叫端的迴圈：add() 加入任務 -> poll() 取回已結束的任務 -> 等 next_wait() 秒再 poll
+    """
+
+    def __init__(self, client: AsrClient, check_interval: float = 0.05):
+        self.client = client
+        self.check_interval = check_interval  # 有請求在路上時，多久回來看一次結果
+        self.jobs = {}  # key -> {"task_id", "txt", "srt", "fetching", "delay", "next_at", "deadline"}
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, key, task_id: str):
+        now = time.monotonic()
+        self.jobs[key] = {"task_id": task_id, "txt": None, "srt": None, "fetching": {},
+                          "delay": self.client.initial_delay, "next_at": now + self.client.initial_delay,
+                          "deadline": now + self.client.wait_timeout}
+
+    def next_wait(self, idle: float = 0.5) -> float:
+        """距離最近一個該輪詢的任務 (或在路上的請求) 還有幾秒；沒有任務時回傳 idle"""
+        now = time.monotonic()
+        next_at = min((now + self.check_interval if job["fetching"] else job["next_at"]
+                       for job in self.jobs.values()), default=now + idle)
+        return max(next_at - now, 0)
+
+    def poll(self) -> list[tuple]:
+        """
+        送出到期任務的請求、收回已完成的請求，回傳這一輪結束的 [(key, AsrResult)]。
+        逾時的任務也會交出：srt 為 None 表示 SRT 沒等到，txt 也是 None 表示整個任務逾時or錯誤
+        """
+        finished = []
+        now = time.monotonic()
+        for key, job in list(self.jobs.items()):
+            if not job["fetching"]:
+                if job["next_at"] <= now:
+                    job["fetching"] = {
+                        kind: self.client.executor.submit(
+                            self.client.fetch_once, self.client.subtitle_url(job["task_id"], kind.upper()))
+                        for kind in ("txt", "srt") if job[kind] is None
+                    }
+                continue
+            if not all(f.done() for f in job["fetching"].values()):
+                continue
+            for kind, f in job["fetching"].items():
+                job[kind] = f.result()
+            job["fetching"] = {}
+            if (job["txt"] is not None and job["srt"] is not None) or time.monotonic() > job["deadline"]:
+                del self.jobs[key]
+                finished.append((key, AsrResult(job["task_id"], job["txt"], job["srt"])))
+            else:
+                job["delay"] = self.client.next_delay(job["delay"])
+                job["next_at"] = time.monotonic() + self.client.jittered(job["delay"])
+        return finished
+
+
+def is_long_wav(path) -> bool:
+    if not SEGMENT_THRESHOLD or not str(path).lower().endswith(".wav"):
+        return False
+    try:
+        with wave.open(str(path), "rb") as w:
+            return w.getnframes() / w.getframerate() > SEGMENT_THRESHOLD
+    except (wave.Error, OSError):
+        return False
+
+
+def audio_hash(path) -> str:
+    """音檔內容的 SHA-256 (分塊讀取，大檔也不會整個載入)"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_cached(digest: str) -> AsrResult | None:
+    """快取命中時回傳 AsrResult (task_id 以 hash 代替)，否則 None"""
+    txt_path, srt_path = CACHE_DIR / f"{digest}.txt", CACHE_DIR / f"{digest}.srt"
+    if not (txt_path.exists() and srt_path.exists()):
+        return None
+    return AsrResult(digest, txt_path.read_text(encoding="utf-8"), srt_path.read_text(encoding="utf-8"))
+
+
+def store_cached(digest: str, result: AsrResult):
+    if result.txt is None or result.srt is None:
+        return
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    (CACHE_DIR / f"{digest}.txt").write_text(result.txt, encoding="utf-8")
+    (CACHE_DIR / f"{digest}.srt").write_text(result.srt, encoding="utf-8")
+
+
+def transcribe_segmented(wav_path, digest: str | None = None, on_piece=None) -> str:
+    """分段平行轉錄長音檔並寫入快取；on_piece(segment, cues) 依片段順序回報"""
+    from asr_segment import transcribe_long
+
+    srt_text, stats = transcribe_long(wav_path, segment_seconds=SEGMENT_SECONDS, on_piece=on_piece)
+    print(f"分段轉錄完成: {stats['segments']} 段, 總耗時 {stats['total_seconds']:.1f} 秒")
+    txt_text = "\n".join(cue.text for cue in parse_srt(srt_text))
+    store_cached(digest or audio_hash(wav_path), AsrResult(digest, txt_text, srt_text))
+    return srt_text
+
+
+def main(wav_path=WAV_PATH, use_cache=True, digest: str | None = None):
+    """轉錄 wav_path 並回傳 SRT 文字；呼叫端已算過內容 hash 時以 digest 傳入，不再重讀整個音檔"""
+    digest = digest or audio_hash(wav_path)
+    if use_cache:
+        cached = load_cached(digest)
+        if cached is not None:
+            print("ASR 快取命中:", CACHE_DIR / f"{digest}.srt")
+            return cached.srt
+
+    if is_long_wav(wav_path):
+        # 長音檔：本機切段後平行轉錄，再拼回完整 SRT
+        return transcribe_segmented(wav_path, digest)
+
+    client = AsrClient()
+    try:
+        print("等待轉文字...")
+        # 2~3) TXT 與 SRT 同時等待
+        result = client.submit(wav_path).result()
+    finally:
+        client.close()
+    task_id, srt_text = result.task_id, result.srt
 
     # 4) 存檔（完整）
+    out_dir.mkdir(exist_ok=True)
     txt_path = out_dir / f"{task_id}.txt"
-    # txt_path.write_text(txt_text, encoding="utf-8")
+    txt_path.write_text(result.txt, encoding="utf-8")
     print("轉錄成功:", txt_path)
 
     if srt_text is not None:
         srt_path = out_dir / f"{task_id}.srt"
-        # srt_path.write_text(srt_text, encoding="utf-8")
+        srt_path.write_text(srt_text, encoding="utf-8")
+        store_cached(digest, result)
         print(srt_text)
         print("轉錄成功:", srt_path)
         return srt_text
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
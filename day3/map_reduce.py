@@ -0,0 +1,122 @@
+"""
+長逐字稿的 Map-Reduce 摘要
+
+- map: 每個時間視窗各自呼叫一次 chain，以 Semaphore 限制同時請求數
+- 視窗一完成就透過 on_partial 回呼串流出去 (不必等全部完成)
+- windows 也可以是 async iterator：逐字稿還在產生時，先到的視窗先開始摘要
+- reduce: 每 fan_in 份合併一次，逐層往上直到剩一份
+- 已摘要過的視窗 (內容相同) 存在 JSONL 快取，下次直接取用；每個視窗只追加一行
+"""
+import asyncio
+import hashlib
+import json
+import os
+
+
+class WindowCache:
+    """以 (用途, 視窗內容) 的 hash 為 key 的 JSONL 快取 ({"key", "value"} 一行一筆，後寫的蓋過先寫的)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._broken_tail = False
+        if not os.path.exists(path):
+            return
+        line = ""
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # 中斷時最後一行可能不完整
+                    continue
+                self._data[record["key"]] = record["value"]
+            self._broken_tail = line != "" and not line.endswith("\n")
+
+    @staticmethod
+    def key(kind: str, text: str) -> str:
+        return hashlib.sha256(f"{kind}\n{text}".encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, text: str):
+        value = self._data.get(self.key(kind, text))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, kind: str, text: str, value: str):
+        key = self.key(kind, text)
+        self._data[key] = value
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._broken_tail:  # 不要接在寫到一半的那一行後面
+                f.write("\n")
+                self._broken_tail = False
+            f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+
+
+async def map_reduce(
+    windows,
+    map_chain,
+    reduce_chain=None,
+    *,
+    kind: str,
+    max_concurrency: int = 4,
+    fan_in: int = 4,
+    cache: WindowCache | None = None,
+    on_partial=None,
+) -> str:
+    """
+    windows: 依時間排序的視窗文字 (list，或 async iterator)
+    map_chain: 以 {"transcript": 視窗文字} 呼叫
+    reduce_chain: 以 {"parts": 多份結果} 呼叫；None 表示依序串接即可 (例如詳細記錄)
+    on_partial(i, total, text): 每個視窗完成時呼叫，完成順序不保證；串流輸入時 total 為 None
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(chain, cache_kind, payload_key, text):
+        if cache is not None:
+            cached = cache.get(cache_kind, text)
+            if cached is not None:
+                return cached
+        async with semaphore:
+            result = await chain.ainvoke({payload_key: text})
+        if cache is not None:
+            cache.put(cache_kind, text, result)
+        return result
+
+    total = len(windows) if isinstance(windows, (list, tuple)) else None
+    results = []
+
+    async def map_one(i, window):
+        results[i] = await run(map_chain, f"{kind}:map", "transcript", window)
+        if on_partial:
+            on_partial(i, total, results[i])
+
+    async def iterate():
+        if total is not None:
+            for window in windows:
+                yield window
+        else:
+            async for window in windows:
+                yield window
+
+    tasks = []
+    async for window in iterate():
+        results.append(None)
+        tasks.append(asyncio.create_task(map_one(len(tasks), window)))
+    await asyncio.gather(*tasks)
+    if not results:
+        return ""
+
+    if reduce_chain is None:
+        return "\n\n".join(results)
+
+    # 階層式 reduce：每層把 fan_in 份併成一份，各組之間平行
+    level = results
+    while len(level) > 1:
+        groups = ["\n\n---\n\n".join(level[i:i + fan_in]) for i in range(0, len(level), fan_in)]
+        level = await asyncio.gather(*(run(reduce_chain, f"{kind}:reduce", "parts", g) for g in groups))
+    return level[0]
@@ -0,0 +1,105 @@
+"""
+ch5 agent 的對話記憶管理 (session 模式)
+
+State 由 checkpointer 保存，每輪只傳入新的使用者訊息；為了不讓歷史無限成長：
+- 近期訊息保留在 token 預算 (CH5_MEMORY_BUDGET) 內，超過時從最舊的「輪」開始移出，
+  一次壓到預算的 CH5_MEMORY_TARGET 成，不必每輪都摘要
+- 以「輪」(HumanMessage 開頭到下一個 HumanMessage 之前) 為單位移出，
+  帶 tool_calls 的 AIMessage 與對應的 ToolMessage 不會被拆開
+- 移出的訊息用 RemoveMessage 從 State 刪掉，內容併入 State 的 summary；
+  摘要是增量的：只送「舊摘要 + 這次移出的訊息」，成本不隨對話長度增加
+- 呼叫 LLM 時送出 [摘要 SystemMessage] + 近期訊息，提示詞大小因此維持穩定
+"""
+import json
+import os
+
+from instrumentation import METRICS
+from token_estimate import estimate_tokens
+
+MEMORY_BUDGET = int(os.getenv("CH5_MEMORY_BUDGET", "2000"))     # 近期訊息的 token 上限
+MEMORY_TARGET = float(os.getenv("CH5_MEMORY_TARGET", "0.6"))    # 超過上限時壓到上限的幾成
+SUMMARY_TOKENS = int(os.getenv("CH5_SUMMARY_TOKENS", "300"))    # 摘要的回應上限
+
+SUMMARY_PROMPT = (
+    "你負責維護一段對話的摘要。請把「新增的對話」併入「目前摘要」，輸出更新後的完整摘要。"
+    "保留使用者提供的事實 (姓名、電話、地址、訂單內容、查詢過的城市與結果) 與尚未完成的需求，"
+    "省略寒暄，使用繁體中文條列，不超過 200 字。"
+)
+
+def message_tokens(message) -> int:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    tokens = estimate_tokens(content) + 4  # role 等格式開銷
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += estimate_tokens(call["name"] + json.dumps(call["args"], ensure_ascii=False))
+    return tokens
+
+
+def split_turns(messages: list) -> list[list]:
+    """依 HumanMessage 切成一輪一輪；工具呼叫與結果一定落在同一輪"""
+    turns = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def transcript(messages: list) -> str:
+    lines = []
+    for message in messages:
+        if message.type == "human":
+            lines.append(f"使用者: {message.content}")
+        elif message.type == "tool":
+            lines.append(f"工具 {message.name} 結果: {message.content}")
+        elif getattr(message, "tool_calls", None):
+            calls = ", ".join(f"{c['name']}({json.dumps(c['args'], ensure_ascii=False)})" for c in message.tool_calls)
+            lines.append(f"助理呼叫工具: {calls}")
+        elif message.content:
+            lines.append(f"助理: {message.content}")
+    return "\n".join(lines)
+
+
+class MemoryManager:
+    def __init__(self, llm, budget: int = MEMORY_BUDGET, target: float = MEMORY_TARGET):
+        self.llm = llm
+        self.budget = budget
+        self.target = target
+
+    def summarize(self, previous: str, evicted: list) -> str:
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        prompt = f"目前摘要:\n{previous or '(無)'}\n\n新增的對話:\n{transcript(evicted)}"
+        response = self.llm.bind(max_tokens=SUMMARY_TOKENS).invoke(
+            [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=prompt)]
+        )
+        return response.content.strip()
+
+    def compact(self, state: dict) -> dict:
+        """graph 節點：近期訊息超過預算時，把最舊的幾輪移進摘要"""
+        from langchain_core.messages import RemoveMessage
+
+        turns = split_turns(state["messages"])
+        sizes = [sum(map(message_tokens, turn)) for turn in turns]
+        total = sum(sizes)
+        if total <= self.budget or len(turns) <= 1:
+            return {}
+
+        evicted = []
+        # 最新一輪 (本輪) 一定保留
+        while len(turns) > 1 and total > self.budget * self.target:
+            evicted.extend(turns.pop(0))
+            total -= sizes.pop(0)
+        summary = self.summarize(state.get("summary", ""), evicted)
+        METRICS.inc("memory_summaries_total")
+        METRICS.inc("memory_evicted_messages_total", len(evicted))
+        return {"summary": summary, "messages": [RemoveMessage(id=m.id) for m in evicted]}
+
+    @staticmethod
+    def context(state: dict) -> list:
+        """送給 LLM 的訊息：摘要 (若有) + 近期訊息"""
+        from langchain_core.messages import SystemMessage
+
+        messages = list(state["messages"])
+        if state.get("summary"):
+            messages.insert(0, SystemMessage(content=f"先前對話摘要：\n{state['summary']}"))
+        return messages
@@ -0,0 +1,240 @@
+"""
+訂單資料的規則式預先提取
+
+ch5_1 原本每則訂單都交給 70B 模型呼叫 extract_order_data。大多數訂單格式其實很固定，
+這裡先用預先編譯的正規表示式抽出欄位，只有缺的欄位才交給 LLM 的 tool call 補：
+- 電話：手機 09xx-xxx-xxx / +886 9xx...、市話 (02) xxxx-xxxx，統一成純數字
+- 數量：阿拉伯或中文數字 + 量詞 (個、件、盒...)、「數量: 3」、「x3」
+- 商品：「商品/品項: ...」、「買/訂/要 + 數量 + 量詞 + 商品」
+- 地址：「地址/送到/寄到 ...」或 縣市 + 區鄉鎮 + 路街 + 號 的樣式
+- 姓名：「我是/我叫/姓名/收件人 ...」
+
+批次模式 (規則全部在本機跑，缺欄位的訂單以執行緒池平行呼叫 LLM)：
+    python order_extract.py orders.txt -o orders.jsonl --workers 8
+    python order_extract.py orders.txt --no-llm       # 只跑規則，看覆蓋率
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from instrumentation import METRICS
+
+FIELDS = ("name", "phone", "product", "quantity", "address")
+FIELD_LABELS = {"name": "姓名", "phone": "電話", "product": "商品", "quantity": "數量", "address": "寄送地址"}
+# 至少抽到其中一項才視為訂單；只有數量之類的片段交給 agent 照常處理
+ORDER_SIGNALS = ("phone", "address")
+
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_UNITS = "個件份盒箱瓶杯支台組包罐張本雙套顆條片袋"
+_NUM = r"\d+|[零一二兩三四五六七八九十百]+"
+_STOP = r"[\s,，。;；!！?？、]"
+_VERB = r"(?:(?:想|要|需要)?(?:訂購|購買|買|訂)|想要|需要|要)了?"  # 「要買」要整個吃掉，不能只吃到「要」
+# 商品名稱可以有空白 (iPhone 15 Pro)，只在標點、送/寄/到/給或下一個欄位標籤前結束
+_PRODUCT_END = r"(?=\s*(?:[,，。;；!！?？、]|送|寄|到|給|地址|住址|電話|手機|數量|姓名|收件人|[xX×＊*]\s*\d|$))"
+
+_PHONE = re.compile(
+    r"(?<!\d)(?:"
+    r"(?:\+?886[-\s]?|0)9\d{2}[-\s]?\d{3}[-\s]?\d{3}"          # 手機
+    r"|\(?0[2-8]\d?\)?[-\s]?\d{3,4}[-\s]?\d{4}"                 # 市話
+    r")(?!\d)"
+)
+_QUANTITY = re.compile(rf"(?:數量[:：]?\s*|[xX×＊*]\s*)(?P<n>\d+)|(?P<m>{_NUM})\s*[{_UNITS}]")
+_PRODUCT_LABEL = re.compile(rf"(?:商品|品項|產品|品名)[:：]\s*(?P<product>.+?){_PRODUCT_END}")
+_PRODUCT_AFTER_QTY = re.compile(
+    rf"{_VERB}\s*(?:{_NUM})\s*[{_UNITS}]\s*(?P<product>.+?){_PRODUCT_END}"
+)
+_PRODUCT_BEFORE_QTY = re.compile(
+    rf"{_VERB}\s*(?P<product>[^\d\s,，。;；!！?？、][^,，。;；!！?？、]*?)"
+    rf"\s*(?:[xX×＊*]\s*\d+|(?:{_NUM})\s*[{_UNITS}])"
+)
+_ADDRESS_LABEL = re.compile(
+    rf"(?:地址|住址|送貨地址|收件地址|送到|寄到|送至|寄至|寄送到|配送到)[:：]?\s*(?P<address>.+?)(?=[,，。;；!！?？]|電話|手機|$)"
+)
+_ADDRESS_PATTERN = re.compile(
+    r"(?P<address>[一-鿿]{1,3}[市縣][一-鿿]{1,4}[區鄉鎮市]"
+    r"[一-鿿0-9０-９]*?[路街道](?:[一二三四五六七八九十0-9]+段)?"
+    r"[一-鿿0-9０-９之巷弄\-]*?\d+[之\-]?\d*號(?:\d+樓(?:之\d+)?)?)"
+)
+_NAME = re.compile(
+    rf"(?:我是|我叫|姓名[:：]?|收件人[:：]?|名字是|訂購人[:：]?)\s*(?P<name>[一-鿿A-Za-z]{{2,4}}?)"
+    rf"(?={_STOP}|電話|手機|要|想|訂|買|住|地址|\d|$)"
+)
+
+
+def parse_number(text: str) -> int | None:
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+        elif ch == "十":
+            total += (current or 1) * 10
+            current = 0
+        elif ch == "百":
+            total += (current or 1) * 100
+            current = 0
+        else:
+            return None
+    return total + current or None
+
+
+def normalize_phone(phone: str) -> str:
+    digits = re.sub(r"\D", "", phone)
+    if digits.startswith("886"):
+        digits = "0" + digits[3:]
+    return digits
+
+
+def extract_rules(text: str) -> dict:
+    """只回傳規則有把握的欄位"""
+    found = {}
+    if m := _PHONE.search(text):
+        found["phone"] = normalize_phone(m.group())
+        # 避免電話號碼被當成數量；換成逗號，商品名稱也不會延伸過去
+        text_wo_phone = text[:m.start()] + "，" + text[m.end():]
+    else:
+        text_wo_phone = text
+    if m := _QUANTITY.search(text_wo_phone):
+        quantity = parse_number(m.group("n") or m.group("m"))
+        if quantity:
+            found["quantity"] = quantity
+    for pattern in (_PRODUCT_LABEL, _PRODUCT_AFTER_QTY, _PRODUCT_BEFORE_QTY):
+        if m := pattern.search(text_wo_phone):
+            found["product"] = m.group("product").strip()
+            break
+    if m := (_ADDRESS_LABEL.search(text_wo_phone) or _ADDRESS_PATTERN.search(text_wo_phone)):
+        found["address"] = m.group("address").strip()
+    if m := _NAME.search(text):
+        found["name"] = m.group("name")
+    return found
+
+
+def looks_like_order(found: dict) -> bool:
+    return any(field in found for field in ORDER_SIGNALS)
+
+
+def missing_fields(found: dict) -> list[str]:
+    return [field for field in FIELDS if field not in found]
+
+
+def _clean(field: str, value):
+    """LLM 回傳的值：空字串、0 或無法解析的數量都當作沒找到 (回傳 None)"""
+    if field == "quantity":
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None
+        return value if value > 0 else None
+    value = str(value).strip() if value is not None else ""
+    if field == "phone":
+        value = normalize_phone(value) if _PHONE.fullmatch(value) else ""
+    return value or None
+
+
+def fill_missing(text: str, found: dict, llm_with_tool) -> dict:
+    """
+    只為缺的欄位呼叫一次 LLM (強制使用 extract_order_data 工具)。
+    規則抽到的欄位放進提示詞當已知資訊，合併時以規則結果為準；
+    LLM 也找不到的欄位不會出現在回傳值裡 (用 missing_fields 檢查)。
+    """
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    missing = missing_fields(found)
+    known = "\n".join(f"- {field}: {found[field]}" for field in FIELDS if field in found) or "(無)"
+    prompt = (
+        "請呼叫 extract_order_data 提取訂單資料。下列欄位已由系統確認，請原樣填入；"
+        f"請從訂單內容找出其餘欄位 ({', '.join(missing)})。訂單沒有提到的資料不要猜測或自行編造。\n"
+        f"已確認欄位:\n{known}"
+    )
+    response = llm_with_tool.invoke([SystemMessage(content=prompt), HumanMessage(content=text)])
+    args = response.tool_calls[0]["args"] if response.tool_calls else {}
+    METRICS.inc("order_extract_llm_calls_total")
+    filled = {field: _clean(field, args.get(field)) for field in missing}
+    return {**{field: value for field, value in filled.items() if value is not None}, **found}
+
+
+class ExtractStats:
+    def __init__(self):
+        self.orders = 0
+        self.rule_only = 0
+        self.llm_calls = 0
+        self.incomplete = 0  # 規則與 LLM 都沒抽齊的訂單 (--no-llm 時為規則沒抽齊的)
+        self.field_hits = dict.fromkeys(FIELDS, 0)
+
+    def report(self, seconds: float, rule_seconds: float):
+        seconds = seconds or 1e-9
+        print("\n" + "=" * 30)
+        print("訂單提取報告")
+        print("=" * 30)
+        print(f"訂單: {self.orders}  規則即完成: {self.rule_only} ({self.rule_only / max(self.orders, 1):.1%})  "
+              f"LLM 補欄位: {self.llm_calls}  未完成: {self.incomplete}")
+        print("各欄位規則命中率: " + ", ".join(
+            f"{field} {hits / max(self.orders, 1):.0%}" for field, hits in self.field_hits.items()))
+        print(f"總耗時: {seconds:.2f} 秒  吞吐量: {self.orders / seconds:.1f} 筆/秒  "
+              f"(規則階段 {self.orders / max(rule_seconds, 1e-9):.0f} 筆/秒)")
+
+
+def extract_batch(texts: list[str], llm_with_tool=None, workers: int = 8) -> tuple[list[dict], ExtractStats, float]:
+    """先全部跑規則；缺欄位的再平行呼叫 LLM (llm_with_tool 為 None 時不補)"""
+    stats = ExtractStats()
+    start = time.perf_counter()
+    results = [extract_rules(text) for text in texts]
+    rule_seconds = time.perf_counter() - start
+
+    pending = []
+    for i, found in enumerate(results):
+        stats.orders += 1
+        for field in found:
+            stats.field_hits[field] += 1
+        if len(found) == len(FIELDS):
+            stats.rule_only += 1
+        elif llm_with_tool is None:
+            stats.incomplete += 1
+        else:
+            pending.append(i)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as pool:
+            filled = pool.map(lambda i: fill_missing(texts[i], results[i], llm_with_tool), pending)
+            for i, record in zip(pending, filled):
+                results[i] = record
+                stats.llm_calls += 1
+                if missing_fields(record):
+                    stats.incomplete += 1
+    METRICS.inc("order_extract_orders_total", stats.orders)
+    return results, stats, rule_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="訂單資料批次提取 (規則優先，缺欄位才用 LLM)")
+    parser.add_argument("input", help="一行一筆訂單的文字檔")
+    parser.add_argument("-o", "--output", help="輸出 JSONL (預設只印報告)")
+    parser.add_argument("--workers", type=int, default=8, help="LLM 補欄位的同時請求數")
+    parser.add_argument("--no-llm", action="store_true", help="只跑規則")
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    llm_with_tool = None
+    if not args.no_llm:
+        from ch5_1 import get_order_extractor
+        from llm_registry import prewarm
+
+        prewarm("ws-02")
+        llm_with_tool = get_order_extractor()
+
+    start = time.perf_counter()
+    results, stats, rule_seconds = extract_batch(texts, llm_with_tool, args.workers)
+    elapsed = time.perf_counter() - start
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            for text, record in zip(texts, results):
+                missing = {"missing": missing_fields(record)} if missing_fields(record) else {}
+                out.write(json.dumps({"text": text, **record, **missing}, ensure_ascii=False) + "\n")
+    stats.report(elapsed, rule_seconds)
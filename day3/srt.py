@@ -0,0 +1,211 @@
+"""
+SRT 字幕工具
+
+- CueList: 以 array 儲存開始/結束時間與文字位移的精簡 cue 列表，所有文字共用一個緩衝區
+- StreamingSrtParser: 可以一段一段 feed 的 SRT 解析器，ASR 還在產生後段時前段就能先用
+- slice_time / window_cues: 依時間範圍切片 (二分搜尋，回傳共用底層資料的 view，不複製文字)
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+
+_TIME_LINE = re.compile(
+    r"(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})"
+)
+_BLOCK_SEP = re.compile(r"\n[ \t]*\n")
+
+
+@dataclass(slots=True)
+class Cue:
+    index: int
+    start: float  # 秒
+    end: float    # 秒
+    text: str
+
+
+def _seconds(h, m, s, ms) -> float:
+    return int(h) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000
+
+
+def format_timestamp(seconds: float) -> str:
+    """秒數 -> SRT 時間格式 00:00:00,000"""
+    ms = round(seconds * 1000)
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def to_srt(cues) -> str:
+    """任何可迭代出 Cue 的物件 -> SRT 文字 (序號重新編排)"""
+    return "\n\n".join(
+        f"{i}\n{format_timestamp(c.start)} --> {format_timestamp(c.end)}\n{c.text}"
+        for i, c in enumerate(cues, 1)
+    ) + "\n"
+
+
+class CueList:
+    """
+    array-backed 的 cue 列表，依開始時間排序。
+
+    starts / ends 為 double 陣列，文字全部串在同一個緩衝區 (依加入順序)，
+    text_lo[i]:text_hi[i] 是第 i 句的文字範圍。
+    """
+
+    __slots__ = ("starts", "ends", "text_lo", "text_hi", "_pieces", "_buffer", "_size", "_duration", "closed")
+
+    def __init__(self):
+        self.starts = array("d")
+        self.ends = array("d")
+        self.text_lo = array("q")
+        self.text_hi = array("q")
+        self._pieces = []     # 尚未併入 _buffer 的文字
+        self._buffer = ""
+        self._size = 0        # 緩衝區 (含 _pieces) 的總字數
+        self._duration = 0.0  # 最晚的結束時間
+        self.closed = False   # 來源 (例如串流 ASR) 是否已經結束
+
+    def append(self, start: float, end: float, text: str):
+        """
+        加入一句。通常依開始時間遞增加入 (O(1))；比最後一句早的 (例如拼接的分段字幕)
+        插入到排序後的位置，slice_time 的二分搜尋才會正確。
+        """
+        lo = self._size
+        self._pieces.append(text)
+        self._size += len(text)
+        self._duration = max(self._duration, end)
+        if not self.starts or start >= self.starts[-1]:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.text_lo.append(lo)
+            self.text_hi.append(self._size)
+            return
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.text_lo.insert(i, lo)
+        self.text_hi.insert(i, self._size)
+
+    def _text_buffer(self) -> str:
+        if self._pieces:
+            self._buffer += "".join(self._pieces)
+            self._pieces.clear()
+        return self._buffer
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text(self, i: int) -> str:
+        return self._text_buffer()[self.text_lo[i]:self.text_hi[i]]
+
+    def cue(self, i: int) -> Cue:
+        return Cue(i + 1, self.starts[i], self.ends[i], self.text(i))
+
+    def __iter__(self):
+        return (self.cue(i) for i in range(len(self)))
+
+    @property
+    def char_count(self) -> int:
+        return self._size
+
+    @property
+    def duration(self) -> float:
+        return self._duration
+
+    def view(self, lo: int = 0, hi: int | None = None) -> "CueSlice":
+        return CueSlice(self, lo, len(self) if hi is None else hi)
+
+    def slice_time(self, t0: float, t1: float) -> "CueSlice":
+        """開始時間落在 [t0, t1) 的 cue (二分搜尋，O(log n))"""
+        return self.view(bisect_left(self.starts, t0), bisect_left(self.starts, t1))
+
+    def to_srt(self) -> str:
+        return to_srt(self)
+
+
+class CueSlice:
+    """CueList 的一段連續範圍，共用底層陣列與文字緩衝區"""
+
+    __slots__ = ("cues", "lo", "hi")
+
+    def __init__(self, cues: CueList, lo: int, hi: int):
+        self.cues, self.lo, self.hi = cues, lo, hi
+
+    def __len__(self):
+        return max(self.hi - self.lo, 0)
+
+    def __iter__(self):
+        return (self.cues.cue(i) for i in range(self.lo, self.hi))
+
+    @property
+    def start(self) -> float:
+        return self.cues.starts[self.lo]
+
+    @property
+    def end(self) -> float:
+        return self.cues.ends[self.hi - 1]
+
+    def to_srt(self) -> str:
+        return to_srt(self)
+
+
+class StreamingSrtParser:
+    """
+    增量 SRT 解析：feed() 收到的文字可以在任何位置被切斷，
+    只有「後面已經出現空行」的區塊才會被解析，最後一塊等 close() 再處理。
+    """
+
+    def __init__(self, cues: CueList | None = None):
+        self.cues = cues if cues is not None else CueList()
+        self._pending = ""
+
+    def _parse_block(self, block: str):
+        lines = block.strip().split("\n")
+        for i, line in enumerate(lines):
+            m = _TIME_LINE.search(line)
+            if m:
+                self.cues.append(
+                    _seconds(*m.groups()[:4]),
+                    _seconds(*m.groups()[4:]),
+                    "\n".join(lines[i + 1:]).strip(),
+                )
+                return
+
+    def feed(self, chunk: str) -> int:
+        """餵入一段文字，回傳新增的 cue 數"""
+        before = len(self.cues)
+        # 接上未完成的部分再換行正規化：\r\n 可能剛好被切在兩次 feed 之間
+        self._pending = (self._pending + chunk).replace("\r\n", "\n")
+        *blocks, self._pending = _BLOCK_SEP.split(self._pending)
+        for block in blocks:
+            self._parse_block(block)
+        return len(self.cues) - before
+
+    def close(self) -> CueList:
+        """來源結束：解析剩下的最後一塊並標記 closed"""
+        if self._pending.strip():
+            self._parse_block(self._pending)
+        self._pending = ""
+        self.cues.closed = True
+        return self.cues
+
+
+def parse_srt(text: str) -> CueList:
+    """一次解析完整的 SRT 文字；格式不完整的區塊直接略過"""
+    parser = StreamingSrtParser()
+    parser.feed(text)
+    return parser.close()
+
+
+def window_bounds(duration: float, window_seconds: float):
+    k = 0
+    while k * window_seconds < duration:
+        yield k * window_seconds, (k + 1) * window_seconds
+        k += 1
+
+
+def window_cues(cues: CueList, window_seconds: float = 300) -> list[CueSlice]:
+    """依開始時間切成固定長度的時間視窗 (空視窗不輸出)"""
+    windows = (cues.slice_time(t0, t1) for t0, t1 in window_bounds(cues.duration, window_seconds))
+    return [w for w in windows if len(w)]
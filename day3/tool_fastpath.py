@@ -0,0 +1,132 @@
+"""
+ch5 agent 的工具快速路徑
+
+原本工具執行完一定回到 agent 再呼叫一次 LLM，只為了把工具結果換句話說。
+這裡的工具都是確定性、便宜的，所以每個工具可以設定回應模式：
+- "llm"：舊行為，回到 agent 讓 LLM 整理
+- "direct"：工具輸出直接當作最終回答
+- "template"：以工具參數與輸出 ({result}) 套用樣板當作最終回答
+同一輪的 tool_calls 全部都是 direct / template 時才略過 LLM，否則照常回到 agent。
+環境變數 CH5_TOOL_MODE=llm 可一次切回舊行為，CH5_TOOL_MODE_<工具名稱> 覆寫單一工具。
+
+同一輪的多個 tool_calls 以執行緒池同時執行；TurnStats 記錄每輪的 LLM 呼叫次數與延遲。
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import METRICS
+
+MODES = ("llm", "direct", "template")
+
+
+class ToolPolicy:
+    def __init__(self, name: str, mode: str = "llm", template: str | None = None):
+        mode = os.getenv(f"CH5_TOOL_MODE_{name.upper()}") or os.getenv("CH5_TOOL_MODE") or mode
+        if mode not in MODES:
+            raise ValueError(f"未知的工具回應模式: {mode} (可用: {', '.join(MODES)})")
+        if mode == "template" and template is None:
+            mode = "direct"
+        self.name = name
+        self.mode = mode
+        self.template = template
+
+    def render(self, args: dict, result: str) -> str:
+        if self.mode == "template":
+            return self.template.format(**args, result=result)
+        return result
+
+
+def _content(result) -> str:
+    return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+
+
+def make_tools_node(tools: list):
+    """取代 ToolNode：同一輪的 tool_calls 同時執行，並記錄每個工具的延遲"""
+    by_name = {t.name: t for t in tools}
+
+    def run_one(call: dict):
+        from langchain_core.messages import ToolMessage
+
+        start = time.perf_counter()
+        status = "success"
+        try:
+            content = _content(by_name[call["name"]].invoke(call["args"]))
+        except Exception as e:  # 與 ToolNode 相同：錯誤回給 LLM，而不是讓整個 graph 失敗
+            content, status = f"Error: {e!r}", "error"
+        METRICS.observe("tool_latency_seconds", time.perf_counter() - start, tool=call["name"])
+        return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"], status=status)
+
+    def tools_node(state: dict):
+        calls = state["messages"][-1].tool_calls
+        if len(calls) == 1:
+            return {"messages": [run_one(calls[0])]}
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            return {"messages": list(pool.map(run_one, calls))}
+
+    return tools_node
+
+
+def last_tool_round(messages: list) -> tuple[list, dict]:
+    """最後一個帶 tool_calls 的 AIMessage 的 calls，以及 tool_call_id -> ToolMessage"""
+    results = {}
+    for message in reversed(messages):
+        if getattr(message, "tool_calls", None):
+            return message.tool_calls, results
+        if message.type == "tool":
+            results[message.tool_call_id] = message
+    return [], results
+
+
+def make_after_tools(policies: dict[str, ToolPolicy]):
+    """工具執行完的路由："respond" 直接結束，"agent" 回到 LLM"""
+
+    def after_tools(state: dict) -> str:
+        calls, results = last_tool_round(state["messages"])
+        for call in calls:
+            policy = policies.get(call["name"])
+            if policy is None or policy.mode == "llm" or results[call["id"]].status == "error":
+                return "agent"
+        return "respond"
+
+    return after_tools
+
+
+def make_respond_node(policies: dict[str, ToolPolicy]):
+    """不經 LLM，依各工具的模式組出最終回答"""
+
+    def respond_node(state: dict):
+        from langchain_core.messages import AIMessage
+
+        calls, results = last_tool_round(state["messages"])
+        lines = [policies[call["name"]].render(call["args"], results[call["id"]].content) for call in calls]
+        return {"messages": [AIMessage(content="\n".join(lines))]}
+
+    return respond_node
+
+
+class TurnStats:
+    """每輪 (一次使用者輸入) 的 LLM 呼叫次數、延遲與提示詞大小"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.turns = []  # (llm_calls, seconds, prompt_tokens)
+
+    def record(self, llm_calls: int, seconds: float, prompt_tokens: int = 0):
+        self.turns.append((llm_calls, seconds, prompt_tokens))
+        METRICS.observe("agent_turn_seconds", seconds, agent=self.name)
+        METRICS.inc("agent_llm_calls_total", llm_calls, agent=self.name)
+        extra = f", 提示詞約 {prompt_tokens} tokens" if prompt_tokens else ""
+        print(f"[本輪] LLM 呼叫 {llm_calls} 次, 耗時 {seconds:.2f} 秒{extra}")
+
+    def summary(self):
+        if not self.turns:
+            return
+        calls = [c for c, _, _ in self.turns]
+        seconds = sorted(s for _, s, _ in self.turns)
+        prompts = [p for _, _, p in self.turns if p]
+        p95 = seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)]
+        extra = f", 提示詞平均 {sum(prompts) / len(prompts):.0f} / 最大 {max(prompts)} tokens" if prompts else ""
+        print(f"[統計] {len(self.turns)} 輪, 平均 LLM 呼叫 {sum(calls) / len(calls):.2f} 次/輪, "
+              f"平均延遲 {sum(seconds) / len(seconds):.2f} 秒, p95 {p95:.2f} 秒{extra}")
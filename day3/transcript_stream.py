@@ -0,0 +1,67 @@
+"""
+串流中的逐字稿
+
+ASR (在背景執行緒) 每產生一段 SRT 就 feed 進來，解析成 CueList；
+下游節點用 `async for window in stream.windows(300)` 逐一取得已經完整的時間視窗，
+不必等整段音檔轉錄完才開始摘要。
+"""
+import asyncio
+import time
+
+from srt import CueSlice, StreamingSrtParser
+
+
+class TranscriptStream:
+    def __init__(self):
+        self.parser = StreamingSrtParser()
+        self.cues = self.parser.cues
+        self.error = None
+        self.started_at = time.perf_counter()
+        self.elapsed = None  # 生產端從開始到結束的秒數
+        self.task = None     # 生產端的 asyncio task (由建立者設定，保留參考避免被回收)
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+
+    # ---------- 生產端 (任何執行緒都可以呼叫) ----------
+    def feed(self, srt_chunk: str):
+        self._loop.call_soon_threadsafe(self._feed, srt_chunk)
+
+    def close(self, error: Exception | None = None):
+        self._loop.call_soon_threadsafe(self._close, error)
+
+    def _feed(self, srt_chunk: str):
+        if self.parser.feed(srt_chunk):
+            self._changed.set()
+
+    def _close(self, error):
+        self.parser.close()
+        self.error = error
+        self.elapsed = time.perf_counter() - self.started_at
+        self._changed.set()
+
+    # ---------- 消費端 ----------
+    async def _wait_past(self, t: float):
+        """等到已有 cue 的開始時間超過 t (代表 t 之前的視窗已完整)，或來源結束"""
+        starts = self.cues.starts
+        while not self.cues.closed and not (starts and starts[-1] >= t):
+            self._changed.clear()
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def windows(self, window_seconds: float):
+        """依序 yield 每個已完整的時間視窗 (CueSlice)，空視窗略過"""
+        k = 0
+        while True:
+            t0, t1 = k * window_seconds, (k + 1) * window_seconds
+            await self._wait_past(t1)
+            if self.cues.closed and t0 >= self.cues.duration:
+                return
+            window: CueSlice = self.cues.slice_time(t0, t1)
+            if len(window):
+                yield window
+            k += 1
+
+    async def wait_closed(self):
+        await self._wait_past(float("inf"))
+        return self.cues
@@ -0,0 +1,128 @@
+"""
+hw4 查證流程的推測執行基準測試 (不連網、不呼叫真的模型)
+
+以固定延遲的假 LLM / 假搜尋 / 假 VLM 取代外部服務，
+同一組情境分別以循序模式與推測執行 (--speculative) 跑完整個 graph，比較端到端時間。
+
+用法:
+    python bench_hw4.py
+    python bench_hw4.py --planner 1.5 --llm 0.8 --search 0.5 --vlm 2 --runs 3
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+# 情境：規劃器每次的決策 (最後一次之後一律 sufficient)
+SCENARIOS = {
+    "1 輪即足夠": ["insufficient", "sufficient"],
+    "2 輪": ["insufficient", "insufficient", "sufficient"],
+    "達到迴圈上限": ["insufficient"] * 4,
+}
+
+
+class FakeLLM:
+    def __init__(self, latency: float, planner_latency: float, decisions: list):
+        self.latency = latency
+        self.planner_latency = planner_latency
+        self.decisions = list(decisions)
+        self.calls = 0
+
+    def invoke(self, prompt):
+        # 每次產生不同關鍵字，讓每一輪都真的搜尋、讀新網頁 (不被快取吃掉)
+        time.sleep(self.latency)
+        self.calls += 1
+        return types.SimpleNamespace(content=f"假關鍵字{self.calls}")
+
+    def stream(self, prompt):
+        time.sleep(self.latency)
+        yield types.SimpleNamespace(content="假答案")
+
+    def with_structured_output(self, schema):
+        outer = self
+
+        class Structured:
+            def invoke(self, prompt):
+                time.sleep(outer.planner_latency)
+                decision = outer.decisions.pop(0) if outer.decisions else "sufficient"
+                return schema(reasoning="bench", decision=decision)
+
+        return Structured()
+
+
+def install_fake_tools(search_latency: float, vlm_latency: float):
+    search = types.ModuleType("search_searxng")
+
+    def search_searxng(query, limit=3):
+        time.sleep(search_latency)
+        return [{"url": f"https://example.com/{query}/{i}", "title": f"結果 {i}"} for i in range(limit)]
+
+    search.search_searxng = search_searxng
+    vlm = types.ModuleType("vlm_read_website")
+
+    def vlm_read_website(url, title):
+        time.sleep(vlm_latency)
+        return f"{title} 的內容"
+
+    vlm.vlm_read_website = vlm_read_website
+    sys.modules["search_searxng"] = search
+    sys.modules["vlm_read_website"] = vlm
+
+
+def run_once(hw4, research_cache, args, decisions, speculative: bool, workdir: Path, tag: str) -> float:
+    hw4.SPECULATIVE = speculative
+    hw4.CACHE_FILE = str(workdir / f"answers_{tag}.json")
+    cache = research_cache.ResearchCache(str(workdir / f"research_{tag}.jsonl"))
+    hw4.get_research_cache = lambda: cache
+    hw4.page_validators = lambda url: None
+    hw4.llm = hw4.planner_llm = FakeLLM(args.llm, args.planner, decisions)
+
+    start = time.perf_counter()
+    hw4.get_app().invoke({"question": f"bench {tag}", "loop_count": 0}, config={"recursion_limit": 50})
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hw4 推測執行基準測試")
+    parser.add_argument("--planner", type=float, default=1.0, help="規劃器 LLM 延遲 (秒)")
+    parser.add_argument("--llm", type=float, default=0.5, help="關鍵字 / 最終答案 LLM 延遲 (秒)")
+    parser.add_argument("--search", type=float, default=0.5, help="搜尋延遲 (秒)")
+    parser.add_argument("--vlm", type=float, default=1.5, help="VLM 讀取單頁延遲 (秒)")
+    parser.add_argument("--runs", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    install_fake_tools(args.search, args.vlm)
+    import hw4
+    import research_cache
+
+    hw4.get_app()  # 先編譯 graph，不算進量測時間
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for name, decisions in SCENARIOS.items():
+            timings = {}
+            for speculative in (False, True):
+                samples = []
+                for i in range(args.runs):
+                    tag = f"{len(rows)}_{int(speculative)}_{i}"
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        samples.append(run_once(hw4, research_cache, args, decisions, speculative, workdir, tag))
+                timings[speculative] = statistics.median(samples)
+            rows.append((name, timings[False], timings[True]))
+
+    print(f"延遲設定: 規劃器 {args.planner}s / LLM {args.llm}s / 搜尋 {args.search}s / VLM {args.vlm}s")
+    print(f"{'情境':<12}{'循序':>10}{'推測執行':>12}{'節省':>10}")
+    for name, serial, speculative in rows:
+        saved = (serial - speculative) / serial * 100
+        print(f"{name:<12}{serial:>9.2f}s{speculative:>11.2f}s{saved:>9.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+整份文件批次翻譯
+
+    python bulk_translate.py article.txt -o article.en.txt --workers 4 --batch 8
+    python bulk_translate.py article.txt --check      # 每批附自我檢查，沒通過的句子重送一次
+
+- 文件切成句子 (保留段落)，每一句各自查 translation_cache.jsonl，只有未命中的才送 LLM
+- 未命中的句子 (重複的只算一次) 每 --batch 句合併成一次請求，交給有上限的執行緒池
+- 每批完成就追加寫入快取 (JSONL)，中斷後重跑只翻還沒完成的句子
+- 某一批失敗會重送 (BATCH_ATTEMPTS 次)，仍失敗則輸出「[翻譯失敗] 原文」並不寫入快取，其他批照常完成
+- 結果依原文順序輸出：前面的句子一完成就寫進輸出檔，不必等整份文件
+- 結束時輸出每秒句數、快取命中與 LLM 呼叫次數
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import ch7_1
+from ch7_1 import CACHE_FILE, load_cache, save_cache_many, split_sentences, translate_batch
+from instrumentation import record_cache
+
+BATCH_ATTEMPTS = 2  # 每批最多送幾次 (例外才重送)
+FAILED_MARK = "[翻譯失敗]"
+
+
+def segment(text: str) -> list[list[str]]:
+    """文件 -> 段落 -> 句子；空行保留為空段落"""
+    return [split_sentences(line) for line in text.splitlines()]
+
+
+class OrderedWriter:
+    """句子可能亂序完成，依編號順序寫出；段落結尾換行 (只在主執行緒呼叫)"""
+
+    def __init__(self, out, breaks: dict[int, int]):
+        self.out = out
+        self.breaks = breaks  # 句子編號 -> 之後要換幾行 (0 表示同段，接一個空白)
+        self.done = {}
+        self.next = 0
+
+    def put(self, index: int, translation: str):
+        self.done[index] = translation
+        while self.next in self.done:
+            self.out.write(self.done.pop(self.next).strip())
+            self.out.write("\n" * self.breaks.get(self.next, 0) or " ")
+            self.next += 1
+        self.out.flush()
+
+
+def translate_document(text: str, out, workers: int = 4, batch_size: int = 8, check: bool = False,
+                       cache_file: str = CACHE_FILE) -> dict:
+    sentences, breaks = [], defaultdict(int)
+    for paragraph in segment(text):
+        if paragraph:
+            sentences.extend(paragraph)
+        if sentences:
+            breaks[len(sentences) - 1] += 1  # 段落結尾；空行則在前一段後多換一行
+        else:
+            out.write("\n")  # 文件開頭的空行
+
+    stats = {"sentences": len(sentences), "cache_hits": 0, "llm_calls": 0, "batches": 0, "failed": 0}
+    start = time.perf_counter()
+    writer = OrderedWriter(out, breaks)
+
+    # 1) 逐句查快取；未命中的相同句子只翻一次
+    cache = load_cache(cache_file)
+    pending = {}  # 原文 -> 所有出現位置
+    hits = []
+    for i, sentence in enumerate(sentences):
+        hit = sentence in cache
+        record_cache("translation", hit)
+        if hit:
+            hits.append(i)
+        else:
+            pending.setdefault(sentence, []).append(i)
+    stats["cache_hits"] = len(hits)
+    for i in hits:
+        writer.put(i, cache[sentences[i]])
+
+    # 2) 未命中的句子分批送出
+    misses = list(pending)
+    batches = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+    stats["batches"] = len(batches)
+
+    def translate(batch: list[str]) -> tuple[list[str], int]:
+        items, calls = translate_batch(batch, check=check)
+        if check:
+            retry = [i for i, item in enumerate(items) if not item.passed]
+            if retry:
+                fixed, more = translate_batch([batch[i] for i in retry], [items[i].issues for i in retry])
+                for i, item in zip(retry, fixed):
+                    items[i] = item
+                calls += more
+        return [item.translation for item in items], calls
+
+    def run(batch: list[str]) -> tuple[list[str], list[str] | None, int, Exception | None]:
+        """失敗時重送；BATCH_ATTEMPTS 次都失敗則回傳 (batch, None, 0, 最後的例外)，不讓整份文件中斷"""
+        error = None
+        for _ in range(BATCH_ATTEMPTS):
+            try:
+                return batch, *translate(batch), None
+            except Exception as e:
+                error = e
+        return batch, None, 0, error
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate") as pool:
+        futures = [pool.submit(run, batch) for batch in batches]
+        for future in as_completed(futures):
+            batch, translations, calls, error = future.result()
+            stats["llm_calls"] += calls
+            if error is not None:
+                print(f"[bulk] {len(batch)} 句翻譯失敗: {error!r}", file=sys.stderr)
+                stats["failed"] += sum(len(pending[original]) for original in batch)
+                translations = [f"{FAILED_MARK} {original}" for original in batch]
+            else:
+                save_cache_many(dict(zip(batch, translations)), cache_file)
+            for original, translation in zip(batch, translations):
+                for i in pending[original]:
+                    writer.put(i, translation)
+
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def report(stats: dict):
+    seconds = stats["seconds"] or 1e-9
+    print("\n" + "=" * 30)
+    print("批次翻譯報告")
+    print("=" * 30)
+    print(f"句數: {stats['sentences']}  快取命中: {stats['cache_hits']}  "
+          f"LLM 呼叫: {stats['llm_calls']} ({stats['batches']} 批)  失敗: {stats['failed']} 句")
+    print(f"總耗時: {seconds:.1f} 秒  吞吐量: {stats['sentences'] / seconds:.2f} 句/秒")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="整份文件批次翻譯 (中 -> 英)")
+    parser.add_argument("input")
+    parser.add_argument("-o", "--output", help="輸出檔 (預設 <輸入檔名>.en.txt)")
+    parser.add_argument("--workers", type=int, default=4, help="同時進行的 LLM 請求數")
+    parser.add_argument("--batch", type=int, default=8, help="每次請求合併的句數")
+    parser.add_argument("--check", action="store_true", help="附自我檢查，沒通過的句子重送一次")
+    args = parser.parse_args()
+
+    source = Path(args.input)
+    output = Path(args.output) if args.output else source.with_suffix(".en.txt")
+    print(f"快取檔案: {ch7_1.CACHE_FILE}")
+    with open(output, "w", encoding="utf-8") as out:
+        stats = translate_document(source.read_text(encoding="utf-8"), out,
+                                   workers=args.workers, batch_size=args.batch, check=args.check)
+    print(f"已寫入 {output}", file=sys.stderr)
+    report(stats)
@@ -1,35 +1,108 @@
-import random
 import time
 import json
-from typing import Annotated, TypedDict, Union, Literal
-from langchain_openai import ChatOpenAI
-from langchain_core.tools import tool
-from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage, ToolMessage, AIMessage
-from langgraph.graph import StateGraph, END, add_messages
-from langgraph.prebuilt import ToolNode
+import difflib
+import re
+from functools import cache
+from typing import TypedDict, Literal, List
 import os
+import sys
+from pydantic import BaseModel, Field
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from startup import maybe_show_graph
+from instrumentation import instrument_node, record_cache
 
 # ================= 配置與快取函式 =================
-llm = ChatOpenAI(
-    base_url="https://ws-02.wade0426.me/v1",
-    api_key="EMPTY",
-    model="google/gemma-3-27b-it",
-    temperature=0.7
-)
-
-CACHE_FILE = "translation_cache.json"
-
-def load_cache():
-    if not os.path.exists(CACHE_FILE): return {}
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f: return json.load(f)
-    except: return {}
-
-def save_cache(original: str, translated: str):
-    data = load_cache()
-    data[original] = translated
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+llm = lazy_llm("google/gemma-3-27b-it", endpoint="ws-02", temperature=0.7)
+# 翻譯 + 自我檢查合併成一次結構化輸出，用低溫度讓結果穩定
+translate_llm = lazy_llm("google/gemma-3-27b-it", endpoint="ws-02", temperature=0)
+
+CACHE_FILE = "translation_cache.jsonl"
+LEGACY = "--legacy" in sys.argv or os.getenv("CH7_1_LEGACY") == "1"  # 舊版：翻譯、審查各一次呼叫
+MAX_ATTEMPTS = 3
+SHORT_TEXT = int(os.getenv("CH7_1_SHORT_TEXT", "12"))            # 這個字數以下不做自我檢查
+SIMILAR_RATIO = float(os.getenv("CH7_1_SIMILAR_RATIO", "0.85"))  # 與快取原文相似度達此值就不做自我檢查
+
+def load_cache(path: str = CACHE_FILE):
+    """JSONL 快取：一行一筆 {"original", "translated"}，後寫的蓋過先寫的"""
+    data = {}
+    if not os.path.exists(path): return data
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                data[record["original"]] = record["translated"]
+            except (json.JSONDecodeError, KeyError, TypeError):  # 中斷時最後一行可能不完整
+                continue
+    return data
+
+def save_cache(original: str, translated: str, path: str = CACHE_FILE):
+    save_cache_many({original: translated}, path)
+
+def save_cache_many(pairs: dict, path: str = CACHE_FILE):
+    """追加寫入多筆 (不重寫整個檔案，批次翻譯每批一次)"""
+    with open(path, "a+b") as f:
+        if f.tell():  # 不要接在中斷時寫到一半的那一行後面
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n": f.write(b"\n")
+        for original, translated in pairs.items():
+            record = {"original": original, "translated": translated}
+            f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+
+def find_similar(original: str, data: dict) -> str | None:
+    """快取中與原文最相似 (difflib ratio >= SIMILAR_RATIO) 的原文"""
+    matches = difflib.get_close_matches(original, list(data), n=1, cutoff=SIMILAR_RATIO)
+    return matches[0] if matches else None
+
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;])|\n+")
+
+def split_sentences(text: str) -> List[str]:
+    """依中文句尾標點與換行切句 (標點留在句子裡)"""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+# ================= 翻譯引擎 (一次呼叫 = 翻譯 + 自我檢查，多句合併) =================
+class SentenceTranslation(BaseModel):
+    translation: str = Field(description="英文翻譯")
+    passed: bool = Field(default=True, description="自我檢查：翻譯是否忠實、通順、沒有漏譯")
+    issues: str = Field(default="", description="未通過時的具體問題")
+
+class BatchTranslation(BaseModel):
+    items: List[SentenceTranslation] = Field(description="依編號順序，每句一筆")
+
+def translate_batch(sentences: List[str], feedback: List[str] | None = None,
+                    check: bool = True, reference: str = "") -> tuple[List[SentenceTranslation], int]:
+    """
+    多句一次送出；check=True 時同一次回應裡附上每句的自我檢查結果。
+    回傳 (每句結果, LLM 呼叫次數)。模型回傳筆數不符時退回逐句翻譯。
+    """
+    lines = []
+    for i, sentence in enumerate(sentences):
+        lines.append(f"{i + 1}. {sentence}")
+        if feedback and feedback[i]:
+            lines.append(f"   (上一版的問題：{feedback[i]})")
+    prompt = "你是一名翻譯員，請將以下編號的中文句子逐句翻譯成英文，依編號順序輸出。\n"
+    if check:
+        prompt += "翻譯後請自我檢查每一句是否忠實、通順、沒有漏譯，並填寫 passed 與 issues。\n"
+    if reference:
+        prompt += f"可參考相似原文的既有譯文，保持用詞一致：{reference}\n"
+    prompt += "\n" + "\n".join(lines)
+
+    result = translate_llm.with_structured_output(BatchTranslation).invoke(prompt)
+    items = result.items
+    if len(items) == len(sentences):
+        if not check:
+            items = [SentenceTranslation(translation=item.translation) for item in items]
+        return items, 1
+    if len(sentences) == 1:
+        return items[:1] or [SentenceTranslation(translation="", passed=False, issues="模型沒有回傳翻譯")], 1
+    # 筆數對不上：逐句重送，確保順序正確
+    results, calls = [], 1
+    for i, sentence in enumerate(sentences):
+        item, n = translate_batch([sentence], [feedback[i]] if feedback else None, check, reference)
+        results.extend(item)
+        calls += n
+    return results, calls
 
 # ================= 1. 定義狀態 =================
 class State(TypedDict):
@@ -38,13 +111,23 @@ class State(TypedDict):
     critique: str
     attempts: int
     is_cache_hit: bool # 標記是否命中快取
+    llm_calls: int     # 這次翻譯用了幾次 LLM 呼叫
+    reference: str     # 相似快取的譯文 (沒有則為空)
+    skip_reflection: bool
+    sentences: List[str]
+    translations: List[str]
+    passed: List[bool]
+    issues: List[str]
+    cache_file: str    # 翻譯快取的路徑 (--compare 用暫存檔，不動全域設定)
 
+@instrument_node
 def check_cache_node(state: State):
     """檢查快取節點"""
     print("\n--- 檢查快取 (Check Cache) ---")
-    data = load_cache()
+    data = load_cache(state.get("cache_file") or CACHE_FILE)
     original = state["original_text"]
 
+    record_cache("translation", original in data)
     if original in data:
         print("✅ 命中快取！直接回傳結果。")
         return {
@@ -53,23 +136,71 @@ def check_cache_node(state: State):
         }
     else:
         print("❌ 未命中快取，準備開始翻譯流程...")
-        return {"is_cache_hit": False}
+        similar = find_similar(original, data)
+        if similar:
+            print(f"--- 找到相似的快取原文：{similar} (略過自我檢查) ---")
+        return {
+            "is_cache_hit": False,
+            "reference": data[similar] if similar else "",
+            "skip_reflection": bool(similar) or len(original) <= SHORT_TEXT,
+        }
+
+@instrument_node
+def translate_node(state: State):
+    """翻譯 + 自我檢查 (一次呼叫)；只重送沒通過的句子"""
+    sentences = state.get("sentences") or split_sentences(state["original_text"]) or [state["original_text"]]
+    translations = state.get("translations") or [""] * len(sentences)
+    passed = state.get("passed") or [False] * len(sentences)
+    issues = state.get("issues") or [""] * len(sentences)
+    pending = [i for i, ok in enumerate(passed) if not ok]
+    check = not state.get("skip_reflection")
 
+    print(f"\n--- 翻譯 (第 {state['attempts'] + 1} 次, {len(pending)}/{len(sentences)} 句{'，含自我檢查' if check else ''}) ---")
+    items, calls = translate_batch(
+        [sentences[i] for i in pending],
+        [issues[i] for i in pending],
+        check=check,
+        reference=state.get("reference", ""),
+    )
+    translations, passed, issues = list(translations), list(passed), list(issues)
+    for i, item in zip(pending, items):
+        translations[i], passed[i], issues[i] = item.translation, item.passed, item.issues
+        if not item.passed:
+            print(f"--- 第 {i + 1} 句未通過：{item.issues} ---")
+
+    return {
+        "sentences": sentences,
+        "translations": translations,
+        "passed": passed,
+        "issues": issues,
+        "translated_text": " ".join(t.strip() for t in translations),
+        "attempts": state["attempts"] + 1,
+        "llm_calls": state.get("llm_calls", 0) + calls,
+    }
+
+@instrument_node
 def translator_node(state: State):
     """翻譯節點"""
+    from langchain_core.messages import HumanMessage
+
     print(f"\n--- 翻譯嘗試 (第 {state['attempts'] + 1} 次) ---")
     prompt = f"你是一名翻譯員，請將以下中文翻譯成英文，不須任何解釋：'{state['original_text']}'"
     if state['critique']:
         prompt += f"\n\n上一輪的審查意見是：{state['critique']}。請根據意見修正翻譯。"
     response = llm.invoke([HumanMessage(content=prompt)])
-    return {"translated_text": response.content, "attempts": state['attempts'] + 1}
+    return {"translated_text": response.content, "attempts": state['attempts'] + 1,
+            "llm_calls": state.get("llm_calls", 0) + 1}
 
+@instrument_node
 def reflector_node(state: State):
     """審查節點"""
+    from langchain_core.messages import HumanMessage
+
     print("--- 審查中 (Reflection) ---")
-    prompt = f"原文：{state['original_text']}\n翻譯：{state['translated_text']}\n請檢查翻譯是否準確，若準確請回覆 PASS，否則請給出修正建議。"
+    prompt = (f"原文：{state['original_text']}\n翻譯：{state['translated_text']}\n"
+              "請檢查翻譯是否準確。第一個字只能是 PASS 或 FAIL；FAIL 時接著給出修正建議。")
     response = llm.invoke([HumanMessage(content=prompt)])
-    return {"critique": response.content}
+    return {"critique": response.content, "llm_calls": state.get("llm_calls", 0) + 1}
 
 # ================= 3. 定義路由 (Routers) =================
 
@@ -79,73 +210,151 @@ def cache_router(state: State) -> Literal["end", "translator"]:
         return "end"
     return "translator"
 
+def is_pass(critique: str) -> bool:
+    """審查結果的第一個詞是否為 PASS ("NOT PASS"、"無法 PASS" 這類都不算)"""
+    words = critique.strip().split(maxsplit=1)
+    return bool(words) and words[0].strip("*.:：,，!！").upper() == "PASS"
+
 def critique_router(state: State) -> Literal["translator", "end"]:
     """審查路由"""
-    if "PASS" in state["critique"].upper():
+    if is_pass(state["critique"]):
         print("--- 審查通過！ ---")
         return "end"
-    elif state["attempts"] >= 3:
+    elif state["attempts"] >= MAX_ATTEMPTS:
         print("--- 達到最大重試次數 ---")
         return "end"
     else:
         print(f"--- 退回重寫：{state['critique']} ---")
         return "translator"
 
-workflow = StateGraph(State)
+def self_check_router(state: State) -> Literal["translate", "end"]:
+    """合併模式：全部句子通過 (或不需檢查、達到上限) 就結束"""
+    if state.get("skip_reflection") or all(state["passed"]):
+        return "end"
+    if state["attempts"] >= MAX_ATTEMPTS:
+        print("--- 達到最大重試次數 ---")
+        return "end"
+    return "translate"
+
+@cache
+def get_app(legacy: bool = LEGACY):
+    """第一次使用時才組裝並編譯 Graph；legacy=True 為翻譯、審查分開呼叫的舊流程"""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(State)
+    workflow.add_node("check_cache", check_cache_node)
+    workflow.set_entry_point("check_cache")
+
+    if not legacy:
+        workflow.add_node("translate", translate_node)
+        workflow.add_conditional_edges("check_cache", cache_router, {"end": END, "translator": "translate"})
+        workflow.add_conditional_edges("translate", self_check_router, {"translate": "translate", "end": END})
+        return workflow.compile()
+
+    # 加入節點
+    workflow.add_node("translator", translator_node)
+    workflow.add_node("reflector", reflector_node)
+
+    # 設定快取後的路徑 (Cache Hit -> END; Cache Miss -> Translator)
+    workflow.add_conditional_edges(
+        "check_cache",
+        cache_router,
+        {
+            "end": END,
+            "translator": "translator"
+        }
+    )
 
-# 加入節點
-workflow.add_node("check_cache", check_cache_node) # 新節點
-workflow.add_node("translator", translator_node)
-workflow.add_node("reflector", reflector_node)
+    # 正常的翻譯迴圈路徑
+    workflow.add_edge("translator", "reflector")
+    workflow.add_conditional_edges(
+        "reflector",
+        critique_router,
+        {"translator": "translator", "end": END}
+    )
 
-# 一律先走 check_cache
-workflow.set_entry_point("check_cache")
+    return workflow.compile()
 
-# 設定快取後的路徑 (Cache Hit -> END; Cache Miss -> Translator)
-workflow.add_conditional_edges(
-    "check_cache",
-    cache_router,
-    {
-        "end": END,
-        "translator": "translator"
+def new_inputs(text: str, cache_file: str = CACHE_FILE) -> State:
+    return {
+        "original_text": text,
+        "cache_file": cache_file,
+        "attempts": 0,
+        "critique": "",
+        "is_cache_hit": False,
+        "translated_text": "", # 初始為空
+        "llm_calls": 0,
+        "reference": "",
+        "skip_reflection": False,
+        "sentences": [],
+        "translations": [],
+        "passed": [],
+        "issues": [],
     }
-)
 
-# 正常的翻譯迴圈路徑
-workflow.add_edge("translator", "reflector")
-workflow.add_conditional_edges(
-    "reflector",
-    critique_router,
-    {"translator": "translator", "end": END}
-)
+def translate(text: str, legacy: bool = LEGACY, cache_file: str = CACHE_FILE) -> tuple[State, float]:
+    """翻譯一段文字 (新結果寫入 cache_file)，回傳 (最終 state, 耗時秒數)"""
+    start = time.perf_counter()
+    result = get_app(legacy).invoke(new_inputs(text, cache_file))
+    # 如果不是從快取來的（代表是新算出來的），就寫入快取
+    if not result["is_cache_hit"]:
+        save_cache(result["original_text"], result["translated_text"], cache_file)
+    return result, time.perf_counter() - start
 
-app = workflow.compile()
-print(app.get_graph().draw_ascii())
+SAMPLE_TEXTS = [
+    "你好",
+    "今天天氣很好，我們去公園散步吧。",
+    "這份報告分析了過去三年的銷售數據。結果顯示線上通路成長了兩倍。我們建議明年增加數位行銷預算。",
+    "請在週五前把合約寄給法務部門審閱。",
+]
+
+def compare(texts: List[str]):
+    """同一批句子分別以舊流程與新流程翻譯 (各用一份空快取)，比較 LLM 呼叫次數與延遲"""
+    import tempfile
+
+    rows = {}
+    for legacy in (True, False):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, "cache.jsonl")
+            calls, seconds = [], []
+            for text in texts:
+                result, elapsed = translate(text, legacy, cache_file)
+                calls.append(result.get("llm_calls", 0))
+                seconds.append(elapsed)
+            rows["舊流程 (翻譯/審查分開)" if legacy else "新流程 (合併 + 略過)"] = (calls, seconds)
+
+    print("\n=========== 比較 ===========")
+    for name, (calls, seconds) in rows.items():
+        print(f"{name}: 平均 LLM 呼叫 {sum(calls) / len(calls):.2f} 次/翻譯, 平均延遲 {sum(seconds) / len(seconds):.2f} 秒")
 
 if __name__ == "__main__":
+    if "--compare" in sys.argv:
+        prewarm("ws-02")
+        compare(SAMPLE_TEXTS)
+        sys.exit()
+
     print(f"快取檔案: {CACHE_FILE}")
+    print(f"模式: {'舊流程 (翻譯/審查分開)' if LEGACY else '翻譯 + 自我檢查合併'}")
+    maybe_show_graph(get_app)
+    prewarm("ws-02")
+    history = []
 
     while True:
         user_input = input("\n請輸入要翻譯的中文 (exit/q 離開): ")
         if user_input.lower() in ["exit", "q"]: break
 
-        inputs = {
-            "original_text": user_input,
-            "attempts": 0,
-            "critique": "",
-            "is_cache_hit": False,
-            "translated_text": "" # 初始為空
-        }
-
         # 執行 Graph
-        result = app.invoke(inputs)
-
-        # 如果不是從快取來的（代表是新算出來的），就寫入快取
+        result, elapsed = translate(user_input)
         if not result["is_cache_hit"]:
-            save_cache(result["original_text"], result["translated_text"])
             print("(已將新翻譯寫入快取)")
+            history.append((result.get("llm_calls", 0), elapsed))
 
         print("\n=========== 最終結果 ===========")
         print(f"原文: {result['original_text']}")
         print(f"翻譯: {result['translated_text']}")
         print(f"來源: {'快取 (Cache)' if result['is_cache_hit'] else '生成 (LLM)'}")
+        print(f"LLM 呼叫: {result.get('llm_calls', 0)} 次, 耗時 {elapsed:.2f} 秒")
+
+    if history:
+        print(f"\n平均每次翻譯: LLM 呼叫 {sum(c for c, _ in history) / len(history):.2f} 次, "
+              f"延遲 {sum(t for _, t in history) / len(history):.2f} 秒")
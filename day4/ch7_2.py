@@ -1,30 +1,39 @@
 import os
 import json
+import re
 import time
+from functools import cache
 from typing import TypedDict
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, END
-
-llm = ChatOpenAI(
-    base_url="https://ws-02.wade0426.me/v1",
-    api_key="EMPTY",
-    model="/models/gpt-oss-120b",
-    temperature=0.7
-)
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from startup import maybe_show_graph
+from instrumentation import METRICS, instrument_node, record_cache
+from router import get_router
+
+llm = lazy_llm("/models/gpt-oss-120b", endpoint="ws-02", temperature=0.7)
 
 # 2. 【新增】快速通道專用的模型實例
 # 指向你指定的 ws-05 URL
-fast_llm = ChatOpenAI(
-    model="Qwen3-VL-8B-Instruct-BF16.gguf",
-    api_key="EMPTY", # 假設 Key 通用
-    base_url="https://ws-05.huannago.com/v1",
-    temperature=0
-)
+fast_llm = lazy_llm("Qwen3-VL-8B-Instruct-BF16.gguf", endpoint="ws-05", temperature=0)
 
 # 設定快取檔案名稱
 CACHE_FILE = "qa_cache.json"
 
+# 串接模式：一律先由 fast_llm 回答並即時輸出，信心不足才升級給專家模型
+CASCADE = "--cascade" in sys.argv or os.getenv("CH7_2_CASCADE") == "1"
+CONFIDENCE_THRESHOLD = int(os.getenv("CH7_2_CONFIDENCE", "7"))  # 自評 0-10，低於此值就升級
+# 標記的開頭與完整格式都接受半形與全形冒號 (中文模型常輸出「[信心：8]」)
+CONFIDENCE_MARK = re.compile(r"\[信心[:：]")
+CONFIDENCE_PATTERN = re.compile(r"\[信心[:：]\s*(\d+)\s*\]")
+_MARK_PREFIXES = ("[信心", "[信", "[")  # 串流結尾可能是標記的前半段
+CASCADE_PROMPT = (
+    "請直接回答使用者的問題。回答完後另起一行，以 [信心:N] 的格式自評你對答案正確性的信心，"
+    "N 為 0 到 10 的整數；不確定、需要專業知識或最新資訊時請給低分。"
+)
+LATENCIES = []  # (來源, 秒數)，離開時輸出 p50 / p95
+
 # ================= 工具函式 (維持原樣) =================
 
 def get_clean_key(text: str) -> str:
@@ -69,13 +78,18 @@ class State(TypedDict):
     question: str
     answer: str
     source: str # CACHE / FAST / LLM
+    route: dict # router.py 的路由決策
+    draft: str # 串接模式下 fast_llm 的初稿
+    confidence: int # 初稿的自評信心 (0-10，沒有標記時為 -1)
 
+@instrument_node
 def check_cache_node(state: State):
     """檢查快取"""
     print(f"\n[系統] 收到問題: {state['question']}")
     cache_data = load_cache()
     clean_query = get_clean_key(state['question'])
 
+    record_cache("qa", clean_query in cache_data)
     if clean_query in cache_data:
         print("--- 命中快取 (Cache Hit) ---")
         return {
@@ -84,26 +98,41 @@ def check_cache_node(state: State):
         }
     else:
         print("--- 快取未命中 (Cache Miss) ---")
-        return {"source": "MISS"}
+        # 路由器在這裡決定，條件邊只讀結果 (條件邊函式不能寫入 State)
+        decision = get_router().route(state['question'])
+        print(f"--- 複雜度 {decision['score']:.2f} -> {decision['route']} ({decision['reason']}) ---")
+        return {"source": "MISS", "route": decision}
 
+@instrument_node
 def fast_reply_node(state: State):
+    from langchain_core.messages import HumanMessage
+
     print("--- 進入快速通道 (Fast Track API) ---")
 
+    start = time.perf_counter()
     response = fast_llm.invoke([HumanMessage(content=state['question'])])
+    get_router().observe(state['route'], time.perf_counter() - start)
 
     return {
         "answer": response.content,
         "source": "FAST_TRACK_API"
     }
 
+@instrument_node
 def expert_node(state: State):
     """
     慢速通道：呼叫 LLM 並使用「流式傳輸」
     """
+    from langchain_core.messages import HumanMessage
+
     print("--- 進入專家模式 (LLM Expert) ---")
 
     prompt = f"請以專業的角度回答以下問題：{state['question']}"
+    if state.get('draft'):
+        print("--- 快速模型信心不足，由專家模型提供改進後的回答 ---")
+        prompt += f"\n\n以下是另一個模型的初步回答，請修正錯誤並補充不足之處，直接給出完整的最終回答：\n{state['draft']}"
 
+    start = time.perf_counter()
     chunks = llm.stream([HumanMessage(content=prompt)])
 
     full_answer = ""
@@ -115,6 +144,8 @@ def expert_node(state: State):
             print(content, end="", flush=True)
             full_answer += content
     print("\n")
+    # 串接模式升級時 state['route'] 是 fast 的決策，延遲要記在 expert 上
+    get_router().observe(dict(state['route'], route="expert"), time.perf_counter() - start)
 
     clean_key = get_clean_key(state['question'])
     save_cache({clean_key: full_answer})
@@ -125,64 +156,163 @@ def expert_node(state: State):
         "source": "LLM_EXPERT"
     }
 
+def stream_until_mark(chunks) -> str:
+    """邊收邊印，但信心標記 ([信心:N] / [信心：N]) 不印給使用者；回傳完整文字"""
+    full, shown = "", 0
+    for chunk in chunks:
+        full += chunk.content or ""
+        match = CONFIDENCE_MARK.search(full)
+        if match:
+            end = match.start()
+        else:
+            # 結尾可能是標記的前半段，先保留不印
+            end = len(full)
+            for prefix in _MARK_PREFIXES:
+                if full.endswith(prefix):
+                    end -= len(prefix)
+                    break
+        if end > shown:
+            print(full[shown:end], end="", flush=True)
+            shown = end
+    return full
+
+@instrument_node
+def cascade_fast_node(state: State):
+    """串接模式第一層：fast_llm 先回答 (即時輸出)，並在結尾附上自評信心"""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    print("--- 串接模式：快速模型先回答 ---")
+    print("⚡ ", end="", flush=True)
+    start = time.perf_counter()
+    full = stream_until_mark(fast_llm.stream([SystemMessage(content=CASCADE_PROMPT), HumanMessage(content=state['question'])]))
+    get_router().observe(dict(state['route'], route="fast"), time.perf_counter() - start)
+
+    match = CONFIDENCE_PATTERN.search(full)
+    confidence = int(match.group(1)) if match else -1  # 沒有照格式自評視為沒把握
+    draft = full[:match.start()].strip() if match else full.strip()
+    print(f"\n--- 自評信心: {confidence if confidence >= 0 else '未標示'} / 10 ---")
+    # 是否需要升級回饋給路由器當訓練標籤 (副作用放在節點裡，條件邊只讀 State)
+    get_router().feedback(state['route'], needs_expert=confidence < CONFIDENCE_THRESHOLD)
+    return {"draft": draft, "confidence": confidence}
+
+def confidence_router(state: State):
+    """信心夠就採用快速模型的答案，否則升級給專家"""
+    return "expert" if state['confidence'] < CONFIDENCE_THRESHOLD else "accept"
+
+@instrument_node
+def accept_fast_node(state: State):
+    return {"answer": state['draft'], "source": "CASCADE_FAST"}
+
 def master_router(state: State):
     """主路由控制器"""
     if state.get("answer"):
         return "end"
 
-    question = state['question']
-    # 只要有這些打招呼的詞，就走 Fast Track (ws-05)
-    if any(word in question for word in ["你好", "嗨", "早安", "哈囉"]):
-        return "fast"
-    else:
-        return "expert"
-
-workflow = StateGraph(State)
-
-workflow.add_node("check_cache", check_cache_node)
-workflow.add_node("fast_bot", fast_reply_node)
-workflow.add_node("expert_bot", expert_node)
-
-workflow.set_entry_point("check_cache")
-
-workflow.add_conditional_edges(
-    "check_cache",
-    master_router,
-    {
-        "end": END,
-        "fast": "fast_bot",
-        "expert": "expert_bot"
-    }
-)
-
-workflow.add_edge("fast_bot", END)
-workflow.add_edge("expert_bot", END)
-
-app = workflow.compile()
-print(app.get_graph().draw_ascii())
+    if CASCADE:
+        return "cascade"
+    # 依問題複雜度分數與各路由的延遲 / 成本預算決定 (見 router.py)
+    return state['route']['route']
+
+@cache
+def get_app():
+    """第一次使用時才組裝並編譯 Graph"""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(State)
+
+    workflow.add_node("check_cache", check_cache_node)
+    workflow.add_node("fast_bot", fast_reply_node)
+    workflow.add_node("expert_bot", expert_node)
+    workflow.add_node("cascade_fast", cascade_fast_node)
+    workflow.add_node("accept_fast", accept_fast_node)
+
+    workflow.set_entry_point("check_cache")
+
+    workflow.add_conditional_edges(
+        "check_cache",
+        master_router,
+        {
+            "end": END,
+            "fast": "fast_bot",
+            "expert": "expert_bot",
+            "cascade": "cascade_fast"
+        }
+    )
+    workflow.add_conditional_edges(
+        "cascade_fast",
+        confidence_router,
+        {"accept": "accept_fast", "expert": "expert_bot"}
+    )
+
+    workflow.add_edge("fast_bot", END)
+    workflow.add_edge("expert_bot", END)
+    workflow.add_edge("accept_fast", END)
+
+    return workflow.compile()
+
+def ask(question: str):
+    """執行一次 Graph，記錄來源與延遲"""
+    start_time = time.perf_counter()
+    result = get_app().invoke({"question": question})
+    elapsed = time.perf_counter() - start_time
+    LATENCIES.append((result['source'], elapsed))
+    return result, elapsed
+
+def latency_report():
+    """各層服務的比例與 p50 / p95 延遲 (快取命中另計，不算進模型層)"""
+    if not LATENCIES:
+        return
+    def pct(values, q):
+        values = sorted(values)
+        return values[min(int(len(values) * q), len(values) - 1)]
+
+    print("\n" + "=" * 30)
+    print(f"延遲報告 ({'串接模式' if CASCADE else '路由模式'})")
+    print("=" * 30)
+    model_calls = [(s, t) for s, t in LATENCIES if s != "CACHE"]
+    fast = [t for s, t in model_calls if s in ("CASCADE_FAST", "FAST_TRACK_API")]
+    if model_calls:
+        print(f"快速模型服務比例: {len(fast) / len(model_calls):.0%} ({len(fast)}/{len(model_calls)})")
+    for name, values in [("全部", [t for _, t in LATENCIES]), ("模型回答", [t for _, t in model_calls]),
+                         ("快速模型", fast), ("專家模型", [t for s, t in model_calls if s == "LLM_EXPERT"])]:
+        if values:
+            print(f"{name:<6} {len(values):>4} 次  p50 {pct(values, 0.5):7.2f} s  p95 {pct(values, 0.95):7.2f} s")
 
 if __name__ == "__main__":
     print(f"快取檔案將儲存於: {os.path.abspath(CACHE_FILE)}")
+    print(f"模式: {'串接 (快速模型先答，信心 < ' + str(CONFIDENCE_THRESHOLD) + ' 才升級專家)' if CASCADE else '複雜度路由'}")
     print("提示：試著輸入 '你好' 測試 Fast API，輸入專業問題測試 Expert API。")
+    print("路由決策記錄於 router.py 的 ROUTER_LOG_FILE，可用 python router.py train 重新訓練。")
+    maybe_show_graph(get_app)
+    prewarm("ws-02", "ws-05")
+
+    # --replay questions.txt：依序問完檔案中的每一行並輸出延遲報告 (比較兩種模式用)
+    if "--replay" in sys.argv:
+        questions = Path(sys.argv[sys.argv.index("--replay") + 1]).read_text(encoding="utf-8").splitlines()
+        for question in filter(None, map(str.strip, questions)):
+            ask(question)
+        latency_report()
+        sys.exit()
 
     while True:
         user_input = input("\n請輸入問題 (輸入 q 離開): ")
         if user_input.lower() == 'q':
+            print("節點延遲:")
+            METRICS.summary()
+            print("LLM 延遲:")
+            METRICS.summary("llm_latency_seconds")
+            latency_report()
             break
 
-        inputs = {"question": user_input}
-
-        start_time = time.time()
         try:
-            result = app.invoke(inputs)
-            end_time = time.time()
+            result, elapsed = ask(user_input)
 
             print("-" * 30)
             print(f"來源: [{result['source']}]")
-            print(f"耗時: {end_time - start_time:.4f} 秒")
+            print(f"耗時: {elapsed:.4f} 秒")
 
-            # 只有非 Expert (Cache 或 Fast API) 需要在這裡印出結果
-            if result['source'] != "LLM_EXPERT":
+            # Expert 與串接模式的快速回答都已在上方流式輸出
+            if result['source'] in ("CACHE", "FAST_TRACK_API"):
                 print(f"回答: {result['answer']}")
             else:
                 print("(回答已於上方流式輸出完畢)")
@@ -0,0 +1,165 @@
+"""
+hw4 提示詞的上下文預算
+
+- token 數以共用的 token_estimate.estimate_tokens 估算 (不載入 tokenizer)
+- 證據 (VLM 讀到的網頁) 以 list[dict] 累積：{"url", "title", "content", "loop", "compressed"}
+- add_evidence: 新一輪加入時，把較舊迴圈的內容做抽取式壓縮 (每頁只壓一次，不再重算)
+- fit_evidence: 依與問題的相關度 + 新舊排序，去掉重複句子，塞進指定的 token 預算
+- PromptStats: 每個節點的提示詞 token 數與 time-to-first-token
+"""
+import math
+import os
+import re
+from collections import defaultdict
+
+from token_estimate import CJK, estimate_tokens
+
+PLANNER_BUDGET = int(os.getenv("HW4_PLANNER_BUDGET", "1500"))    # 規劃器提示詞中證據的 token 上限
+FINAL_BUDGET = int(os.getenv("HW4_FINAL_BUDGET", "4000"))        # 最終回答提示詞中證據的 token 上限
+SEARCH_BUDGET = int(os.getenv("HW4_SEARCH_BUDGET", "300"))       # 搜尋結果摘要的 token 上限
+COMPRESSED_TOKENS = int(os.getenv("HW4_COMPRESSED_TOKENS", "200"))  # 舊迴圈每頁壓縮後的上限
+
+_SENTENCE = re.compile(r"(?<=[。！？!?；;])|(?<=\.)\s+|\n+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in _SENTENCE.split(text) if s and s.strip()]
+
+
+def _terms(text: str) -> set[str]:
+    """英數字詞 + 中文字的 bigram"""
+    text = text.lower()
+    terms = set(_WORD.findall(text))
+    cjk = "".join(CJK.findall(text))
+    terms.update(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return terms
+
+
+def relevance(question_terms: set[str], text: str) -> float:
+    terms = _terms(text)
+    if not terms or not question_terms:
+        return 0.0
+    return len(question_terms & terms) / math.sqrt(len(terms))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """依句子截斷到 budget 以內；單句就超過時直接截字"""
+    if estimate_tokens(text) <= budget:
+        return text
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        cost = estimate_tokens(sentence)
+        if used + cost > budget:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return " ".join(kept)
+    return text[:budget]
+
+
+def compress(text: str, question: str, budget: int = COMPRESSED_TOKENS) -> str:
+    """抽取式壓縮：挑與問題最相關的句子，維持原本順序"""
+    if estimate_tokens(text) <= budget:
+        return text
+    q = _terms(question)
+    sentences = split_sentences(text)
+    ranked = sorted(range(len(sentences)), key=lambda i: -relevance(q, sentences[i]))
+    chosen, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i])
+        if used + cost > budget:
+            continue
+        chosen.add(i)
+        used += cost
+    return " ".join(sentences[i] for i in sorted(chosen)) or truncate_to_tokens(text, budget)
+
+
+def add_evidence(evidence: list[dict], new_items: list[dict], question: str, current_loop: int) -> list[dict]:
+    """加入本輪證據；之前迴圈尚未壓縮的項目壓縮一次"""
+    merged = []
+    for item in evidence:
+        if not item.get("compressed") and item["loop"] < current_loop:
+            item = {**item, "content": compress(item["content"], question), "compressed": True}
+        merged.append(item)
+    known = {item["url"] for item in merged}
+    merged.extend(
+        {**item, "loop": current_loop, "compressed": False}
+        for item in new_items
+        if item["url"] not in known
+    )
+    return merged
+
+
+def fit_evidence(evidence: list[dict], question: str, budget: int) -> tuple[str, int, int]:
+    """
+    依相關度排序、去除重複句子後組成提示詞片段。
+    回傳 (文字, 放入的頁數, 全部頁數)。
+    """
+    q = _terms(question)
+    latest = max((item["loop"] for item in evidence), default=0)
+    ranked = sorted(
+        evidence,
+        key=lambda item: relevance(q, item["content"]) + 0.1 * (item["loop"] == latest),
+        reverse=True,
+    )
+    seen, sections, used = set(), [], 0
+    for item in ranked:
+        sentences = []
+        for sentence in split_sentences(item["content"]):
+            key = re.sub(r"\s+", "", sentence)
+            if key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+        if not sentences:
+            continue
+        header = f"### {item['title']}\n來源: {item['url']}\n"
+        remaining = budget - used - estimate_tokens(header)
+        if remaining < 50:
+            break
+        body = truncate_to_tokens(" ".join(sentences), remaining)
+        sections.append(header + body)
+        used += estimate_tokens(header) + estimate_tokens(body)
+    return "\n\n".join(sections), len(sections), len(evidence)
+
+
+def fit_search_results(results: list[dict], budget: int = SEARCH_BUDGET) -> str:
+    """搜尋結果只保留標題、網址與摘要，塞進預算內"""
+    lines, used = [], 0
+    for r in results or []:
+        line = f"- {r.get('title', '無標題')} ({r.get('url', '無連結')})"
+        snippet = r.get("content") or r.get("snippet")
+        if snippet:
+            line += f": {truncate_to_tokens(snippet, 60)}"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+class PromptStats:
+    """每個節點的提示詞 token 數與 time-to-first-token (秒)"""
+
+    def __init__(self):
+        self.records = defaultdict(list)
+
+    def reset(self):
+        self.records.clear()
+
+    def record(self, node: str, prompt: str, ttft: float):
+        tokens = estimate_tokens(prompt)
+        self.records[node].append((tokens, ttft))
+        print(f"--- [{node}] 提示詞 ≈ {tokens} tokens, TTFT {ttft:.2f} 秒 ---")
+
+    def report(self):
+        for node, rows in self.records.items():
+            tokens = [t for t, _ in rows]
+            ttfts = [s for _, s in rows]
+            print(f"{node}: {len(rows)} 次, 提示詞 平均 {sum(tokens) / len(tokens):.0f} / 最大 {max(tokens)} tokens, "
+                  f"TTFT 平均 {sum(ttfts) / len(ttfts):.2f} 秒")
+
+
+PROMPT_STATS = PromptStats()
@@ -1,25 +1,41 @@
 import os
 import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import cache
 from typing import TypedDict, Literal, List, Annotated
 import operator
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.graph import StateGraph, END
 from pydantic import BaseModel, Field
-from langchain_google_vertexai import ChatVertexAI
-# 導入自定義工具
-from search_searxng import search_searxng
-from vlm_read_website import vlm_read_website
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import lazy_llm, prewarm
+from startup import maybe_show_graph
+from instrumentation import METRICS, instrument_node, record_cache
+from tracing import get_tracer
+from research_cache import get_research_cache, page_validators
+from context_budget import (
+    FINAL_BUDGET, PLANNER_BUDGET, PROMPT_STATS, add_evidence, fit_evidence, fit_search_results,
+)
+# 自定義工具 (search_searxng / vlm_read_website) 於節點內用到才載入
 
 # --- 配置 ---
 CACHE_FILE = "hw4_cache.json"
+MAX_LOOPS = 3
+VLM_TOP_K = int(os.getenv("HW4_VLM_TOP_K", "3"))                 # 每輪同時讀取的搜尋結果數
+VLM_URL_TIMEOUT = float(os.getenv("HW4_VLM_URL_TIMEOUT", "60"))  # 單一網頁的讀取上限 (秒，從該頁開始讀取算起)
+# 推測執行：規劃器思考時先預取下一輪的關鍵字、搜尋結果與網頁
+SPECULATIVE = "--speculative" in sys.argv or os.getenv("HW4_SPECULATIVE") == "1"
+PREFETCH_STATS = Counter()
+# 串流模式：逐節點輸出進度，最終答案邊產生邊輸出
+STREAM = "--stream" in sys.argv or os.getenv("HW4_STREAM") == "1"
 
-llm = ChatOpenAI(
-    base_url="https://ws-05.huannago.com/v1",
-    api_key="EMPTY",
-    model="Qwen3-VL-8B-Instruct-BF16.gguf",
-    temperature=0.7
-)
+llm = lazy_llm("Qwen3-VL-8B-Instruct-BF16.gguf", endpoint="ws-05", temperature=0.7, stream_usage=True)
+# 規劃器輸出結構化 JSON，串流模式下也不需要逐字產生 (共用同一組連線池)
+planner_llm = lazy_llm("Qwen3-VL-8B-Instruct-BF16.gguf", endpoint="ws-05", temperature=0.7, disable_streaming=True)
+# from langchain_google_vertexai import ChatVertexAI
 # llm = ChatVertexAI(
 #     model="gemini-2.5-pro",
 #     project="gen-lang-client-0342191491",  # <--- 關鍵！這裡填對，錢就從抵免額出
@@ -32,11 +48,14 @@ class State(TypedDict):
     answer: str
     source: str  # CACHE / LLM
     search_results: List[dict]  # SearXNG 搜尋結果
-    vlm_content: str  # VLM 讀取的內容
+    vlm_content: str  # 本輪 VLM 讀取的內容
+    evidence: List[dict]  # 累積的證據 (舊迴圈已壓縮)，見 context_budget
     loop_count: int   # 防止無限迴圈
     reasoning: str    # 規劃器的思考過程
     current_query: str
     decision: Literal["sufficient", "insufficient"] # 決策結果
+    visited_urls: Annotated[List[str], operator.add]  # 本次查證已讀過的網址
+    prefetch: object  # 推測執行中的 Prefetch (無則為 None)
 
 # --- 輔助函數 ---
 def load_cache():
@@ -56,11 +75,15 @@ def save_cache(new_data):
 
 # --- 節點 (Nodes) ---
 
+@instrument_node
 def check_cache_node(state: State):
     """1. 檢查快取"""
     print(f"\n[系統] 正在檢查快取：{state['question']}")
+    PREFETCH_STATS.clear()
+    PROMPT_STATS.reset()
     cache_data = load_cache()
     
+    record_cache("hw4_answer", state['question'] in cache_data)
     if state['question'] in cache_data:
         print("--- 命中快取 (Cache Hit) ---")
         return {
@@ -74,6 +97,7 @@ def check_cache_node(state: State):
             "source": "LLM", 
             "loop_count": 0,
             "vlm_content": "",
+            "evidence": [],
             "search_results": []
         }
 
@@ -81,61 +105,194 @@ class PlannerDecision(BaseModel):
     reasoning: str = Field(description="分析目前資訊是否足夠回答問題")
     decision: Literal["sufficient", "insufficient"] = Field(description="決定是否回答或繼續搜尋")
 
+class Prefetch:
+    """
+    推測執行：規劃器還在思考時，先生成下一輪的關鍵字、搜尋並開始讀取網頁。
+    規劃器判定 sufficient 就 cancel()；已經在跑的網頁讀取會自然結束 (結果仍寫入網頁快取)。
+    pages / started 由背景工作填入、cancel() 與 vlm_process_node 讀取，一律在 _lock 內存取。
+    """
+
+    def __init__(self, state: State):
+        self.cancelled = threading.Event()
+        self.pages = {}    # url -> Future
+        self.started = {}  # url -> 開始讀取的時間 (monotonic)，單頁逾時從這裡算起
+        self._lock = threading.Lock()
+        self._page_pool = None
+        self.future = _prefetch_pool().submit(self._run, state["question"], state.get("visited_urls") or [])
+
+    def _run(self, question: str, visited: list):
+        query = generate_query(question)
+        if self.cancelled.is_set():
+            return query, None
+        results = run_search(query)
+        targets = select_targets(results, visited)
+        if targets and not self.cancelled.is_set():
+            self._page_pool = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="vlm-prefetch")
+            for r in targets:
+                with self._lock:
+                    # 在鎖內檢查：cancel() 之後不會再送出新的讀取
+                    if self.cancelled.is_set():
+                        break
+                    self.started[r["url"]] = time.monotonic()
+                    self.pages[r["url"]] = self._page_pool.submit(_read_page, r["url"], r.get("title", "無標題"))
+            self._page_pool.shutdown(wait=False)
+        return query, results
+
+    def snapshot(self) -> dict:
+        """url -> (Future, 開始讀取的時間)"""
+        with self._lock:
+            return {url: (future, self.started[url]) for url, future in self.pages.items()}
+
+    def result(self):
+        """(關鍵字, 搜尋結果)；會等背景工作完成"""
+        return self.future.result()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            pages = list(self.pages.values())
+        self.future.cancel()
+        for f in pages:
+            f.cancel()
+        PREFETCH_STATS["cancelled"] += 1
+
+
+@cache
+def _prefetch_pool() -> ThreadPoolExecutor:
+    # 被取消的預取可能還在跑目前這一步 (產生關鍵字或搜尋)，多一條執行緒才不會擋住下一次預取
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+
+@instrument_node
 def planner_node(state: State):
     """2. 規劃器 / 決策節點"""
     current_loop = state.get("loop_count", 0)
     print(f"\n[系統] 規劃器正在思考... (目前迴圈次數: {current_loop})")
     
     # 檢查迴圈限制
-    if current_loop >= 3:
+    if current_loop >= MAX_LOOPS:
         print("--- 達到迴圈限制，強制回答 ---")
-        return {"decision": "sufficient", "reasoning": "達到迴圈限制"}
+        return {"decision": "sufficient", "reasoning": "達到迴圈限制", "prefetch": None}
 
+    prefetch = Prefetch(state) if SPECULATIVE else None
+
+    evidence_text, used, total = fit_evidence(state.get("evidence") or [], state["question"], PLANNER_BUDGET)
+    if total:
+        print(f"--- 證據: 放入 {used}/{total} 頁 ---")
     prompt = f"""
     使用者問題: {state['question']}
     
     目前收集的資訊:
-    {state.get('vlm_content', '無')}
+    {evidence_text or '無'}
     
     搜尋結果:
-    {str(state.get('search_results', []))[:500]}...
+    {fit_search_results(state.get('search_results', [])) or '無'}
     
     請判斷目前收集的資訊是否足以準確回答使用者的問題。
     如果是，輸出 'sufficient'。
     如果否，輸出 'insufficient' 以執行更多搜尋/研究。
     """
     
-    structured_llm = llm.with_structured_output(PlannerDecision)
-    result = structured_llm.invoke(prompt)
+    structured_llm = planner_llm.with_structured_output(PlannerDecision)
+    start = time.perf_counter()
+    try:
+        # 結構化輸出無法串流，TTFT 即完整回應時間
+        result = structured_llm.invoke(prompt)
+        PROMPT_STATS.record("planner", prompt, time.perf_counter() - start)
+    except BaseException:
+        if prefetch:
+            prefetch.cancel()
+        raise
     
     print(f"--- 決策: {result.decision} ({result.reasoning}) ---")
-    return {"decision": result.decision, "reasoning": result.reasoning}
+    if prefetch and result.decision == "sufficient":
+        print("--- 取消預取 ---")
+        prefetch.cancel()
+        prefetch = None
+    return {"decision": result.decision, "reasoning": result.reasoning, "prefetch": prefetch}
 
-def query_gen_node(state: State):
-    """3. 生成搜尋關鍵字"""
-    print("\n[系統] 正在生成搜尋關鍵字...")
-    
+def generate_query(question: str) -> str:
     try:
-        prompt = f"根據問題 '{state['question']}'，生成一個具體的 Google 搜尋關鍵字以尋找答案。僅輸出關鍵字文字。"
+        prompt = f"根據問題 '{question}'，生成一個具體的 Google 搜尋關鍵字以尋找答案。僅輸出關鍵字文字。"
         # 加入超時控制 (如果模型支援 timeout 參數，否則標準 invoke 可能不支援，這裡加 try-except 是核心)
+        start = time.perf_counter()
         response = llm.invoke(prompt)
-        query = response.content.strip().replace('"', '')
-        print(f"--- 關鍵字: {query} ---")
-        return {"current_query": query}
+        PROMPT_STATS.record("query_gen", prompt, time.perf_counter() - start)
+        return response.content.strip().replace('"', '')
     except Exception as e:
         print(f"❌ 生成關鍵字失敗: {e}")
-        return {"current_query": state['question']} 
+        return question
+
+@instrument_node
+def query_gen_node(state: State):
+    """3. 生成搜尋關鍵字"""
+    print("\n[系統] 正在生成搜尋關鍵字...")
+    prefetch = state.get("prefetch")
+    if prefetch is not None:
+        query, _ = prefetch.result()
+        PREFETCH_STATS["used"] += 1
+        print(f"--- 關鍵字 (預取): {query} ---")
+        return {"current_query": query}
+
+    query = generate_query(state["question"])
+    print(f"--- 關鍵字: {query} ---")
+    return {"current_query": query}
 
+def run_search(query: str) -> list:
+    research_cache = get_research_cache()
+    results = research_cache.get_search(query)
+    if results is not None:
+        print("--- 搜尋快取命中 ---")
+        return results
+
+    from search_searxng import search_searxng
+    
+    with get_tracer().span("search_searxng", query=query):
+        results = search_searxng(query, limit=max(3, VLM_TOP_K))
+    if results:
+        research_cache.put_search(query, results)
+    return results
+
+@instrument_node
 def search_tool_node(state: State):
     """4. 執行搜尋"""
     query = state.get("current_query", state["question"])
     print(f"\n[系統] 正在搜尋: {query}")
-    
-    results = search_searxng(query, limit=3)
-    return {"search_results": results}
+    prefetch = state.get("prefetch")
+    if prefetch is not None:
+        return {"search_results": prefetch.result()[1]}
+    return {"search_results": run_search(query)}
+
+def _read_page(url: str, title: str):
+    """讀取單一網頁 (網頁內容沒變就沿用快取)，回傳 (內容, 耗時秒數, 是否來自快取)"""
+    start = time.perf_counter()
+    research_cache = get_research_cache()
+    with get_tracer().span("page_validators", url=url):
+        validators = page_validators(url)
+    content = research_cache.get_page(url, validators)
+    if content is not None:
+        return content, time.perf_counter() - start, True
+
+    from vlm_read_website import vlm_read_website
 
+    with get_tracer().span("vlm_read_website", url=url):
+        content = vlm_read_website(url, title)
+    if content:
+        research_cache.put_page(url, validators, content)
+    return content, time.perf_counter() - start, False
+
+def select_targets(results: list, visited: list, count_dedup: bool = False) -> list:
+    """前 k 個有 URL、且這次查證還沒讀過的結果"""
+    visited = set(visited)
+    with_url = [r for r in results or [] if r.get("url")]
+    fresh = [r for r in with_url if r["url"] not in visited]
+    if count_dedup:
+        get_research_cache().stats["url_dedup"] += len(with_url) - len(fresh)
+    return fresh[:VLM_TOP_K]
+
+@instrument_node
 def vlm_process_node(state: State):
-    """5. 使用 VLM 讀取網站"""
+    """5. 使用 VLM 同時讀取前 k 個搜尋結果，合併後交給規劃器"""
     results = state.get("search_results", [])
     current_loop = state.get("loop_count", 0)
     
@@ -143,45 +300,94 @@ def vlm_process_node(state: State):
         print("--- 沒有搜尋結果可供讀取 ---")
         return {
             "vlm_content": "未找到搜尋結果。",
-            "loop_count": current_loop + 1
+            "loop_count": current_loop + 1,
+            "prefetch": None
         }
     
-    # 選擇第一個有效的 URL
-    target_url = results[0].get("url")
-    title = results[0].get("title", "無標題")
+    targets = select_targets(results, state.get("visited_urls") or [], count_dedup=True)
     
-    if not target_url:
+    if not targets:
+        print("--- 搜尋結果都已讀過或沒有有效的 URL ---")
         return {
-            "vlm_content": "搜尋結果中沒有有效的 URL。",
-            "loop_count": current_loop + 1
+            "vlm_content": "搜尋結果都已讀過或沒有有效的 URL。",
+            "loop_count": current_loop + 1,
+            "prefetch": None
         }
         
-    print(f"\n[系統] VLM 正在讀取: {target_url}")
-    content = vlm_read_website(target_url, title)
+    print(f"\n[系統] VLM 正在同時讀取 {len(targets)} 個網頁 (單頁上限 {VLM_URL_TIMEOUT:.0f} 秒)")
+    start = time.perf_counter()
+    # 推測執行時已經開始讀的網頁直接沿用
+    prefetch = state.get("prefetch")
+    prefetched = prefetch.snapshot() if prefetch is not None else {}
+    missing = [r for r in targets if r["url"] not in prefetched]
+    pool = ThreadPoolExecutor(max_workers=max(len(missing), 1), thread_name_prefix="vlm")
+    futures = {}  # future -> (搜尋結果, 這一頁的讀取期限)
+    for r in targets:
+        if r["url"] in prefetched:
+            future, started = prefetched[r["url"]]
+        else:
+            future, started = pool.submit(_read_page, r["url"], r.get("title", "無標題")), time.monotonic()
+        futures[future] = (r, started + VLM_URL_TIMEOUT)
+    # 每一頁各自計時 (預取的頁面從預取開始算)；各頁同時在讀，依序等到各自的期限即可
+    for future, (_, deadline) in futures.items():
+        wait([future], timeout=max(deadline - time.monotonic(), 0))
+    # 逾時的網頁不再等待 (背景執行緒跑完自行結束)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    sections, pages = [], []
+    for future, (r, _) in futures.items():
+        title = r.get("title", "無標題")
+        if not future.done():
+            print(f"--- 逾時: {r['url']} ---")
+            continue
+        try:
+            content, seconds, cached = future.result()
+        except Exception as e:
+            print(f"❌ 讀取失敗 {r['url']}: {e}")
+            continue
+        print(f"--- {seconds:5.1f} 秒 {r['url']}{' (快取)' if cached else ''}{' (預取)' if r['url'] in prefetched else ''} ---")
+        if content:
+            sections.append(f"### {title}\n來源: {r['url']}\n{content}")
+            pages.append({"url": r["url"], "title": title, "content": content})
+    print(f"--- 本輪讀取 {len(sections)}/{len(targets)} 頁，耗時 {time.perf_counter() - start:.1f} 秒 ---")
     
+    # 證據累積到 evidence (之前迴圈的內容在這裡壓縮)，規劃器一次看到全部資訊
+    evidence = add_evidence(state.get("evidence") or [], pages, state["question"], current_loop)
     return {
-        "vlm_content": content,
-        "loop_count": current_loop + 1
+        "vlm_content": "\n\n".join(sections) or "無法讀取任何搜尋結果。",
+        "evidence": evidence,
+        "loop_count": current_loop + 1,
+        "visited_urls": [r["url"] for r in targets],
+        "prefetch": None
     }
 
+@instrument_node
 def final_answer_node(state: State):
     """6. 生成最終答案"""
     print("\n[系統] 正在生成最終答案...")
     
+    evidence_text, used, total = fit_evidence(state.get("evidence") or [], state["question"], FINAL_BUDGET)
     prompt = f"""
     問題: {state['question']}
     
     已驗證資訊:
-    {state.get('vlm_content', '無內容')}
+    {evidence_text or '無內容'}
     
     搜尋上下文:
-    {state.get('search_results', [])}
+    {fit_search_results(state.get('search_results', [])) or '無'}
     
     請提供一個全面且親切的回答給使用者。
     """
     
-    response = llm.invoke(prompt)
-    answer = response.content
+    start = time.perf_counter()
+    ttft = None
+    parts = []
+    for chunk in llm.stream(prompt):
+        if ttft is None and chunk.content:
+            ttft = time.perf_counter() - start
+        parts.append(chunk.content)
+    answer = "".join(parts)
+    PROMPT_STATS.record("final_answer", prompt, ttft if ttft is not None else time.perf_counter() - start)
     
     # 更新快取
     save_cache({state['question']: answer})
@@ -196,45 +402,70 @@ def route_check_cache(state: State):
     return "planner"
 
 # --- 圖建構 (Graph Construction) ---
-workflow = StateGraph(State) 
-
-workflow.add_node("check_cache", check_cache_node)
-workflow.add_node("planner", planner_node)
-workflow.add_node("query_gen", query_gen_node)
-workflow.add_node("search_tool", search_tool_node)
-workflow.add_node("vlm_process", vlm_process_node)
-workflow.add_node("final_answer", final_answer_node)
-
-workflow.set_entry_point("check_cache")
-
-workflow.add_conditional_edges(
-    "check_cache",
-    route_check_cache,
-    {
-        "end": END,
-        "planner": "planner"
-    }
-)
+@cache
+def get_app():
+    """第一次使用時才組裝並編譯 Graph"""
+    from langgraph.graph import StateGraph, END
 
-workflow.add_conditional_edges(
-    "planner",
-    lambda x: x['decision'],
-    {
-        "sufficient": "final_answer",
-        "insufficient": "query_gen"
-    }
-)
+    workflow = StateGraph(State)
+
+    workflow.add_node("check_cache", check_cache_node)
+    workflow.add_node("planner", planner_node)
+    workflow.add_node("query_gen", query_gen_node)
+    workflow.add_node("search_tool", search_tool_node)
+    workflow.add_node("vlm_process", vlm_process_node)
+    workflow.add_node("final_answer", final_answer_node)
+
+    workflow.set_entry_point("check_cache")
+
+    workflow.add_conditional_edges(
+        "check_cache",
+        route_check_cache,
+        {
+            "end": END,
+            "planner": "planner"
+        }
+    )
 
-workflow.add_edge("query_gen", "search_tool")
-workflow.add_edge("search_tool", "vlm_process")
-workflow.add_edge("vlm_process", "planner") # 迴圈檢查是否足夠
+    workflow.add_conditional_edges(
+        "planner",
+        lambda x: x['decision'],
+        {
+            "sufficient": "final_answer",
+            "insufficient": "query_gen"
+        }
+    )
+
+    workflow.add_edge("query_gen", "search_tool")
+    workflow.add_edge("search_tool", "vlm_process")
+    workflow.add_edge("vlm_process", "planner") # 迴圈檢查是否足夠
 
-workflow.add_edge("final_answer", END)
+    workflow.add_edge("final_answer", END)
+
+    return workflow.compile()
+
+def run_streaming(inputs: dict, config: dict) -> dict:
+    """串流執行：每個節點完成就輸出進度，final_answer 的 token 即時輸出；回傳最終 state"""
+    result = {}
+    last = time.perf_counter()
+    for mode, chunk in get_app().stream(inputs, config=config, stream_mode=["updates", "messages", "values"]):
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") == "final_answer" and message.content:
+                print(message.content, end="", flush=True)
+        elif mode == "updates":
+            now = time.perf_counter()
+            for node in chunk:
+                print(f"\n>>> [{node}] 完成 ({now - last:.1f} 秒)", flush=True)
+            last = now
+        else:
+            result = chunk
+    return result
 
-app = workflow.compile()
-print(app.get_graph().draw_ascii())
 # --- 執行 ---
 if __name__ == "__main__":
+    maybe_show_graph(get_app)
+    prewarm("ws-05")
     user_input = input("我是全能查證 AI 助手，請問有什麼想知道的嗎？").strip()
     if not user_input:
         user_input = "最近誰爬了101大樓"
@@ -243,11 +474,14 @@ if __name__ == "__main__":
     print("🔍 開始查證流程")
     print("="*50)
     
-    # 使用 invoke 取代 stream
-    result = app.invoke(
-        {"question": user_input, "loop_count": 0},
-        config={"recursion_limit": 50}
-    )
+    # 每次執行記錄一個 trace (traces.jsonl)，python tracing.py report 看最慢節點
+    with get_tracer().run("hw4", question=user_input, speculative=SPECULATIVE) as callbacks:
+        config = {"recursion_limit": 50, "callbacks": callbacks}
+        inputs = {"question": user_input, "loop_count": 0}
+        if STREAM:
+            result = run_streaming(inputs, config)
+        else:
+            result = get_app().invoke(inputs, config=config)
     
     # 輸出最終結果
     print("\n" + "="*50)
@@ -255,9 +489,17 @@ if __name__ == "__main__":
     print("="*50)
     print(f"來源: {result.get('source', 'LLM')}")
     print(f"迴圈次數: {result.get('loop_count', 0)}")
+    if result.get("source") != "CACHE":
+        get_research_cache().report()
+        PROMPT_STATS.report()
+        print("節點延遲:")
+        METRICS.summary()
+        if SPECULATIVE:
+            print(f"預取: 使用 {PREFETCH_STATS['used']} / 取消 {PREFETCH_STATS['cancelled']}")
     
-    print("\n[回答]")
-    print(result.get("answer", "無法生成答案"))
+    if not STREAM or result.get("source") == "CACHE":
+        print("\n[回答]")
+        print(result.get("answer", "無法生成答案"))
     
     # 顯示參考來源
     results = result.get('search_results', [])
@@ -0,0 +1,134 @@
+"""
+hw4 查證流程用的持久化快取
+
+- 搜尋結果：以正規化後的查詢字串為 key (全半形、大小寫、多餘空白視為相同)，超過 TTL 重新搜尋
+- VLM 網頁內容：以 URL 為 key，連同網頁的 ETag / Last-Modified 一起存；
+  下次先發一個 HEAD (不下載內容) 比對，網頁沒變就直接沿用先前 VLM 讀出的內容，不必再跑一次昂貴的 VLM
+  (HEAD 失敗或伺服器沒給這兩個標頭時退回只看 URL，並套用 TTL)
+- 存成 JSONL，每次寫入只追加一行 ({"kind", "key", "value"}，後寫的蓋過先寫的)，不重寫整個檔案
+- 命中/未命中次數累計在 stats (整個行程)，由 report() 印出
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from functools import cache
+
+from instrumentation import record_cache
+
+RESEARCH_CACHE_FILE = os.getenv("HW4_RESEARCH_CACHE", "hw4_research_cache.jsonl")
+SEARCH_TTL = float(os.getenv("HW4_SEARCH_TTL", str(24 * 3600)))       # 搜尋結果保留秒數
+PAGE_TTL = float(os.getenv("HW4_PAGE_TTL", str(7 * 24 * 3600)))       # 無法比對 ETag / Last-Modified 時網頁內容保留秒數
+VALIDATE_TIMEOUT = float(os.getenv("HW4_VALIDATE_TIMEOUT", "5"))
+
+
+def normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = query.replace('"', " ").replace("'", " ")
+    return re.sub(r"\s+", " ", query).strip()
+
+
+@cache
+def _session():
+    import requests
+
+    return requests.Session()
+
+
+def page_validators(url: str) -> dict | None:
+    """HEAD 取回網頁的 ETag / Last-Modified；請求失敗或兩者都沒有時回傳 None"""
+    try:
+        resp = _session().head(url, timeout=VALIDATE_TIMEOUT, allow_redirects=True)
+        resp.raise_for_status()
+    except Exception:
+        return None
+    validators = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+    return validators if any(validators.values()) else None
+
+
+def same_version(old: dict | None, new: dict) -> bool:
+    """有 ETag 就比 ETag，否則比 Last-Modified"""
+    if not old:
+        return False
+    if new.get("etag") and old.get("etag"):
+        return new["etag"] == old["etag"]
+    return bool(new.get("last_modified")) and new["last_modified"] == old.get("last_modified")
+
+
+class ResearchCache:
+    def __init__(self, path: str = RESEARCH_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()  # VLM 會平行讀多個網頁
+        self.stats = Counter()
+        self._data = {"search": {}, "pages": {}}
+        self._broken_tail = False
+        if not os.path.exists(path):
+            return
+        line = ""
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._data[record["kind"]][record["key"]] = record["value"]
+                except (json.JSONDecodeError, KeyError, TypeError):  # 中斷時最後一行可能不完整
+                    continue
+            self._broken_tail = line != "" and not line.endswith("\n")
+
+    def _append(self, kind: str, key: str, value: dict):
+        self._data[kind][key] = value
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._broken_tail:  # 不要接在寫到一半的那一行後面
+                f.write("\n")
+                self._broken_tail = False
+            f.write(json.dumps({"kind": kind, "key": key, "value": value}, ensure_ascii=False) + "\n")
+
+    # --- 搜尋結果 ---
+    def get_search(self, query: str):
+        with self.lock:
+            entry = self._data["search"].get(normalize_query(query))
+            if entry and time.time() - entry["at"] < SEARCH_TTL:
+                self.stats["search_hit"] += 1
+                record_cache("search", True)
+                return entry["results"]
+            self.stats["search_miss"] += 1
+            record_cache("search", False)
+            return None
+
+    def put_search(self, query: str, results: list):
+        with self.lock:
+            self._append("search", normalize_query(query), {"at": time.time(), "results": results})
+
+    # --- VLM 網頁內容 ---
+    def get_page(self, url: str, validators: dict | None):
+        with self.lock:
+            entry = self._data["pages"].get(url)
+            if entry:
+                if validators is not None and same_version(entry.get("validators"), validators):
+                    self.stats["page_hit"] += 1
+                    record_cache("page", True)
+                    return entry["content"]
+                if validators is None and time.time() - entry["at"] < PAGE_TTL:
+                    self.stats["page_hit_ttl"] += 1
+                    record_cache("page", True)
+                    return entry["content"]
+            self.stats["page_miss"] += 1
+            record_cache("page", False)
+            return None
+
+    def put_page(self, url: str, validators: dict | None, content: str):
+        with self.lock:
+            self._append("pages", url, {"at": time.time(), "validators": validators, "content": content})
+
+    def report(self):
+        s = self.stats
+        print(f"搜尋快取: 命中 {s['search_hit']} / 未命中 {s['search_miss']}")
+        print(f"網頁快取: 命中 {s['page_hit']} (ETag / Last-Modified 未變) + {s['page_hit_ttl']} (TTL) / 未命中 {s['page_miss']}")
+        print(f"同一次查證中略過已讀網址: {s['url_dedup']}")
+
+
+@cache
+def get_research_cache() -> ResearchCache:
+    return ResearchCache()
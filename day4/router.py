@@ -0,0 +1,254 @@
+"""
+問題複雜度路由 (取代 ch7_2 的打招呼關鍵字判斷)
+
+- 特徵：長度、估計 token 數、子句數、疑問/分析類用語、程式碼符號、英數比例、打招呼用語...
+  全部是字串運算，不載入 embedding 模型，一次評分只要幾十微秒
+- 分類器：邏輯迴歸，score = P(需要專家模型)；權重預設為手調值，可用流量紀錄重新訓練
+    python router.py score "什麼是 LangGraph 的 checkpoint？"
+    python router.py train                       # 讀 router_decisions.jsonl 中有標籤的紀錄
+    python router.py train labeled.jsonl --epochs 300
+- 每條路由有自己的能力上限、延遲預算與成本預算：
+    * 依便宜到貴排序，選第一個 max_complexity >= score 的路由
+    * 該路由近期延遲 (EWMA) 超過延遲預算時改走下一條
+    * 預估成本超過成本預算時退回較便宜的路由
+- 每次決策寫一行 JSONL (含特徵與分數)；之後的延遲 observe() 與標籤 feedback() 也以同一個 id 追加，
+  train 時依 id 合併成訓練資料
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from functools import cache
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from instrumentation import METRICS
+from token_estimate import estimate_tokens
+
+ROUTER_MODEL_FILE = os.getenv("ROUTER_MODEL_FILE", "router_model.json")
+ROUTER_LOG_FILE = os.getenv("ROUTER_LOG_FILE", "router_decisions.jsonl")
+EWMA_ALPHA = 0.3          # 延遲 EWMA 的平滑係數
+EXPECTED_OUTPUT_RATIO = 3  # 預估成本時假設回答長度約為問題的幾倍
+
+# 依成本由低到高；環境變數可覆寫預算 (例如 ROUTER_FAST_LATENCY=2)
+ROUTES = {
+    "fast": {
+        "max_complexity": float(os.getenv("ROUTER_FAST_MAX", "0.5")),
+        "latency_budget": float(os.getenv("ROUTER_FAST_LATENCY", "3")),      # 秒
+        "cost_budget": float(os.getenv("ROUTER_FAST_COST", "0.001")),        # 美元 / 次
+        "cost_per_1k": float(os.getenv("ROUTER_FAST_PRICE", "0.0001")),      # 美元 / 1k tokens
+    },
+    "expert": {
+        "max_complexity": 1.0,
+        "latency_budget": float(os.getenv("ROUTER_EXPERT_LATENCY", "60")),
+        "cost_budget": float(os.getenv("ROUTER_EXPERT_COST", "0.05")),
+        "cost_per_1k": float(os.getenv("ROUTER_EXPERT_PRICE", "0.002")),
+    },
+}
+
+_GREETINGS = ("你好", "嗨", "早安", "午安", "晚安", "哈囉", "謝謝", "掰掰", "hi", "hello", "thanks")
+_REASONING = ("為什麼", "如何", "怎麼", "比較", "差異", "分析", "解釋", "原理", "設計", "實作", "優缺點",
+              "步驟", "推導", "證明", "評估", "架構", "why", "how", "compare", "explain", "design")
+_CODE = re.compile(r"[{}\[\]()=<>_/\\`#]")
+_CLAUSE = re.compile(r"[，,；;、。！？!?\n]")
+_ASCII_WORD = re.compile(r"[A-Za-z][A-Za-z0-9_.-]+")
+
+# 手調的初始權重：打招呼與短句往 fast，長句、推理用語、程式碼往 expert
+DEFAULT_WEIGHTS = {
+    "bias": -2.0, "log_tokens": 0.8, "clauses": 0.35, "greeting": -2.5,
+    "reasoning": 1.6, "code": 0.8, "ascii_words": 0.3, "short": -1.0,
+}
+
+
+def extract_features(question: str) -> dict[str, float]:
+    text = question.strip()
+    lower = text.lower()
+    tokens = estimate_tokens(text)
+    return {
+        "bias": 1.0,
+        "log_tokens": math.log1p(tokens),
+        "clauses": min(len(_CLAUSE.findall(text)), 6),
+        "greeting": float(any(word in lower for word in _GREETINGS)),
+        "reasoning": float(min(sum(word in lower for word in _REASONING), 3)),
+        "code": float(bool(_CODE.search(text))),
+        "ascii_words": min(len(_ASCII_WORD.findall(text)), 5) / 5,
+        "short": float(tokens <= 6),
+    }
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    return 1 / (1 + math.exp(-z))
+
+
+class ComplexityRouter:
+    def __init__(self, weights: dict | None = None, routes: dict = ROUTES, log_file: str | None = ROUTER_LOG_FILE):
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.routes = routes
+        self.log_file = log_file
+        self.latency = {}  # route -> 延遲 EWMA
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = ROUTER_MODEL_FILE, **kwargs) -> "ComplexityRouter":
+        weights = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    weights = json.load(f)["weights"]
+            except (OSError, json.JSONDecodeError, KeyError):
+                pass
+        return cls(weights, **kwargs)
+
+    def score(self, features: dict[str, float]) -> float:
+        return _sigmoid(sum(self.weights.get(k, 0.0) * v for k, v in features.items()))
+
+    def estimated_cost(self, route: str, question: str) -> float:
+        tokens = estimate_tokens(question) * (1 + EXPECTED_OUTPUT_RATIO)
+        return tokens / 1000 * self.routes[route]["cost_per_1k"]
+
+    def route(self, question: str) -> dict:
+        """回傳決策 {"id", "route", "score", "reason", ...}，同時寫入決策紀錄"""
+        start = time.perf_counter()
+        features = extract_features(question)
+        score = self.score(features)
+        names = list(self.routes)
+
+        index = next((i for i, name in enumerate(names) if score <= self.routes[name]["max_complexity"]), len(names) - 1)
+        reason = "complexity"
+        # 延遲預算：近期太慢就往下一條 (最後一條沒得退)
+        while index < len(names) - 1 and self.latency.get(names[index], 0.0) > self.routes[names[index]]["latency_budget"]:
+            index += 1
+            reason = "latency_budget"
+        # 成本預算：超過就退回較便宜的路由
+        while index > 0 and self.estimated_cost(names[index], question) > self.routes[names[index]]["cost_budget"]:
+            index -= 1
+            reason = "cost_budget"
+
+        decision = {
+            "id": uuid.uuid4().hex[:12],
+            "at": time.time(),
+            "question": question,
+            "features": features,
+            "score": round(score, 4),
+            "route": names[index],
+            "reason": reason,
+            "decide_us": round((time.perf_counter() - start) * 1e6, 1),
+        }
+        METRICS.inc("router_decisions_total", route=decision["route"], reason=reason)
+        self._log(decision)
+        return decision
+
+    def observe(self, decision: dict, seconds: float):
+        """回報該路由實際花費的時間，更新延遲 EWMA"""
+        route = decision["route"]
+        with self._lock:
+            previous = self.latency.get(route)
+            self.latency[route] = seconds if previous is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous
+        self._log({"id": decision["id"], "latency": round(seconds, 4)})
+
+    def feedback(self, decision: dict, needs_expert: bool):
+        """標記這個問題實際上需不需要專家模型，供 train 使用"""
+        self._log({"id": decision["id"], "label": int(needs_expert)})
+
+    def _log(self, record: dict):
+        if not self.log_file:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.log_file, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+# ================= 訓練 =================
+
+def load_training_data(path: str) -> list[tuple[dict, int]]:
+    """
+    讀決策紀錄，依 id 合併出 (features, label)。
+    也接受人工標註檔：每行 {"question": ..., "label": 0/1}
+    """
+    decisions, labels, rows = {}, {}, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "id" not in record:
+                rows.append((extract_features(record["question"]), int(record["label"])))
+                continue
+            if "question" in record:
+                decisions[record["id"]] = record
+                if "label" in record:
+                    labels[record["id"]] = int(record["label"])
+            elif "label" in record:
+                labels[record["id"]] = int(record["label"])
+    for id_, label in labels.items():
+        if id_ in decisions:
+            # 以目前的特徵定義重新計算，舊紀錄的特徵欄位可能已過時
+            rows.append((extract_features(decisions[id_]["question"]), label))
+    return rows
+
+
+def train(rows: list[tuple[dict, int]], epochs: int = 200, lr: float = 0.1, l2: float = 0.001,
+          weights: dict | None = None) -> dict:
+    """批次梯度下降的邏輯迴歸 (資料量是幾百到幾千筆，不需要 numpy)"""
+    weights = dict(weights or DEFAULT_WEIGHTS)
+    n = len(rows)
+    for _ in range(epochs):
+        grad = dict.fromkeys(weights, 0.0)
+        for features, label in rows:
+            error = _sigmoid(sum(weights[k] * v for k, v in features.items())) - label
+            for k, v in features.items():
+                grad[k] += error * v
+        for k in weights:
+            penalty = 0.0 if k == "bias" else l2 * weights[k]
+            weights[k] -= lr * (grad[k] / n + penalty)
+    return weights
+
+
+def accuracy(weights: dict, rows: list[tuple[dict, int]], threshold: float = 0.5) -> float:
+    router = ComplexityRouter(weights, log_file=None)
+    correct = sum((router.score(features) > threshold) == bool(label) for features, label in rows)
+    return correct / len(rows)
+
+
+@cache
+def get_router() -> ComplexityRouter:
+    return ComplexityRouter.load()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="問題複雜度路由")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_score = sub.add_parser("score", help="顯示問題的特徵、分數與路由")
+    p_score.add_argument("question")
+    p_train = sub.add_parser("train", help="用有標籤的流量紀錄重新訓練")
+    p_train.add_argument("data", nargs="?", default=ROUTER_LOG_FILE)
+    p_train.add_argument("--epochs", type=int, default=200)
+    p_train.add_argument("--lr", type=float, default=0.1)
+    p_train.add_argument("-o", "--output", default=ROUTER_MODEL_FILE)
+    args = parser.parse_args()
+
+    if args.command == "score":
+        router = ComplexityRouter.load(log_file=None)
+        decision = router.route(args.question)
+        for name, value in decision["features"].items():
+            print(f"  {name:<12} {value:6.2f}  x {router.weights[name]:+.2f}")
+        print(f"分數: {decision['score']:.3f} -> {decision['route']} ({decision['reason']}, {decision['decide_us']} µs)")
+    else:
+        rows = load_training_data(args.data)
+        if not rows:
+            raise SystemExit(f"{args.data} 中沒有帶標籤的紀錄")
+        positives = sum(label for _, label in rows)
+        print(f"訓練資料: {len(rows)} 筆 (需要專家 {positives} / 快速 {len(rows) - positives})")
+        print(f"訓練前準確率: {accuracy(DEFAULT_WEIGHTS, rows):.1%}")
+        weights = train(rows, epochs=args.epochs, lr=args.lr)
+        print(f"訓練後準確率: {accuracy(weights, rows):.1%}")
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"weights": weights, "trained_at": time.time(), "samples": len(rows)}, f, indent=4)
+        print(f"已寫入 {args.output}")
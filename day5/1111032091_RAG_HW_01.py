@@ -1,8 +1,14 @@
-from langchain_text_splitters import CharacterTextSplitter, TokenTextSplitter
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-import requests
+import os
+import sys
 import uuid
+from functools import cache
+from pathlib import Path
+import requests
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from startup import lazy_import
+
+# pandas 很重，第一次用到 pd.xxx 才真正載入
+pd = lazy_import("pandas")
 
 # --- Helper Functions ---
 def get_embedding(text):
@@ -20,10 +26,17 @@ def get_embedding(text):
         print(f"Embedding API Error: {e}")
     return None
 
-client = QdrantClient(url="http://localhost:6333")
+@cache
+def get_client():
+    """第一次需要向量庫時才建立 QdrantClient"""
+    from qdrant_client import QdrantClient
+    return QdrantClient(url="http://localhost:6333")
 
 def setup_collection_and_upsert(collection_name, chunks, splitter_name, source_name):
+    from qdrant_client.models import Distance, VectorParams, PointStruct
+
     print(f"\nProcessing {collection_name} for {splitter_name} from {source_name}...")
+    client = get_client()
     
     # 檢查/建立 Collection
     if not client.collection_exists(collection_name=collection_name):
@@ -67,6 +80,8 @@ def setup_collection_and_upsert(collection_name, chunks, splitter_name, source_n
 # --- Splitting Functions ---
 
 def character_split_text(text, chunk_size=200, chunk_overlap=0):
+    from langchain_text_splitters import CharacterTextSplitter
+
     print(f"--- CharacterTextSplitter (Size: {chunk_size}, Overlap: {chunk_overlap}) ---")
     text_splitter = CharacterTextSplitter(
         chunk_size=chunk_size,
@@ -84,6 +99,8 @@ def character_split_text(text, chunk_size=200, chunk_overlap=0):
     return chunks
 
 def token_split_text(text, chunk_size=200, chunk_overlap=50):
+    from langchain_text_splitters import TokenTextSplitter
+
     print(f"\n--- TokenTextSplitter (Size: {chunk_size}, Overlap: {chunk_overlap}) ---")
     text_splitter_token = TokenTextSplitter(
         chunk_size=chunk_size,
@@ -187,16 +204,17 @@ def get_dynamic_split_params(text, base_chunk_size=200):
 #     print(f"File {i}: {len(text)} characters")
 #     print(f"Dynamic Params: {params}\n")
 
-import os
-
 # 定義要處理的檔案列表
 data_dir = "data"
-files = [f for f in os.listdir(data_dir) if f.startswith("data_") and f.endswith(".txt")]
 
-print(f"Found files to process: {files}")
+def list_data_files():
+    """列出 data/ 底下要處理的檔案 (呼叫時才讀目錄，不在 import 時做)"""
+    files = [f for f in os.listdir(data_dir) if f.startswith("data_") and f.endswith(".txt")]
+    print(f"Found files to process: {files}")
+    return files
 
 # --- 執行部分 (資料庫建立完成後可註解) ---
-# for filename in files:
+# for filename in list_data_files():
 #     file_path = os.path.join(data_dir, filename)
 #     print(f"\n{'='*30}")
 #     print(f"Processing file: {filename}")
@@ -238,9 +256,6 @@ print(f"Found files to process: {files}")
 #     setup_collection_and_upsert("hw_semantic_split", chunks_semantic, "SemanticTextSplitter", filename)
 
 
-import pandas as pd
-import uuid
-
 def retrieve_and_export_answers():
     # --- 讀取問題並進行檢索 ---
     print(f"\n{'='*30}")
@@ -268,7 +283,7 @@ def retrieve_and_export_answers():
             if query_vector:
                 try:
                     # 搜尋 (只取 Top 1)
-                    search_result = client.query_points(
+                    search_result = get_client().query_points(
                         collection_name=collection_name,
                         query=query_vector,
                         limit=1 
@@ -1,5 +1,11 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from llm_registry import get_openai_client, prewarm
+
+# 先在背景建立連線，和下面載入 pandas / 解析 HTML 的時間重疊
+prewarm("ws-03")
 import pandas as pd
-from openai import OpenAI
 
 tables = pd.read_html("table_html.html")
 # print(tables[0]) # Screenshot doesn't show this print, but user had it. I'll comment it out or keep it? User said "add screenshot code". I'll keep previous code but maybe comment print to avoid clutter if screenshot implies clean start? Actually, screenshot uses tables[0], so tables must be defined.
@@ -8,10 +14,7 @@ tables = pd.read_html("table_html.html")
 with open("Prompt_table_v2.txt", "r", encoding="UTF-8") as f:
     system_prompt = f.read()
 
-client = OpenAI(
-    base_url="https://ws-03.wade0426.me/v1",
-    api_key="EMPTY",
-)
+client = get_openai_client("ws-03")
 
 response = client.chat.completions.create(
     model="/models/gpt-oss-120b",
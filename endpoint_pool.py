@@ -0,0 +1,409 @@
+"""
+多 endpoint 連線池：對沖請求 (hedging)、故障轉移與斷路器
+
+同一個模型部署在多台機器時，以環境變數列出所有副本 (第一個為主要 endpoint)：
+    LLM_POOL_WS_02="https://ws-02.wade0426.me/v1,http://backup:8000/v1"
+llm_registry 會換上這裡的 transport，ChatOpenAI / OpenAI client 不需要任何修改：
+- 每個成員記錄延遲 EWMA、最近請求的 p95 與錯誤率 (一般請求與 stream 分開統計)
+- 選延遲 EWMA 最低的健康成員送出；超過該成員的 p95 還沒回應，就再送一份給次佳成員
+  (只有一個成員時送給同一個 endpoint)，先回來的勝出，另一個取消
+- 連線錯誤、逾時、5xx / 429 算失敗，立刻換下一個成員重送 (故障轉移)
+- 連續失敗 BREAKER_FAILURES 次或近期錯誤率超過 BREAKER_ERROR_RATE 就斷路，
+  BREAKER_COOLDOWN 秒後放一個試探請求 (half-open)，成功才恢復
+- 以 llm_stub_server.py 注入延遲與錯誤驗證：python endpoint_pool.py --demo
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+from instrumentation import METRICS
+
+HEDGE = os.getenv("LLM_HEDGE", "1") != "0"
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10"))    # 樣本數不足時不對沖 (p95 不可靠)
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.05"))    # 對沖延遲下限 (秒)
+WINDOW = int(os.getenv("LLM_POOL_WINDOW", "100"))                    # p95 與錯誤率的統計視窗 (請求數)
+EWMA_ALPHA = 0.2
+EWMA_HALF_LIFE = float(os.getenv("LLM_POOL_HALF_LIFE", "30"))  # 沒被選到的成員，EWMA 每隔幾秒減半 (才會被重新量測)
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_MIN_REQUESTS = 10    # 錯誤率斷路至少要有的樣本數
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+_STREAM = re.compile(rb'"stream"\s*:\s*true')
+
+
+def _failed(status: int) -> bool:
+    return status >= 500 or status == 429
+
+
+class Member:
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.ewma = {}                                       # kind -> 延遲 EWMA
+        self.last_seen = 0.0                                 # 最後一次回報結果的時間
+        self.recent = {}                                     # kind -> deque(最近成功請求的延遲)
+        self.outcomes = deque(maxlen=WINDOW)                 # True = 成功
+        self.consecutive_failures = 0
+        self.opened_at = None                                # 斷路的時間；None 表示正常
+        self.probing = False                                 # half-open 時是否已有試探請求在路上
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self, kind: str, now: float) -> float:
+        """選擇用的延遲：EWMA 依閒置時間衰減，變慢過的成員之後仍有機會被重新量測"""
+        return self.ewma.get(kind, 0.0) * 0.5 ** ((now - self.last_seen) / EWMA_HALF_LIFE)
+
+    def p95(self, kind: str) -> float | None:
+        recent = self.recent.get(kind)
+        if not recent or len(recent) < HEDGE_MIN_SAMPLES:
+            return None
+        values = sorted(recent)
+        return values[min(int(len(values) * 0.95), len(values) - 1)]
+
+
+class EndpointPool:
+    """
+    primary 是 ChatOpenAI / OpenAI client 設定的 base_url；送出時把這個前綴換成選中成員的 base_url。
+    """
+
+    def __init__(self, primary: str, members: list[str]):
+        self.primary = primary.rstrip("/")
+        self.members = [Member(url) for url in members] or [Member(primary)]
+        self._lock = threading.Lock()
+
+    # --- 選擇成員 ---
+    def _available(self, member: Member, now: float) -> bool:
+        if member.opened_at is None:
+            return True
+        # 冷卻結束後只放一個試探請求
+        return now - member.opened_at >= BREAKER_COOLDOWN and not member.probing
+
+    def pick(self, kind: str, exclude=()) -> Member | None:
+        """延遲 (衰減後的 EWMA) 最低的可用成員 (沒有紀錄的視為 0，先試)；全部斷路時挑最早斷路的，總比直接失敗好"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [m for m in self.members if m not in exclude]
+            if not candidates:
+                return None
+            healthy = [m for m in candidates if self._available(m, now)]
+            if healthy:
+                member = min(healthy, key=lambda m: m.score(kind, now))
+            else:
+                member = min(candidates, key=lambda m: m.opened_at)
+            if member.opened_at is not None:
+                member.probing = True
+            return member
+
+    def hedge_target(self, kind: str, primary: Member) -> Member | None:
+        """對沖對象：次佳的健康成員；只有一個成員時送回同一個"""
+        if len(self.members) == 1:
+            return primary if primary.opened_at is None else None
+        now = time.monotonic()
+        with self._lock:
+            others = [m for m in self.members if m is not primary and self._available(m, now)]
+        if not others:
+            return None
+        return min(others, key=lambda m: m.score(kind, now))
+
+    def hedge_delay(self, member: Member, kind: str) -> float | None:
+        if not HEDGE:
+            return None
+        with self._lock:
+            p95 = member.p95(kind)
+        return None if p95 is None else max(p95, HEDGE_MIN_DELAY)
+
+    # --- 結果回報 ---
+    def record_success(self, member: Member, kind: str, seconds: float):
+        with self._lock:
+            # 偶發的長尾已由對沖處理，計入 EWMA 時以 2 倍 p95 為上限，免得一次長尾就讓成員長期被冷落
+            p95 = member.p95(kind)
+            sample = seconds if p95 is None else min(seconds, 2 * p95)
+            previous = member.ewma.get(kind)
+            member.ewma[kind] = sample if previous is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * previous
+            member.recent.setdefault(kind, deque(maxlen=WINDOW)).append(seconds)
+            member.outcomes.append(True)
+            member.last_seen = time.monotonic()
+            member.consecutive_failures = 0
+            if member.opened_at is not None:
+                member.opened_at = None
+                member.probing = False
+                METRICS.inc("endpoint_breaker_transitions_total", endpoint=member.base_url, state="closed")
+        METRICS.observe("endpoint_latency_seconds", seconds, endpoint=member.base_url, kind=kind)
+        METRICS.inc("endpoint_requests_total", endpoint=member.base_url, status="ok")
+
+    def record_failure(self, member: Member):
+        with self._lock:
+            member.outcomes.append(False)
+            member.last_seen = time.monotonic()
+            member.consecutive_failures += 1
+            trip = (member.consecutive_failures >= BREAKER_FAILURES
+                    or (len(member.outcomes) >= BREAKER_MIN_REQUESTS and member.error_rate > BREAKER_ERROR_RATE))
+            if member.opened_at is not None or trip:
+                # half-open 的試探失敗也重新計時
+                if member.opened_at is None:
+                    METRICS.inc("endpoint_breaker_transitions_total", endpoint=member.base_url, state="open")
+                member.opened_at = time.monotonic()
+                member.probing = False
+        METRICS.inc("endpoint_requests_total", endpoint=member.base_url, status="error")
+
+    def rewrite(self, request: httpx.Request, member: Member) -> httpx.Request:
+        url = str(request.url)
+        if member.base_url != self.primary and url.startswith(self.primary):
+            url = member.base_url + url[len(self.primary):]
+        headers = request.headers.copy()
+        headers.pop("host", None)
+        return httpx.Request(request.method, url, headers=headers, content=request.content,
+                             extensions=request.extensions)
+
+    def status(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "endpoint": m.base_url,
+                    "state": "closed" if m.opened_at is None else ("half-open" if self._available(m, now) else "open"),
+                    "ewma": {k: round(v, 3) for k, v in m.ewma.items()},
+                    "p95": {k: m.p95(k) and round(m.p95(k), 3) for k in m.recent},
+                    "error_rate": round(m.error_rate, 3),
+                }
+                for m in self.members
+            ]
+
+
+def _kind(request: httpx.Request) -> str:
+    return "stream" if _STREAM.search(request.content or b"") else "request"
+
+
+class HedgedTransport(httpx.BaseTransport):
+    """同步版：每份請求在執行緒中送出；輸掉的請求若還沒開始就取消，已在路上的等它回來後直接關閉"""
+
+    def __init__(self, pool: EndpointPool, transport: httpx.BaseTransport, max_workers: int = 20):
+        self.pool = pool
+        self.transport = transport
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def _send(self, member: Member, request: httpx.Request, kind: str) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = self.transport.handle_request(self.pool.rewrite(request, member))
+        except httpx.TransportError:
+            self.pool.record_failure(member)
+            raise
+        if _failed(response.status_code):
+            response.read()
+            response.close()
+            self.pool.record_failure(member)
+        else:
+            self.pool.record_success(member, kind, time.perf_counter() - start)
+        return response
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        kind = _kind(request)
+        primary = self.pool.pick(kind)
+        pending = {self._executor.submit(self._send, primary, request, kind): primary}
+        tried = {primary}
+        hedge = None
+        hedge_at = self.pool.hedge_delay(primary, kind)
+        start = time.perf_counter()
+        last_error = last_response = None
+
+        while pending:
+            timeout = None if hedge_at is None else max(hedge_at - (time.perf_counter() - start), 0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_at = None
+                member = self.pool.hedge_target(kind, primary)
+                if member is not None:
+                    METRICS.inc("endpoint_hedges_total", endpoint=member.base_url)
+                    hedge = self._executor.submit(self._send, member, request, kind)
+                    pending[hedge] = member
+                    tried.add(member)
+                continue
+            for future in done:
+                member = pending.pop(future)
+                try:
+                    response = future.result()
+                except httpx.TransportError as e:
+                    last_error = e
+                    continue
+                if _failed(response.status_code):
+                    last_response = response
+                    continue
+                if future is hedge:
+                    METRICS.inc("endpoint_hedge_wins_total", endpoint=member.base_url)
+                for loser in pending:
+                    if not loser.cancel():
+                        loser.add_done_callback(_close_result)
+                return response
+            if not pending:
+                # 故障轉移：換一個還沒試過的成員
+                member = self.pool.pick(kind, exclude=tried)
+                if member is not None:
+                    tried.add(member)
+                    pending[self._executor.submit(self._send, member, request, kind)] = member
+
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.transport.close()
+
+
+def _close_result(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class AsyncHedgedTransport(httpx.AsyncBaseTransport):
+    """非同步版：輸掉的請求還在路上就 cancel (連線隨之關閉)，已經回來的直接關閉回應"""
+
+    def __init__(self, pool: EndpointPool, transport: httpx.AsyncBaseTransport):
+        self.pool = pool
+        self.transport = transport
+
+    async def _send(self, member: Member, request: httpx.Request, kind: str) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(self.pool.rewrite(request, member))
+        except httpx.TransportError:
+            self.pool.record_failure(member)
+            raise
+        if _failed(response.status_code):
+            await response.aread()
+            await response.aclose()
+            self.pool.record_failure(member)
+        else:
+            self.pool.record_success(member, kind, time.perf_counter() - start)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        kind = _kind(request)
+        primary = self.pool.pick(kind)
+        pending = {asyncio.create_task(self._send(primary, request, kind)): primary}
+        tried = {primary}
+        hedge = None
+        hedge_at = self.pool.hedge_delay(primary, kind)
+        start = time.perf_counter()
+        last_error = last_response = None
+
+        try:
+            while pending:
+                timeout = None if hedge_at is None else max(hedge_at - (time.perf_counter() - start), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    member = self.pool.hedge_target(kind, primary)
+                    if member is not None:
+                        METRICS.inc("endpoint_hedges_total", endpoint=member.base_url)
+                        hedge = asyncio.create_task(self._send(member, request, kind))
+                        pending[hedge] = member
+                        tried.add(member)
+                    continue
+                for task in done:
+                    member = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except httpx.TransportError as e:
+                        last_error = e
+                        continue
+                    if _failed(response.status_code):
+                        last_response = response
+                        continue
+                    if task is hedge:
+                        METRICS.inc("endpoint_hedge_wins_total", endpoint=member.base_url)
+                    return response
+                if not pending:
+                    member = self.pool.pick(kind, exclude=tried)
+                    if member is not None:
+                        tried.add(member)
+                        pending[asyncio.create_task(self._send(member, request, kind))] = member
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    # 同一輪 wait 一起完成、但沒被採用的回應也要關閉，否則連線不會還回連線池
+                    await task.result().aclose()
+
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def pool_members(endpoint: str, base_url: str) -> list[str]:
+    """LLM_POOL_<ENDPOINT> 以逗號分隔的副本清單；沒設定時只有 endpoint 本身"""
+    env_key = "LLM_POOL_" + endpoint.upper().replace("-", "_")
+    members = [url.strip() for url in os.getenv(env_key, "").split(",") if url.strip()]
+    return members or [base_url]
+
+
+def demo(requests: int = 200):
+    """三台 stub：主要的較快但有 3% 長尾、備援較慢但穩定、第三台當機；比較單一 endpoint 與連線池"""
+    import statistics
+
+    from llm_stub_server import serve_in_thread
+
+    servers = [
+        serve_in_thread(port=0, delay=0.1, jitter=0.02, slow_rate=0.03, slow_delay=2.0),
+        serve_in_thread(port=0, delay=0.2, jitter=0.02),
+        serve_in_thread(port=0, delay=0.1, fail_rate=1.0),
+    ]
+    urls = [f"http://127.0.0.1:{server.server_address[1]}/v1" for server, _ in servers]
+    body = {"model": "demo", "messages": [{"role": "user", "content": "hi"}]}
+
+    def run(client: httpx.Client) -> tuple[list[float], int]:
+        latencies, errors = [], 0
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                client.post(f"{urls[0]}/chat/completions", json=body).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+        return latencies, errors
+
+    def show(name: str, latencies: list[float], errors: int):
+        latencies.sort()
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        print(f"{name:<24} p50 {statistics.median(latencies) * 1000:7.0f} ms  "
+              f"p95 {p95 * 1000:7.0f} ms  最大 {latencies[-1] * 1000:7.0f} ms  錯誤 {errors}")
+
+    print(f"stub: {urls[0]} (3% 長尾 2s), {urls[1]} (穩定 200ms), {urls[2]} (全部 500)")
+    with httpx.Client(timeout=30) as client:
+        show("單一 endpoint", *run(client))
+
+    pool = EndpointPool(urls[0], [urls[0], urls[2], urls[1]])
+    transport = HedgedTransport(pool, httpx.HTTPTransport())
+    with httpx.Client(transport=transport, timeout=30) as client:
+        show("連線池 (對沖 + 斷路)", *run(client))
+    for row in pool.status():
+        print(f"  {row['endpoint']:<32} {row['state']:<9} ewma={row['ewma']} p95={row['p95']} 錯誤率={row['error_rate']}")
+    print("對沖次數:", sum(v for (name, _), v in METRICS.counters.items() if name == "endpoint_hedges_total"),
+          " 對沖勝出:", sum(v for (name, _), v in METRICS.counters.items() if name == "endpoint_hedge_wins_total"))
+    for server, _ in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="endpoint 連線池示範 (本機 stub server)")
+    parser.add_argument("--demo", action="store_true", required=True)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    demo(args.requests)
@@ -0,0 +1,261 @@
+"""
+節點層級的量測 (Instrumentation)
+
+- @instrument_node：包住任何 StateGraph 節點 (同步 / async 皆可)，記錄延遲直方圖與呼叫次數
+- record_cache()：快取命中 / 未命中計數
+- LLM 延遲與 token 用量：llm_registry 建立模型時自動掛上 metrics_callback()，腳本不用改
+- measure()：量一段任意程式碼 (例如 hw2 的 chain)
+- 匯出：Prometheus 文字格式或 JSON
+    METRICS_FILE=metrics.prom python hw4.py     # 結束時寫檔 (.json 副檔名則寫 JSON)
+    METRICS_PORT=9464 python hw4.py             # 執行期間提供 http://localhost:9464/metrics
+
+每次記錄只有一次 perf_counter、一次 bisect 與一把鎖，可以常駐開啟；INSTRUMENTATION=0 則完全不包。
+"""
+import atexit
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+ENABLED = os.getenv("INSTRUMENTATION", "1") != "0"
+# 延遲直方圖的 bucket 上界 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # 最後一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> float
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    # --- 匯出 ---
+    @staticmethod
+    def _labels(labels, **extra) -> str:
+        items = list(labels) + list(extra.items())
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda kv: kv[0])
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), counts, total, count in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{self._labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                        "buckets": dict(zip(map(str, LATENCY_BUCKETS + ("+Inf",)), h.counts)),
+                    }
+                    for (name, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0])
+                ],
+            }
+
+    def dump(self, path: str):
+        """依副檔名寫出 Prometheus 文字 (.prom / .txt) 或 JSON (.json)"""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                json.dump(self.to_json(), f, ensure_ascii=False, indent=4)
+            else:
+                f.write(self.to_prometheus())
+
+    def summary(self, name: str = "node_latency_seconds"):
+        """終端機用的簡短報表：每個 label 的次數與平均延遲"""
+        with self._lock:
+            rows = [(dict(labels), h.count, h.sum) for (n, labels), h in self.histograms.items() if n == name]
+        for labels, count, total in sorted(rows, key=lambda r: -r[2]):
+            label = ",".join(f"{k}={v}" for k, v in labels.items())
+            print(f"  {label:<40} {count:>5} 次  平均 {total / count * 1000:8.1f} ms  總計 {total:7.2f} s")
+
+
+METRICS = Metrics()
+
+
+def instrument_node(fn=None, *, name: str | None = None):
+    """
+    節點裝飾器：node_latency_seconds{node} 直方圖 + node_calls_total{node, status}。
+    name 預設為函式名稱去掉 _node 字尾。
+    """
+    if fn is None:
+        return functools.partial(instrument_node, name=name)
+    if not ENABLED:
+        return fn
+    node = name or fn.__name__.removesuffix("_node")
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                METRICS.observe("node_latency_seconds", time.perf_counter() - start, node=node)
+                METRICS.inc("node_calls_total", node=node, status=status)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = fn(*args, **kwargs)
+            status = "ok"
+            return result
+        finally:
+            METRICS.observe("node_latency_seconds", time.perf_counter() - start, node=node)
+            METRICS.inc("node_calls_total", node=node, status=status)
+
+    return wrapper
+
+
+@contextmanager
+def measure(operation: str, **labels):
+    """量一段程式碼：operation_latency_seconds{operation}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if ENABLED:
+            METRICS.observe("operation_latency_seconds", time.perf_counter() - start, operation=operation, **labels)
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    if ENABLED and count:
+        METRICS.inc("cache_requests_total", count, cache=cache, result="hit" if hit else "miss")
+
+
+_callback = None
+
+
+def metrics_callback():
+    """LangChain callback：llm_latency_seconds{model} 與 llm_tokens_total{model, direction}"""
+    global _callback
+    if _callback is not None:
+        return _callback
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class MetricsCallbackHandler(BaseCallbackHandler):
+        def __init__(self):
+            self._started = {}  # run_id -> (model, perf_counter)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            params = kwargs.get("invocation_params") or {}
+            model = params.get("model") or params.get("model_name") or "unknown"
+            self._started[run_id] = (model, time.perf_counter())
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            model, start = self._started.pop(run_id, ("unknown", None))
+            if start is not None:
+                METRICS.observe("llm_latency_seconds", time.perf_counter() - start, model=model)
+            METRICS.inc("llm_calls_total", model=model, status="ok")
+            for generations in response.generations:
+                for gen in generations:
+                    usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                    if usage:
+                        METRICS.inc("llm_tokens_total", usage.get("input_tokens", 0), model=model, direction="input")
+                        METRICS.inc("llm_tokens_total", usage.get("output_tokens", 0), model=model, direction="output")
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            model, _ = self._started.pop(run_id, ("unknown", None))
+            METRICS.inc("llm_calls_total", model=model, status="error")
+
+    _callback = MetricsCallbackHandler()
+    return _callback
+
+
+def serve_metrics(port: int):
+    """背景執行緒提供 GET /metrics (Prometheus) 與 /metrics.json"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(METRICS.to_json(), ensure_ascii=False).encode(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, ctype = METRICS.to_prometheus().encode(), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if ENABLED and os.getenv("METRICS_FILE"):
+    atexit.register(METRICS.dump, os.getenv("METRICS_FILE"))
+if ENABLED and os.getenv("METRICS_PORT"):
+    serve_metrics(int(os.getenv("METRICS_PORT")))
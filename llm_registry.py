@@ -0,0 +1,276 @@
+"""
+共用模型註冊表 (Model Registry)
+
+所有作業腳本都透過這裡取得 LLM，不再各自 new 一個 ChatOpenAI / OpenAI。
+- 每個 endpoint 只建立一組 httpx 連線池 (keep-alive)，同 endpoint 的所有模型共用
+- timeout / retry / 連線數上限集中設定，可用環境變數覆寫
+- prewarm() 在啟動時先打一個輕量請求，把 TLS 握手提前做掉
+- httpx / langchain_openai 都在第一次用到時才 import，不拖慢腳本啟動
+- 每個模型都掛上 instrumentation 的 callback，延遲與 token 用量自動計入
+- 連線經過 endpoint_pool 的 transport：慢請求超過 p95 自動對沖、失敗換副本重送、斷路器
+  (副本以 LLM_POOL_WS_02=url1,url2 或 register_endpoint(name, url, *replicas) 設定；LLM_HEDGE=0 關閉)
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import weakref
+
+# ================= 設定 =================
+ENDPOINTS = {
+    "ws-02": "https://ws-02.wade0426.me/v1",
+    "ws-03": "https://ws-03.wade0426.me/v1",
+    "ws-05": "https://ws-05.huannago.com/v1",
+}
+
+API_KEY = os.getenv("LLM_API_KEY", "EMPTY")
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+_sync_clients: dict[str, httpx.Client] = {}
+_async_clients: dict[str, httpx.AsyncClient] = {}
+_models: dict[tuple, object] = {}
+_openai_clients: dict[str, object] = {}
+_pools: dict[str, object] = {}
+_replicas: dict[str, list[str]] = {}
+
+
+def _base_url(endpoint: str) -> str:
+    """endpoint 可以是註冊名稱 (ws-02) 或完整 URL；環境變數 LLM_ENDPOINT_WS_02 可覆寫"""
+    env_key = "LLM_ENDPOINT_" + endpoint.upper().replace("-", "_")
+    if os.getenv(env_key):
+        return os.environ[env_key]
+    return ENDPOINTS.get(endpoint, endpoint)
+
+
+def _limits() -> httpx.Limits:
+    import httpx
+
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    import httpx
+
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def register_endpoint(name: str, base_url: str, *replicas: str):
+    """新增或替換 endpoint (例如指向本機 stub server)；replicas 為同一模型的其他副本"""
+    with _lock:
+        ENDPOINTS[name] = base_url
+        _replicas[name] = [base_url, *replicas]
+
+
+def get_pool(endpoint: str):
+    """endpoint 的副本池 (延遲 / 錯誤率統計與斷路器狀態)"""
+    base_url = _base_url(endpoint)
+    with _lock:
+        pool = _pools.get(base_url)
+        if pool is None:
+            from endpoint_pool import EndpointPool, pool_members
+
+            members = _replicas.get(endpoint)
+            if not members or members[0] != base_url:  # 被 LLM_ENDPOINT_* 覆寫時不沿用登記的副本
+                members = pool_members(endpoint, base_url)
+            pool = EndpointPool(base_url, members)
+            _pools[base_url] = pool
+        return pool
+
+
+def get_http_client(endpoint: str) -> httpx.Client:
+    """取得 endpoint 專屬的同步連線池 (lazy 建立，之後共用)"""
+    base_url = _base_url(endpoint)
+    pool = get_pool(endpoint)
+    with _lock:
+        client = _sync_clients.get(base_url)
+        if client is None:
+            import httpx
+
+            from endpoint_pool import HedgedTransport
+
+            transport = HedgedTransport(pool, httpx.HTTPTransport(limits=_limits()), max_workers=MAX_CONNECTIONS)
+            client = httpx.Client(transport=transport, timeout=_timeout())
+            _sync_clients[base_url] = client
+        return client
+
+
+def _per_loop_transport():
+    """
+    async 連線會綁定建立它的 event loop；腳本可能多次 asyncio.run()，
+    所以每個 event loop 各自一組連線池，loop 被回收時連線池一併釋放。
+    """
+    import asyncio
+
+    import httpx
+
+    class PerLoopTransport(httpx.AsyncBaseTransport):
+        def __init__(self):
+            self._transports = weakref.WeakKeyDictionary()
+
+        def _current(self) -> httpx.AsyncHTTPTransport:
+            loop = asyncio.get_running_loop()
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = httpx.AsyncHTTPTransport(limits=_limits())
+                self._transports[loop] = transport
+            return transport
+
+        async def handle_async_request(self, request):
+            return await self._current().handle_async_request(request)
+
+        async def aclose(self):
+            await self._current().aclose()
+
+    return PerLoopTransport()
+
+
+def get_async_http_client(endpoint: str) -> httpx.AsyncClient:
+    """取得 endpoint 專屬的非同步連線池 (每個 event loop 各一組連線)"""
+    base_url = _base_url(endpoint)
+    pool = get_pool(endpoint)
+    with _lock:
+        client = _async_clients.get(base_url)
+        if client is None:
+            import httpx
+
+            from endpoint_pool import AsyncHedgedTransport
+
+            client = httpx.AsyncClient(transport=AsyncHedgedTransport(pool, _per_loop_transport()), timeout=_timeout())
+            _async_clients[base_url] = client
+        return client
+
+
+def _model_key(endpoint: str, model: str, kwargs: dict) -> tuple | None:
+    """
+    註冊表的 key：kwargs 以 JSON 比對，dict / list 參數 (model_kwargs、stop) 也能共用實例。
+    含 callback 等無法轉成 JSON 的物件時回傳 None，這種呼叫每次建立新實例，不快取。
+    """
+    try:
+        return _base_url(endpoint), model, json.dumps(kwargs, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_llm(model: str, endpoint: str = "ws-02", **kwargs):
+    """
+    取得共用的 ChatOpenAI 實例。
+
+    相同 (endpoint, model, 參數) 只會建立一次；同 endpoint 的不同模型共用連線池。
+    kwargs 直接傳給 ChatOpenAI (temperature, max_tokens, model_kwargs...)。
+    """
+    key = _model_key(endpoint, model, kwargs)
+    if key is not None:
+        with _lock:
+            llm = _models.get(key)
+        if llm is not None:
+            return llm
+
+    from langchain_openai import ChatOpenAI
+
+    from instrumentation import ENABLED as METRICS_ENABLED, metrics_callback
+
+    if METRICS_ENABLED:
+        # 每個模型的延遲與 token 用量 (見 instrumentation.py)
+        kwargs["callbacks"] = [*kwargs.get("callbacks", []), metrics_callback()]
+    llm = ChatOpenAI(
+        model=model,
+        base_url=_base_url(endpoint),
+        api_key=API_KEY,
+        timeout=_timeout(),
+        max_retries=MAX_RETRIES,
+        http_client=get_http_client(endpoint),
+        http_async_client=get_async_http_client(endpoint),
+        **kwargs,
+    )
+    if key is None:
+        return llm
+    with _lock:
+        return _models.setdefault(key, llm)
+
+
+class LazyLLM:
+    """
+    延遲建立的模型代理。
+
+    模組載入時只記下參數，第一次 invoke / stream / bind_tools ... 時才 import
+    langchain_openai 並向註冊表取得實例。要串進 LCEL chain 時用 .get() 取出本體。
+    """
+
+    def __init__(self, model: str, endpoint: str = "ws-02", **kwargs):
+        self._model = model
+        self._endpoint = endpoint
+        self._kwargs = kwargs
+        self._llm = None  # 第一次取得後保留 (不能快取的參數也不會每次存取都建一個新實例)
+
+    def get(self):
+        if self._llm is None:
+            self._llm = get_llm(self._model, self._endpoint, **self._kwargs)
+        return self._llm
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def lazy_llm(model: str, endpoint: str = "ws-02", **kwargs) -> LazyLLM:
+    return LazyLLM(model, endpoint, **kwargs)
+
+
+def get_openai_client(endpoint: str = "ws-03"):
+    """取得共用連線池的原生 OpenAI client (給不經過 LangChain 的腳本使用)"""
+    base_url = _base_url(endpoint)
+    with _lock:
+        client = _openai_clients.get(base_url)
+    if client is not None:
+        return client
+
+    from openai import OpenAI
+
+    client = OpenAI(
+        base_url=base_url,
+        api_key=API_KEY,
+        timeout=_timeout(),
+        max_retries=MAX_RETRIES,
+        http_client=get_http_client(endpoint),
+    )
+    with _lock:
+        return _openai_clients.setdefault(base_url, client)
+
+
+def _warm(endpoint: str):
+    import httpx
+
+    try:
+        get_http_client(endpoint).get(
+            f"{_base_url(endpoint)}/models",
+            headers={"Authorization": f"Bearer {API_KEY}"},
+        )
+    except httpx.HTTPError as e:
+        print(f"[registry] 預熱 {endpoint} 失敗: {e}")
+
+
+def prewarm(*endpoints: str, wait: bool = False):
+    """
+    啟動時預先建立連線 (TCP + TLS)，讓第一個節點的請求不用付握手成本。
+    預設在背景執行緒進行，不阻塞啟動流程。
+    """
+    threads = [
+        threading.Thread(target=_warm, args=(ep,), daemon=True)
+        for ep in (endpoints or ENDPOINTS)
+    ]
+    for t in threads:
+        t.start()
+    if wait:
+        for t in threads:
+            t.join()
+    return threads
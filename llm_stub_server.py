@@ -0,0 +1,147 @@
+"""
+本機 OpenAI 相容 stub server：注入延遲、長尾與錯誤，用來測試 endpoint_pool 的對沖與斷路器
+
+    python llm_stub_server.py --port 9001 --delay 0.2 --slow-rate 0.1 --slow-delay 3
+    python llm_stub_server.py --port 9002 --fail-rate 0.5
+    LLM_POOL_WS_02=http://127.0.0.1:9001/v1,http://127.0.0.1:9002/v1 python day4/ch7_2.py
+
+- GET  /v1/models             預熱用
+- POST /v1/chat/completions   一般與 stream 回應都支援，內容固定為 --reply
+每個請求的延遲 = delay ± jitter；有 slow-rate 的機率改為 slow-delay (模擬長尾)；
+有 fail-rate 的機率回 500。state 的欄位可以在執行中修改 (例如把 fail_rate 改成 1 模擬當機)。
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, delay: float = 0.1, jitter: float = 0.0, slow_rate: float = 0.0,
+                 slow_delay: float = 3.0, fail_rate: float = 0.0, reply: str = "stub reply"):
+        self.delay = delay
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.fail_rate = fail_rate
+        self.reply = reply
+        self.requests = {"ok": 0, "failed": 0, "slow": 0}
+        self.lock = threading.Lock()
+
+    def next_outcome(self) -> tuple[float, bool]:
+        """這次請求要等多久、是否失敗"""
+        with self.lock:
+            if random.random() < self.fail_rate:
+                self.requests["failed"] += 1
+                return self.delay, False
+            if random.random() < self.slow_rate:
+                self.requests["slow"] += 1
+                return self.slow_delay, True
+            self.requests["ok"] += 1
+        return max(self.delay + random.uniform(-self.jitter, self.jitter), 0), True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 對沖輸掉的請求會被 client 直接斷線，不必印 traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                return self._send(200, {"object": "list", "data": []})
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._send(404, {"error": "not found"})
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            delay, ok = state.next_outcome()
+            time.sleep(delay)
+            if not ok:
+                return self._send(500, {"error": {"message": "injected failure"}})
+
+            model = request.get("model", "stub")
+            usage = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+            if not request.get("stream"):
+                return self._send(200, {
+                    "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": state.reply},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(payload):
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            for i in range(0, len(state.reply), 4):
+                delta = {"content": state.reply[i:i + 4]}
+                event(json.dumps(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]),
+                                 ensure_ascii=False))
+            event(json.dumps(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}], usage=usage)))
+            event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def serve(port: int = 9001, **kwargs):
+    """啟動 stub server (回傳 server, state)，可在測試中以執行緒方式使用"""
+    state = StubState(**kwargs)
+    server = StubServer(("127.0.0.1", port), make_handler(state))
+    return server, state
+
+
+def serve_in_thread(**kwargs):
+    server, state = serve(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機 OpenAI 相容 stub server")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--delay", type=float, default=0.1, help="一般請求的延遲 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲的隨機變動幅度 (秒)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="長尾請求的比例")
+    parser.add_argument("--slow-delay", type=float, default=3.0, help="長尾請求的延遲 (秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="回 500 的比例")
+    parser.add_argument("--reply", default="stub reply")
+    args = parser.parse_args()
+
+    server, _ = serve(args.port, delay=args.delay, jitter=args.jitter, slow_rate=args.slow_rate,
+                      slow_delay=args.slow_delay, fail_rate=args.fail_rate, reply=args.reply)
+    print(f"LLM stub server: http://127.0.0.1:{args.port}/v1 (delay={args.delay}s, fail_rate={args.fail_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
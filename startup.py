@@ -0,0 +1,40 @@
+"""
+啟動加速工具 (Startup helpers)
+
+- lazy_import(): 模組第一次被存取屬性時才真正載入 (pandas 這類重量級套件)
+- maybe_show_graph(): ASCII 流程圖改成 --show-graph 或 SHOW_GRAPH=1 才輸出
+Graph 編譯則由各腳本的 get_app() (functools.cache) 延遲到第一次使用。
+"""
+import importlib.util
+import os
+import sys
+
+
+def lazy_import(name: str):
+    """回傳延遲載入的模組物件；真正的 import 發生在第一次存取屬性時"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def show_graph_requested(argv=None) -> bool:
+    argv = sys.argv[1:] if argv is None else argv
+    return "--show-graph" in argv or os.getenv("SHOW_GRAPH") == "1"
+
+
+def maybe_show_graph(get_app, argv=None):
+    """
+    只有在明確要求時才畫 ASCII 流程圖。
+    傳入的是 get_app (不是 app)，沒要求畫圖時連 Graph 編譯都不會提前發生。
+    """
+    if show_graph_requested(argv):
+        print(get_app().get_graph().draw_ascii())
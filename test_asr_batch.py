@@ -0,0 +1,68 @@
+"""
+asr_batch：同名音檔的輸出與續跑紀錄 (在本機啟動 asr_stub_server，不連外部 API)
+
+    python -m pytest -q test_asr_batch.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day3"))
+
+import asr_stub_server  # noqa: E402
+from asr_batch import BatchTranscriber, JobTable  # noqa: E402
+from hw_asr import AsrClient  # noqa: E402
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # out/ 與 out/cache 寫在暫存目錄
+    server, state = asr_stub_server.serve_in_thread(port=0, delay=0.1)
+    client = AsrClient(base=f"http://127.0.0.1:{server.server_address[1]}", initial_delay=0.05)
+    yield client, state
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def run_batch(client, paths):
+    batch = BatchTranscriber(client=client, job_table=JobTable(Path("out/asr_jobs.json")))
+    return batch, dict(batch.run(paths))
+
+
+def test_same_file_name_in_different_folders(stub, tmp_path):
+    client, state = stub
+    paths = []
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        path = tmp_path / folder / "x.wav"
+        path.write_bytes(f"RIFF {folder}".encode())
+        paths.append(path)
+
+    batch, _ = run_batch(client, paths)
+
+    records = [batch.jobs.get(str(p)) for p in paths]
+    assert records[0]["txt_path"] != records[1]["txt_path"]
+    assert records[0]["srt_path"] != records[1]["srt_path"]
+    assert all(Path(r["txt_path"]).exists() and Path(r["srt_path"]).exists() for r in records)
+    assert state.requests["create"] == 2
+
+    # 續跑：兩個檔都讀回自己的結果，不再上傳
+    batch, results = run_batch(client, paths)
+    assert batch.resumed == 2
+    assert state.requests["create"] == 2
+    assert set(results) == set(paths)
+
+
+def test_changed_file_is_not_resumed_from_old_record(stub, tmp_path):
+    client, state = stub
+    path = tmp_path / "x.wav"
+    path.write_bytes(b"RIFF old")
+    run_batch(client, [path])
+
+    path.write_bytes(b"RIFF new")
+    batch, _ = run_batch(client, [path])
+
+    assert batch.resumed == 0
+    assert state.requests["create"] == 2
@@ -0,0 +1,67 @@
+"""
+bulk_translate：JSONL 快取追加寫入與單批失敗 (假的 translate_batch，不連線)
+
+    python -m pytest -q test_bulk_translate.py
+"""
+import io
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day4"))
+
+import bulk_translate  # noqa: E402
+from ch7_1 import load_cache, save_cache_many  # noqa: E402
+
+TEXT = "第一句。第二句。\n壞掉的句子。第一句。"
+
+
+def fake_translate_batch(fail_on: str = "", calls: list | None = None):
+    def translate_batch(sentences, issues=None, check=False):
+        if calls is not None:
+            calls.append(list(sentences))
+        if fail_on in sentences:
+            raise RuntimeError("server error")
+        return [SimpleNamespace(translation=f"EN:{s}", passed=True, issues="") for s in sentences], 1
+    return translate_batch
+
+
+def run(cache_file, **kwargs) -> tuple[str, dict]:
+    out = io.StringIO()
+    stats = bulk_translate.translate_document(TEXT, out, workers=2, batch_size=1, cache_file=str(cache_file), **kwargs)
+    return out.getvalue(), stats
+
+
+def test_failed_batch_is_marked_and_others_are_cached(monkeypatch, tmp_path):
+    cache_file = tmp_path / "cache.jsonl"
+    calls = []
+    monkeypatch.setattr(bulk_translate, "translate_batch", fake_translate_batch("壞掉的句子。", calls))
+
+    output, stats = run(cache_file)
+
+    assert output == "EN:第一句。 EN:第二句。\n[翻譯失敗] 壞掉的句子。 EN:第一句。\n"
+    assert stats["failed"] == 1
+    assert calls.count(["壞掉的句子。"]) == bulk_translate.BATCH_ATTEMPTS
+    assert load_cache(str(cache_file)) == {"第一句。": "EN:第一句。", "第二句。": "EN:第二句。"}
+
+    # 重跑：只送之前失敗的那句
+    calls.clear()
+    monkeypatch.setattr(bulk_translate, "translate_batch", fake_translate_batch(calls=calls))
+    output, stats = run(cache_file)
+    assert calls == [["壞掉的句子。"]]
+    assert stats["cache_hits"] == 3 and stats["failed"] == 0
+    assert "[翻譯失敗]" not in output
+
+
+def test_cache_appends_and_skips_broken_tail(tmp_path):
+    cache_file = str(tmp_path / "cache.jsonl")
+    save_cache_many({"a": "A"}, cache_file)
+    with open(cache_file, "a", encoding="utf-8") as f:
+        f.write('{"original": "b", "transl')  # 中斷時寫到一半
+    save_cache_many({"c": "C", "a": "A2"}, cache_file)
+
+    lines = Path(cache_file).read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 4
+    assert json.loads(lines[-1]) == {"original": "a", "translated": "A2"}
+    assert load_cache(cache_file) == {"a": "A2", "c": "C"}
@@ -0,0 +1,105 @@
+"""
+ch7_2 串接模式：用假的模型跑一次升級流程，不連線
+
+    python -m pytest -q test_ch7_2.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day4"))
+
+import ch7_2  # noqa: E402
+from router import ComplexityRouter  # noqa: E402
+
+
+class FakeLLM:
+    """stream() 依序吐出 pieces，每段之間等 delay 秒"""
+
+    def __init__(self, pieces, delay=0.0):
+        self.pieces = pieces
+        self.delay = delay
+
+    def stream(self, messages):
+        from langchain_core.messages import AIMessageChunk
+
+        for piece in self.pieces:
+            time.sleep(self.delay)
+            yield AIMessageChunk(content=piece)
+
+
+class RecordingRouter(ComplexityRouter):
+    """每個問題都判成 fast (升級時 state['route'] 才會是 fast 的決策)，並記下 observe / feedback 的呼叫"""
+
+    def __init__(self):
+        super().__init__({"bias": -30.0}, log_file=None)
+        self.observed = []
+        self.feedbacks = []
+
+    def observe(self, decision, seconds):
+        self.observed.append((decision["route"], seconds))
+        super().observe(decision, seconds)
+
+    def feedback(self, decision, needs_expert):
+        self.feedbacks.append(needs_expert)
+        super().feedback(decision, needs_expert)
+
+
+@pytest.fixture
+def cascade(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # qa_cache.json 寫在暫存目錄
+    router = RecordingRouter()
+    monkeypatch.setattr(ch7_2, "get_router", lambda: router)
+    monkeypatch.setattr(ch7_2, "CASCADE", True)
+    return router
+
+
+def test_escalation_records_expert_latency_on_expert_route(cascade, monkeypatch):
+    monkeypatch.setattr(ch7_2, "fast_llm", FakeLLM(["初步回答", "\n[信心：", "3]"]))
+    monkeypatch.setattr(ch7_2, "llm", FakeLLM(["專家", "回答"], delay=0.1))
+
+    result = ch7_2.get_app().invoke({"question": "請比較兩種分散式共識演算法的優缺點"})
+
+    assert result["route"]["route"] == "fast"
+    assert result["source"] == "LLM_EXPERT"
+    assert result["draft"] == "初步回答"
+    assert [route for route, _ in cascade.observed] == ["fast", "expert"]
+    fast_seconds = cascade.observed[0][1]
+    # 專家模型的延遲不能混進 fast 的 EWMA
+    assert cascade.latency["fast"] == fast_seconds
+    assert cascade.latency["expert"] >= 0.2
+    assert cascade.feedbacks == [True]
+
+
+def test_accept_keeps_fast_answer(cascade, monkeypatch):
+    monkeypatch.setattr(ch7_2, "fast_llm", FakeLLM(["這是答案", "\n[信心:9]"]))
+    monkeypatch.setattr(ch7_2, "llm", FakeLLM(["不該被呼叫"]))
+
+    result = ch7_2.get_app().invoke({"question": "台灣的首都是哪裡"})
+
+    assert result["source"] == "CASCADE_FAST"
+    assert result["answer"] == "這是答案"
+    assert [route for route, _ in cascade.observed] == ["fast"]
+    assert cascade.feedbacks == [False]
+
+
+@pytest.mark.parametrize("pieces", [
+    ["答案", "[信", "心:", "8]"],
+    ["答案", "[信", "心：", "8]"],
+    ["答案[信心：8]"],
+    ["答案 [", "信心", "：8]"],
+])
+def test_stream_hides_confidence_mark(pieces, capsys):
+    full = ch7_2.stream_until_mark(FakeLLM(pieces).stream([]))
+
+    assert ch7_2.CONFIDENCE_PATTERN.search(full).group(1) == "8"
+    printed = capsys.readouterr().out
+    assert "信心" not in printed and "[" not in printed
+    assert printed.strip() == "答案"
+
+
+def test_stream_prints_brackets_that_are_not_the_mark(capsys):
+    ch7_2.stream_until_mark(FakeLLM(["見 [", "附錄] 說明"]).stream([]))
+    assert capsys.readouterr().out == "見 [附錄] 說明"
@@ -0,0 +1,224 @@
+"""
+endpoint_pool 的對沖、故障轉移與斷路器 (在本機啟動 llm_stub_server 注入延遲與錯誤，不連外部 API)
+
+    python -m pytest -q test_endpoint_pool.py
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import endpoint_pool
+import llm_stub_server
+from endpoint_pool import AsyncHedgedTransport, EndpointPool, HedgedTransport
+from instrumentation import METRICS
+
+BODY = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """啟動 stub server；回傳啟動函式 (參數同 llm_stub_server.serve) -> (base_url, state)"""
+    monkeypatch.setattr(endpoint_pool, "HEDGE_MIN_SAMPLES", 3)
+    monkeypatch.setattr(endpoint_pool, "EWMA_HALF_LIFE", 1e9)  # 測試期間不讓 EWMA 衰減改變選擇順序
+    servers = []
+
+    def start(**kwargs):
+        server, state = llm_stub_server.serve_in_thread(port=0, **kwargs)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1", state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def counter(name: str) -> float:
+    return sum(v for (key, _), v in METRICS.counters.items() if key == name)
+
+
+def member(pool: EndpointPool, url: str):
+    return next(m for m in pool.members if m.base_url == url)
+
+
+def state_of(pool: EndpointPool, url: str) -> str:
+    return next(row["state"] for row in pool.status() if row["endpoint"] == url)
+
+
+def warm_up(client: httpx.Client, pool: EndpointPool, requests: int = 8):
+    for _ in range(requests):
+        client.post(f"{pool.primary}/chat/completions", json=BODY).raise_for_status()
+
+
+# --- 對沖 ---
+def test_hedge_wins_over_slow_primary(stubs):
+    urls, states = zip(*(stubs(delay=0.02) for _ in range(2)))
+    pool = EndpointPool(urls[0], list(urls))
+    with httpx.Client(transport=HedgedTransport(pool, httpx.HTTPTransport()), timeout=10) as client:
+        warm_up(client, pool)
+        slow = pool.pick("request")
+        states[urls.index(slow.base_url)].delay = 2.0
+        wins = counter("endpoint_hedge_wins_total")
+
+        start = time.perf_counter()
+        response = client.post(f"{urls[0]}/chat/completions", json=BODY)
+        elapsed = time.perf_counter() - start
+
+    assert response.json()["choices"][0]["message"]["content"] == "stub reply"
+    assert elapsed < 1.0
+    assert counter("endpoint_hedge_wins_total") == wins + 1
+
+
+class RecordingTransport(httpx.AsyncHTTPTransport):
+    """記下被取消的請求"""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = []
+
+    async def handle_async_request(self, request):
+        try:
+            return await super().handle_async_request(request)
+        except asyncio.CancelledError:
+            self.cancelled.append(str(request.url))
+            raise
+
+
+def test_async_hedge_cancels_loser(stubs):
+    urls, states = zip(*(stubs(delay=0.02) for _ in range(2)))
+    pool = EndpointPool(urls[0], list(urls))
+    inner = RecordingTransport()
+
+    async def run():
+        async with httpx.AsyncClient(transport=AsyncHedgedTransport(pool, inner), timeout=10) as client:
+            for _ in range(8):
+                (await client.post(f"{urls[0]}/chat/completions", json=BODY)).raise_for_status()
+            slow = pool.pick("request")
+            states[urls.index(slow.base_url)].delay = 2.0
+            start = time.perf_counter()
+            response = await client.post(f"{urls[0]}/chat/completions", json=BODY)
+            return slow, response, time.perf_counter() - start
+
+    slow, response, elapsed = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert elapsed < 1.0
+    assert len(inner.cancelled) == 1 and inner.cancelled[0].startswith(slow.base_url)
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        yield b"{}"
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_async_closes_response_finished_in_same_round():
+    """主要請求與對沖請求在同一輪 asyncio.wait 一起完成：沒被採用的那份要關閉"""
+    urls = ["http://a.test/v1", "http://b.test/v1"]
+    pool = EndpointPool(urls[0], urls)
+    for m in pool.members:
+        for _ in range(endpoint_pool.HEDGE_MIN_SAMPLES):
+            pool.record_success(m, "request", 0.01)
+    streams = []
+
+    async def run():
+        release = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.2, release.set)  # 兩份請求都在路上之後才一起放行
+
+        async def handler(request):
+            await release.wait()
+            streams.append(TrackedStream())
+            return httpx.Response(200, stream=streams[-1])
+
+        transport = AsyncHedgedTransport(pool, httpx.MockTransport(handler))
+        return await transport.handle_async_request(httpx.Request("POST", f"{urls[0]}/chat/completions", json=BODY))
+
+    response = asyncio.run(run())
+
+    assert len(streams) == 2
+    assert [s.closed for s in streams].count(True) == 1
+    assert not response.stream.closed
+
+
+# --- 故障轉移與斷路器 ---
+@pytest.fixture
+def breaker(stubs, monkeypatch):
+    """壞掉的主要 endpoint + 正常的備援；連續失敗 2 次斷路，冷卻 0.3 秒"""
+    monkeypatch.setattr(endpoint_pool, "HEDGE", False)
+    monkeypatch.setattr(endpoint_pool, "BREAKER_FAILURES", 2)
+    monkeypatch.setattr(endpoint_pool, "BREAKER_COOLDOWN", 0.3)
+    bad_url, bad = stubs(delay=0.01, fail_rate=1.0)
+    good_url, good = stubs(delay=0.01)
+    pool = EndpointPool(bad_url, [bad_url, good_url])
+    client = httpx.Client(transport=HedgedTransport(pool, httpx.HTTPTransport()), timeout=10)
+    yield pool, client, bad, good
+    client.close()
+
+
+def post(client, pool):
+    return client.post(f"{pool.primary}/chat/completions", json=BODY)
+
+
+def test_failover_to_healthy_member(breaker):
+    pool, client, bad, good = breaker
+
+    response = post(client, pool)
+
+    assert response.status_code == 200
+    assert bad.requests["failed"] == 1
+    assert good.requests["ok"] == 1
+
+
+def test_breaker_opens_then_half_open_probe_closes_it(breaker):
+    pool, client, bad, good = breaker
+    bad_url = pool.members[0].base_url
+
+    for _ in range(2):
+        assert post(client, pool).status_code == 200
+    assert state_of(pool, bad_url) == "open"
+
+    # 斷路期間不再送到壞掉的 endpoint
+    for _ in range(3):
+        assert post(client, pool).status_code == 200
+    assert bad.requests["failed"] == 2
+    assert good.requests["ok"] == 5
+
+    time.sleep(0.35)
+    assert state_of(pool, bad_url) == "half-open"
+    bad.fail_rate = 0.0  # 修好了：試探請求成功就恢復
+    assert post(client, pool).status_code == 200
+    assert bad.requests["ok"] == 1
+    assert state_of(pool, bad_url) == "closed"
+    assert member(pool, bad_url).consecutive_failures == 0
+
+
+def test_failed_probe_reopens_breaker(breaker):
+    pool, client, bad, good = breaker
+    bad_url = pool.members[0].base_url
+    for _ in range(2):
+        post(client, pool)
+    time.sleep(0.35)
+
+    assert post(client, pool).status_code == 200  # 試探失敗，轉給備援
+    assert bad.requests["failed"] == 3
+    assert state_of(pool, bad_url) == "open"
+
+    post(client, pool)
+    assert bad.requests["failed"] == 3  # 重新計時，冷卻期間不再試探
+
+
+def test_all_members_down_returns_last_error(stubs, monkeypatch):
+    monkeypatch.setattr(endpoint_pool, "HEDGE", False)
+    urls, _ = zip(*(stubs(delay=0.01, fail_rate=1.0) for _ in range(2)))
+    pool = EndpointPool(urls[0], list(urls))
+    with httpx.Client(transport=HedgedTransport(pool, httpx.HTTPTransport()), timeout=10) as client:
+        response = client.post(f"{urls[0]}/chat/completions", json=BODY)
+
+    assert response.status_code == 500
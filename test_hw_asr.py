@@ -0,0 +1,176 @@
+"""
+hw_asr 對本機 asr_stub_server 的請求次數：快取、輪詢退避、串流上傳 (在本機啟動 asr_stub_server，不連外部 API)
+
+    python -m pytest -q test_hw_asr.py
+"""
+import os
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day3"))
+
+import asr_stub_server  # noqa: E402
+import hw_asr  # noqa: E402
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    """啟動 stub server；回傳 (啟動函式, 目前的 state)，可在測試中指定延遲"""
+    monkeypatch.chdir(tmp_path)  # out/ 與 out/cache 寫在暫存目錄
+    servers = []
+
+    def start(**kwargs):
+        server, state = asr_stub_server.serve_in_thread(port=0, **kwargs)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}", state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def wav(tmp_path):
+    path = tmp_path / "sample.wav"
+    path.write_bytes(os.urandom(600 * 1024))  # 大於一個 chunk，上傳會分好幾塊
+    return path
+
+
+def test_cached_second_call_makes_no_requests(stub, monkeypatch, wav):
+    base, state = stub(delay=0.1)
+    monkeypatch.setattr(hw_asr, "AsrClient", partial(hw_asr.AsrClient, base=base, initial_delay=0.05))
+
+    first = hw_asr.main(wav)
+    requests_after_first = dict(state.requests)
+    second = hw_asr.main(wav)
+
+    assert requests_after_first["create"] == 1
+    assert state.requests == requests_after_first  # 第二次 0 個 create、0 個 poll
+    assert first == second == asr_stub_server.SAMPLE_SRT
+    assert (hw_asr.CACHE_DIR / f"{hw_asr.audio_hash(wav)}.srt").exists()
+
+
+def test_main_reuses_callers_digest(stub, monkeypatch, wav):
+    """hw3 已算過 hash 時傳入 digest，main 不再重讀整個音檔"""
+    base, _ = stub(delay=0.1)
+    monkeypatch.setattr(hw_asr, "AsrClient", partial(hw_asr.AsrClient, base=base, initial_delay=0.05))
+    digest = hw_asr.audio_hash(wav)
+    monkeypatch.setattr(hw_asr, "audio_hash", lambda path: pytest.fail("audio_hash called again"))
+
+    assert hw_asr.main(wav, use_cache=False, digest=digest) == asr_stub_server.SAMPLE_SRT
+    assert (hw_asr.CACHE_DIR / f"{digest}.srt").exists()
+
+
+def test_polling_backs_off(stub, wav):
+    base, state = stub(delay=1.0)
+    client = hw_asr.AsrClient(base=base, initial_delay=0.1, backoff=2.0, jitter=0.0)
+    try:
+        start = time.monotonic()
+        result = client.submit(wav).result(timeout=10)
+        elapsed = time.monotonic() - start
+    finally:
+        client.close()
+
+    assert result.txt and result.srt == asr_stub_server.SAMPLE_SRT
+    # 0, 0.1, 0.3, 0.7, 1.5 秒各打一次 TXT 與 SRT；固定每 0.1 秒打會超過 20 次
+    assert state.requests["poll"] <= 12
+    assert elapsed < 2.5
+
+
+def test_backoff_is_capped():
+    client = hw_asr.AsrClient(base="http://127.0.0.1:9", backoff=2.0, max_delay=3.0, jitter=0.0)
+    try:
+        delays = [0.5]
+        for _ in range(5):
+            delays.append(client.next_delay(delays[-1]))
+    finally:
+        client.close()
+    assert delays == [0.5, 1.0, 2.0, 3.0, 3.0, 3.0]
+
+
+def test_upload_streams_whole_file(stub, wav):
+    base, state = stub(delay=0)
+    body = hw_asr.MultipartFile(wav)
+    chunks = list(body)
+
+    client = hw_asr.AsrClient(base=base)
+    try:
+        task_id = client.create_task(wav)
+    finally:
+        client.close()
+
+    assert len(chunks) == 5  # head + 3 塊檔案內容 + tail
+    assert b"".join(chunks[1:-1]) == wav.read_bytes()
+    assert state.requests["create"] == 1
+    assert state.tasks[task_id]["bytes"] == len(body) == wav.stat().st_size + len(body.head) + len(body.tail)
+
+
+def run_poller(client, task_ids) -> dict:
+    poller = client.poller()
+    for task_id in task_ids:
+        poller.add(task_id, task_id)
+    finished = {}
+    while poller:
+        time.sleep(poller.next_wait())
+        finished.update(poller.poll())
+    return finished
+
+
+def test_poller_finishes_many_tasks_in_one_loop(stub, wav):
+    base, state = stub(delay=0.3)
+    client = hw_asr.AsrClient(base=base, initial_delay=0.05, jitter=0.0)
+    try:
+        task_ids = [client.create_task(wav) for _ in range(5)]
+        finished = run_poller(client, task_ids)
+    finally:
+        client.close()
+
+    assert set(finished) == set(task_ids)
+    assert all(r.txt and r.srt == asr_stub_server.SAMPLE_SRT for r in finished.values())
+
+
+def test_poller_reports_timeout_without_text(stub, wav):
+    base, state = stub(delay=60)
+    client = hw_asr.AsrClient(base=base, initial_delay=0.05, wait_timeout=0.3)
+    try:
+        finished = run_poller(client, [client.create_task(wav)])
+    finally:
+        client.close()
+
+    [result] = finished.values()
+    assert result.txt is None and result.srt is None
+
+
+def test_slow_poll_does_not_stall_other_tasks(stub, wav):
+    """某個任務的 GET 卡住時，其他任務照常輪詢完成"""
+    base, state = stub(delay=0.1)
+    client = hw_asr.AsrClient(base=base, initial_delay=0.05, jitter=0.0)
+    fetch_once = client.fetch_once
+    try:
+        slow, fast = client.create_task(wav), client.create_task(wav)
+
+        def fetch(url):
+            if slow in url:
+                time.sleep(2)
+            return fetch_once(url)
+
+        client.fetch_once = fetch
+        poller = client.poller()
+        poller.add(slow, slow)
+        poller.add(fast, fast)
+        start = time.monotonic()
+        finished_at = {}
+        while poller:
+            time.sleep(poller.next_wait())
+            for key, _ in poller.poll():
+                finished_at[key] = time.monotonic() - start
+    finally:
+        client.close()
+
+    assert finished_at[fast] < 1.0
+    assert finished_at[slow] >= 2.0
@@ -0,0 +1,42 @@
+"""
+instrumentation.instrument_node：同步與 async 節點都要計時
+
+    python -m pytest -q test_instrumentation.py
+"""
+import asyncio
+import functools
+
+import pytest
+
+from instrumentation import METRICS, instrument_node
+
+
+async def _answer(state, suffix=""):
+    await asyncio.sleep(0.01)
+    return {"answer": state["q"] + suffix}
+
+
+def latency_count(node: str) -> int:
+    return sum(h.count for (name, labels), h in METRICS.histograms.items()
+               if name == "node_latency_seconds" and dict(labels).get("node") == node)
+
+
+@pytest.mark.parametrize("fn", [_answer, functools.partial(_answer, suffix="!")], ids=["coroutine", "partial"])
+def test_async_node_is_awaited_and_timed(fn):
+    node = instrument_node(fn, name=f"async_{id(fn)}")
+    before = latency_count(f"async_{id(fn)}")
+
+    result = asyncio.run(node({"q": "hi"}))
+
+    assert result["answer"].startswith("hi")
+    assert latency_count(f"async_{id(fn)}") == before + 1
+    assert METRICS.histograms[("node_latency_seconds", (("node", f"async_{id(fn)}"),))].sum >= 0.01
+
+
+def test_sync_node():
+    @instrument_node
+    def echo_node(state):
+        return state
+
+    assert echo_node({"q": 1}) == {"q": 1}
+    assert latency_count("echo") >= 1
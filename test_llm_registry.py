@@ -0,0 +1,37 @@
+"""
+llm_registry：get_llm 的實例共用 (只建立 ChatOpenAI 物件，不送請求)
+
+    python -m pytest -q test_llm_registry.py
+"""
+from langchain_core.callbacks import BaseCallbackHandler
+
+import llm_registry
+from llm_registry import get_llm, lazy_llm
+
+
+class Callback(BaseCallbackHandler):
+    pass
+
+
+def test_dict_and_list_kwargs_share_instance():
+    first = get_llm("stub-model", temperature=0, model_kwargs={"user": "a"}, stop=["\n"])
+    second = get_llm("stub-model", stop=["\n"], model_kwargs={"user": "a"}, temperature=0)
+
+    assert first is second
+    assert get_llm("stub-model", temperature=0, model_kwargs={"user": "b"}, stop=["\n"]) is not first
+
+
+def test_non_json_kwargs_are_not_cached():
+    models = len(llm_registry._models)
+
+    first = get_llm("stub-model", callbacks=[Callback()])
+    second = get_llm("stub-model", callbacks=[Callback()])
+
+    assert first is not second
+    assert len(llm_registry._models) == models
+
+
+def test_lazy_llm_resolves_once():
+    lazy = lazy_llm("stub-model", callbacks=[Callback()])
+
+    assert lazy.get() is lazy.get()
@@ -0,0 +1,90 @@
+"""
+map_reduce：階層式 reduce 與視窗快取 (假的 chain，不連線)
+
+    python -m pytest -q test_map_reduce.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day3"))
+
+from map_reduce import WindowCache, map_reduce  # noqa: E402
+
+WINDOWS = [f"w{i}" for i in range(5)]
+PART_SEP = "\n\n---\n\n"  # map_reduce 串接各份結果的分隔
+
+
+class FakeChain:
+    """ainvoke 回傳 "<name>(<輸入>)"，記下每次呼叫與最大同時數"""
+
+    def __init__(self, name: str, delay: float = 0.0):
+        self.name = name
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    async def ainvoke(self, payload: dict) -> str:
+        (text,) = payload.values()
+        self.calls.append(text)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(self.delay)
+        self.running -= 1
+        return f"{self.name}({text.replace(PART_SEP, '|')})"
+
+
+def run(windows=WINDOWS, **kwargs) -> str:
+    return asyncio.run(map_reduce(windows, kwargs.pop("map_chain"), kwargs.pop("reduce_chain", None),
+                                  kind="test", **kwargs))
+
+
+def test_reduce_combines_fan_in_parts_per_level():
+    map_chain, reduce_chain = FakeChain("M"), FakeChain("R")
+
+    result = run(map_chain=map_chain, reduce_chain=reduce_chain, fan_in=2)
+
+    # 5 -> 3 -> 2 -> 1，順序保持不變
+    assert result == "R(R(R(M(w0)|M(w1))|R(M(w2)|M(w3)))|R(R(M(w4))))"
+    assert len(map_chain.calls) == 5
+    assert len(reduce_chain.calls) == 3 + 2 + 1
+
+
+def test_without_reduce_chain_joins_in_order():
+    assert run(map_chain=FakeChain("M")) == "\n\n".join(f"M({w})" for w in WINDOWS)
+
+
+def test_map_respects_max_concurrency_and_streams_partials():
+    map_chain = FakeChain("M", delay=0.02)
+    partials = []
+
+    async def windows():
+        for w in WINDOWS:
+            yield w
+
+    run(windows(), map_chain=map_chain, max_concurrency=2,
+        on_partial=lambda i, total, text: partials.append((i, total, text)))
+
+    assert map_chain.max_running == 2
+    assert sorted(partials) == [(i, None, f"M(w{i})") for i in range(5)]
+
+
+def test_rerun_hits_cache_without_calling_chains(tmp_path):
+    path = str(tmp_path / "cache.jsonl")
+    first = run(map_chain=FakeChain("M"), reduce_chain=FakeChain("R"), fan_in=2, cache=WindowCache(path))
+
+    map_chain, reduce_chain = FakeChain("M"), FakeChain("R")
+    cache = WindowCache(path)  # 重新從檔案載入
+    second = run(map_chain=map_chain, reduce_chain=reduce_chain, fan_in=2, cache=cache)
+
+    assert second == first
+    assert map_chain.calls == [] and reduce_chain.calls == []
+    assert (cache.hits, cache.misses) == (5 + 6, 0)
+
+    # 改了一個視窗：只重算那個視窗與它往上的 reduce
+    map_chain, reduce_chain = FakeChain("M"), FakeChain("R")
+    run(["w0", "w1", "w2", "w3", "changed"], map_chain=map_chain, reduce_chain=reduce_chain,
+        fan_in=2, cache=WindowCache(path))
+    assert map_chain.calls == ["changed"]
+    assert len(reduce_chain.calls) == 3
@@ -0,0 +1,103 @@
+"""
+order_extract 規則與 ch5_1 pre_extract 的路由 (假模型，不連線)
+
+    python -m pytest -q test_order_extract.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day3"))
+
+import ch5_1  # noqa: E402
+from order_extract import extract_rules, fill_missing, missing_fields  # noqa: E402
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("我是王小明，電話0912-345-678，要買3個保溫杯，送到台北市大安區忠孝東路四段100號",
+     {"name": "王小明", "phone": "0912345678", "product": "保溫杯", "quantity": 3,
+      "address": "台北市大安區忠孝東路四段100號"}),
+    ("我是王小明 0912345678 要買2個iPhone 15 Pro 送到台北市大安區忠孝東路四段100號",
+     {"name": "王小明", "phone": "0912345678", "product": "iPhone 15 Pro", "quantity": 2,
+      "address": "台北市大安區忠孝東路四段100號"}),
+    ("姓名：林志豪 手機：+886 935 123 456 商品：藍牙耳機 數量：2 地址：高雄市前鎮區中山二路5號",
+     {"name": "林志豪", "phone": "0935123456", "product": "藍牙耳機", "quantity": 2,
+      "address": "高雄市前鎮區中山二路5號"}),
+    ("我要買 Galaxy S24 Ultra 兩台，電話 (02) 2345-6789",
+     {"phone": "0223456789", "product": "Galaxy S24 Ultra", "quantity": 2}),
+])
+def test_extract_rules(text, expected):
+    assert extract_rules(text) == expected
+
+
+def _tool_reply(args):
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    call = {"name": "extract_order_data", "args": args, "id": "call_1"}
+    return RunnableLambda(lambda messages: AIMessage(content="", tool_calls=[call]))
+
+
+def test_fill_missing_drops_placeholders():
+    found = {"phone": "0912345678", "address": "台中市西區民生路10號"}
+    placeholders = {"name": "", "phone": "0999", "product": " ", "quantity": 0, "address": "別的地址"}
+
+    filled = fill_missing("電話 0912345678 地址 台中市西區民生路10號", found, _tool_reply(placeholders))
+
+    assert filled == found
+    assert missing_fields(filled) == ["name", "product", "quantity"]
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    calls = []
+
+    def reply(messages):
+        calls.append(messages)
+        return AIMessage(content="請提供姓名、商品與數量。")
+
+    monkeypatch.setattr(ch5_1, "get_llm_with_tools", lambda: RunnableLambda(reply))
+    return calls
+
+
+def run_turn(text):
+    from langchain_core.messages import HumanMessage
+
+    return ch5_1.get_app(False).invoke({"messages": [HumanMessage(content=text)]})
+
+
+def test_incomplete_order_goes_to_agent(agent, monkeypatch):
+    monkeypatch.setattr(ch5_1, "get_order_extractor", lambda: _tool_reply({"name": "", "product": "", "quantity": 0}))
+
+    result = run_turn("電話 0912345678 地址 台中市西區民生路10號")
+
+    assert len(agent) == 1
+    assert result["llm_calls"] == 2
+    assert result["messages"][-1].content == "請提供姓名、商品與數量。"
+    assert not any(m.type == "tool" for m in result["messages"])
+
+
+def test_complete_order_skips_llm(agent, monkeypatch):
+    monkeypatch.setattr(ch5_1, "get_order_extractor", lambda: pytest.fail("不該補欄位"))
+
+    result = run_turn("我是王小明，電話0912345678，要買2個iPhone 15 Pro，送到台北市大安區忠孝東路四段100號")
+
+    assert agent == []
+    assert result["llm_calls"] == 0
+    assert result["messages"][-1].content.startswith("已收到訂單：王小明 訂購 iPhone 15 Pro x 2")
+
+
+def test_cli_stream_handles_incomplete_order(agent, monkeypatch, capsys):
+    """CLI 逐節點印出：pre_extract 只回報 llm_calls (沒有 messages) 時不能讓整個 session 中斷"""
+    monkeypatch.setattr(ch5_1, "get_order_extractor", lambda: _tool_reply({"name": "", "product": "", "quantity": 0}))
+
+    llm_calls, _ = ch5_1.stream_turn("電話 0912345678 地址 台中市西區民生路10號")
+
+    assert llm_calls == 2
+    out = capsys.readouterr().out
+    assert "-- Node: pre_extract --" not in out
+    assert "-- Node: agent --" in out and "請提供姓名、商品與數量。" in out
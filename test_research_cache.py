@@ -0,0 +1,89 @@
+"""
+research_cache：ETag / Last-Modified 驗證與 JSONL 追加寫入 (假的 HTTP session，不連線)
+
+    python -m pytest -q test_research_cache.py
+"""
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day4"))
+
+import research_cache  # noqa: E402
+from research_cache import ResearchCache  # noqa: E402
+
+URL = "https://example.com/a"
+
+
+class FakeSession:
+    def __init__(self, headers=None, error=None):
+        self.headers = headers or {}
+        self.error = error
+        self.calls = []
+
+    def head(self, url, **kwargs):
+        self.calls.append(("HEAD", url))
+        if self.error:
+            raise self.error
+        return SimpleNamespace(headers=self.headers, raise_for_status=lambda: None)
+
+    def get(self, url, **kwargs):
+        raise AssertionError("驗證網頁版本不應該下載內容")
+
+
+def validators_for(monkeypatch, **kwargs):
+    session = FakeSession(**kwargs)
+    monkeypatch.setattr(research_cache, "_session", lambda: session)
+    return research_cache.page_validators(URL), session
+
+
+def test_page_validated_with_head_request(monkeypatch, tmp_path):
+    path = str(tmp_path / "cache.jsonl")
+    validators, session = validators_for(monkeypatch, headers={"ETag": '"v1"'})
+    ResearchCache(path).put_page(URL, validators, "VLM 內容")
+
+    cache = ResearchCache(path)  # 重新載入
+    same, _ = validators_for(monkeypatch, headers={"ETag": '"v1"'})
+    changed, _ = validators_for(monkeypatch, headers={"ETag": '"v2"'})
+
+    assert session.calls == [("HEAD", URL)]
+    assert cache.get_page(URL, same) == "VLM 內容"
+    assert cache.get_page(URL, changed) is None
+    assert (cache.stats["page_hit"], cache.stats["page_miss"]) == (1, 1)
+
+
+def test_last_modified_used_without_etag(monkeypatch, tmp_path):
+    cache = ResearchCache(str(tmp_path / "cache.jsonl"))
+    old, _ = validators_for(monkeypatch, headers={"Last-Modified": "Mon, 19 Oct 2026 00:00:00 GMT"})
+    cache.put_page(URL, old, "舊內容")
+
+    newer, _ = validators_for(monkeypatch, headers={"Last-Modified": "Tue, 20 Oct 2026 00:00:00 GMT"})
+    assert cache.get_page(URL, old) == "舊內容"
+    assert cache.get_page(URL, newer) is None
+
+
+def test_head_failure_falls_back_to_ttl(monkeypatch, tmp_path):
+    cache = ResearchCache(str(tmp_path / "cache.jsonl"))
+    validators, _ = validators_for(monkeypatch, error=OSError("timeout"))
+    no_headers, _ = validators_for(monkeypatch, headers={})
+    cache.put_page(URL, None, "內容")
+
+    assert validators is None and no_headers is None
+    assert cache.get_page(URL, None) == "內容"
+    assert cache.stats["page_hit_ttl"] == 1
+
+
+def test_puts_append_and_skip_broken_tail(tmp_path):
+    path = tmp_path / "cache.jsonl"
+    ResearchCache(str(path)).put_search("誰 爬了101", [{"url": URL}])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"kind": "pages", "key": "x", "val')  # 中斷時寫到一半
+
+    cache = ResearchCache(str(path))
+    cache.put_page(URL, None, "內容")
+    cache.put_search("誰 爬了101", [{"url": URL}, {"url": "https://example.com/b"}])
+
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 4
+    reloaded = ResearchCache(str(path))
+    assert len(reloaded.get_search("誰  爬了101")) == 2
+    assert reloaded.get_page(URL, None) == "內容"
@@ -0,0 +1,84 @@
+"""
+srt：CueList / StreamingSrtParser 的解析與時間切片
+
+    python -m pytest -q test_srt.py
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "day3"))
+
+from srt import CueList, StreamingSrtParser, parse_srt, to_srt, window_cues  # noqa: E402
+
+SRT = """1
+00:00:00,000 --> 00:00:02,500
+大家好，歡迎收聽本集節目。
+
+2
+00:00:02,500 --> 00:00:05,000
+今天我們要聊的是
+語音辨識。
+
+3
+00:00:05,000 --> 00:00:07,000
+第三句。
+"""
+
+
+def texts(cues) -> list[str]:
+    return [cue.text for cue in cues]
+
+
+def test_blank_lines_with_spaces_and_crlf():
+    messy = SRT.replace("\n\n", "\n   \n\n\t\n").replace("\n", "\r\n")
+
+    cues = parse_srt(messy)
+
+    assert texts(cues) == texts(parse_srt(SRT))
+    assert texts(cues)[1] == "今天我們要聊的是\n語音辨識。"
+    assert list(cues.starts) == [0.0, 2.5, 5.0]
+
+
+def test_feed_split_anywhere_matches_whole_parse():
+    text = SRT.replace("\n", "\r\n")
+    for size in (1, 3, 7, 50):
+        parser = StreamingSrtParser()
+        for i in range(0, len(text), size):
+            parser.feed(text[i:i + size])
+        cues = parser.close()
+        assert to_srt(cues) == to_srt(parse_srt(SRT))
+        assert cues.closed
+
+
+def test_slice_time_boundaries():
+    cues = parse_srt(SRT)
+
+    assert texts(cues.slice_time(0, 2.5)) == ["大家好，歡迎收聽本集節目。"]  # 開始時間 == t1 不算
+    assert len(cues.slice_time(2.5, 5.0)) == 1                            # 開始時間 == t0 算
+    assert len(cues.slice_time(2.6, 4.9)) == 0
+    assert len(cues.slice_time(0, 100)) == 3
+    assert [len(w) for w in window_cues(cues, window_seconds=5)] == [2, 1]
+
+
+def test_stitched_segments_out_of_order_are_sorted():
+    """拼接的分段字幕：後一段的第一句比前一段最後一句還早開始"""
+    parser = StreamingSrtParser()
+    parser.feed("1\n00:00:58,000 --> 00:01:03,000\n片段一最後一句\n\n")
+    parser.feed("1\n00:00:57,500 --> 00:00:59,000\n片段二第一句\n\n2\n00:01:05,000 --> 00:01:06,000\n片段二第二句\n\n")
+    parser.feed("3\n00:00:10,000 --> 00:00:12,000\n更早的一句\n")
+    cues = parser.close()
+
+    assert list(cues.starts) == sorted(cues.starts)
+    assert texts(cues) == ["更早的一句", "片段二第一句", "片段一最後一句", "片段二第二句"]
+    assert texts(cues.slice_time(57, 60)) == ["片段二第一句", "片段一最後一句"]
+    assert cues.duration == 66.0
+    assert cues.char_count == sum(len(t) for t in texts(cues))
+
+
+def test_equal_starts_keep_insertion_order():
+    cues = CueList()
+    cues.append(1.0, 2.0, "a")
+    cues.append(3.0, 4.0, "b")
+    cues.append(1.0, 1.5, "c")
+
+    assert texts(cues) == ["a", "c", "b"]
@@ -0,0 +1,14 @@
+"""
+不載入 tokenizer 的 token 數估算 (day3 memory、day4 context_budget / router 共用)
+
+中日韓字元約 1 token/字，其餘約 4 字元/token；只用來抓預算與路由門檻，不求精確。
+"""
+import math
+import re
+
+CJK = re.compile(r"[　-鿿가-힯＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
@@ -0,0 +1,251 @@
+"""
+本機追蹤 (Tracing)
+
+每次執行 Graph 記錄一個 trace，內含：
+- graph / node span：由 LangChain callback 取得 (LangGraph 節點的 metadata 帶有 langgraph_node)
+- llm span：模型名稱、input/output tokens、第一個 token 的時間
+- tool span：搜尋、網頁讀取這類非 LangChain 呼叫，以 tracer.span() 包起來
+
+span 以 OpenTelemetry 的欄位命名 (trace_id / span_id / parent_span_id / start_time_unix_nano ...)
+一行一筆寫進 JSONL (預設 traces.jsonl，可用 TRACE_FILE 覆寫)，之後要轉進 OTel collector 也容易。
+
+    python tracing.py report                 # 跨所有 run 的最慢節點
+    python tracing.py report --top 5 --file traces.jsonl
+"""
+import argparse
+import contextvars
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import cache
+
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+_current_trace = contextvars.ContextVar("trace_id", default=None)
+
+
+def _new_id(length: int = 16) -> str:
+    return uuid.uuid4().hex[:length]
+
+
+def _usage(response) -> tuple[int | None, int | None]:
+    """從 LLMResult 取出 (input_tokens, output_tokens)"""
+    for generations in response.generations:
+        for gen in generations:
+            usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+class Tracer:
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._active_trace = None  # 執行緒池裡拿不到 contextvar 時的後備
+
+    def export(self, span: dict):
+        line = json.dumps(span, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def trace_id(self) -> str | None:
+        return _current_trace.get() or self._active_trace
+
+    def _span(self, name, kind, start_ns, end_ns, trace_id=None, span_id=None,
+              parent_span_id=None, **attributes) -> dict:
+        return {
+            "trace_id": trace_id or self.trace_id(),
+            "span_id": span_id or _new_id(),
+            "parent_span_id": parent_span_id,
+            "name": name,
+            "kind": kind,
+            "start_time_unix_nano": start_ns,
+            "end_time_unix_nano": end_ns,
+            "duration_ms": None if end_ns is None else (end_ns - start_ns) / 1e6,
+            "attributes": {k: v for k, v in attributes.items() if v is not None},
+        }
+
+    @contextmanager
+    def span(self, name: str, kind: str = "tool", **attributes):
+        """
+        包住一段非 LangChain 的呼叫 (搜尋、爬網頁...)；例外會記在 error 欄位後照常拋出。
+        不在 run() 之內時什麼都不記錄。
+        """
+        if self.trace_id() is None and kind != "run":
+            yield attributes
+            return
+        start = time.time_ns()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = repr(e)
+            raise
+        finally:
+            self.export(self._span(name, kind, start, time.time_ns(), **attributes))
+
+    @contextmanager
+    def run(self, name: str, **attributes):
+        """
+        一次 Graph 執行 = 一個 trace。
+        yield 的 callbacks 要放進 config={"callbacks": ...}，node / llm span 才會被記錄。
+        """
+        trace_id = _new_id(32)
+        token = _current_trace.set(trace_id)
+        self._active_trace = trace_id
+        handler = _callback_handler(self, trace_id)
+        with self.span(name, kind="run", **attributes):
+            try:
+                yield [handler]
+            finally:
+                _current_trace.reset(token)
+                self._active_trace = None
+
+
+def _callback_handler(tracer: Tracer, trace_id: str):
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TraceCallbackHandler(BaseCallbackHandler):
+        """把 LangGraph 的 graph / node 與 LLM 呼叫轉成 span"""
+
+        def __init__(self):
+            self._lock = threading.Lock()
+            self._open = {}     # run_id -> span (尚未結束)
+            self._parent = {}   # run_id -> parent_run_id (含未記錄的內部 runnable)
+
+        def _traced_parent(self, parent_run_id):
+            while parent_run_id is not None:
+                span = self._open.get(parent_run_id)
+                if span is not None:
+                    return span["span_id"]
+                parent_run_id = self._parent.get(parent_run_id)
+            return None
+
+        def _start(self, run_id, parent_run_id, name, kind, **attributes):
+            with self._lock:
+                self._parent[run_id] = parent_run_id
+                if kind is None:
+                    return
+                self._open[run_id] = tracer._span(
+                    name, kind, time.time_ns(), None, trace_id=trace_id,
+                    parent_span_id=self._traced_parent(parent_run_id), **attributes,
+                )
+
+        def _end(self, run_id, **attributes):
+            with self._lock:
+                self._parent.pop(run_id, None)
+                span = self._open.pop(run_id, None)
+            if span is None:
+                return
+            span["end_time_unix_nano"] = time.time_ns()
+            span["duration_ms"] = (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e6
+            span["attributes"].update({k: v for k, v in attributes.items() if v is not None})
+            tracer.export(span)
+
+        # --- graph / node ---
+        def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None,
+                           tags=None, metadata=None, **kwargs):
+            name = kwargs.get("name")
+            metadata = metadata or {}
+            if parent_run_id is None:
+                kind = "graph"
+            elif name and name == metadata.get("langgraph_node"):
+                kind = "node"
+            else:
+                kind = None  # 節點內部的 RunnableSequence / ChannelWrite 等不記錄
+            self._start(run_id, parent_run_id, name, kind, step=metadata.get("langgraph_step"))
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            self._end(run_id)
+
+        def on_chain_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error=repr(error))
+
+        # --- llm ---
+        def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None,
+                                metadata=None, **kwargs):
+            params = kwargs.get("invocation_params") or {}
+            model = params.get("model") or params.get("model_name") or (serialized or {}).get("name")
+            self._start(run_id, parent_run_id, model or "llm", "llm",
+                        node=(metadata or {}).get("langgraph_node"))
+
+        def on_llm_new_token(self, token, *, run_id, **kwargs):
+            with self._lock:
+                span = self._open.get(run_id)
+                if span is not None and "ttft_ms" not in span["attributes"] and token:
+                    span["attributes"]["ttft_ms"] = (time.time_ns() - span["start_time_unix_nano"]) / 1e6
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            input_tokens, output_tokens = _usage(response)
+            self._end(run_id, input_tokens=input_tokens, output_tokens=output_tokens)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error=repr(error))
+
+    return TraceCallbackHandler()
+
+
+@cache
+def get_tracer() -> Tracer:
+    return Tracer()
+
+
+# ================= 報表 =================
+def load_spans(path: str = TRACE_FILE) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def report(path: str = TRACE_FILE, top: int = 10):
+    spans = load_spans(path)
+    if not spans:
+        print(f"{path} 沒有任何 span")
+        return
+    runs = {s["trace_id"] for s in spans if s["kind"] == "run"}
+    print(f"{path}: {len(runs)} 次執行, {len(spans)} 個 span")
+
+    def table(kind: str, title: str):
+        groups = defaultdict(list)
+        for s in spans:
+            if s["kind"] == kind:
+                groups[s["name"]].append(s)
+        if not groups:
+            return
+        rows = []
+        for name, items in groups.items():
+            durations = sorted(s["duration_ms"] for s in items)
+            p95 = durations[min(int(len(durations) * 0.95), len(durations) - 1)]
+            rows.append((sum(durations), name, len(items), statistics.mean(durations), p95, items))
+        rows.sort(reverse=True)
+        print(f"\n[{title}] 依總耗時排序")
+        print(f"{'名稱':<28}{'次數':>6}{'總計(s)':>10}{'平均(ms)':>10}{'p95(ms)':>10}")
+        for total, name, count, mean, p95, items in rows[:top]:
+            extra = ""
+            if kind == "llm":
+                tokens_in = sum(s["attributes"].get("input_tokens") or 0 for s in items)
+                tokens_out = sum(s["attributes"].get("output_tokens") or 0 for s in items)
+                extra = f"  tokens {tokens_in} in / {tokens_out} out"
+            print(f"{str(name)[:27]:<28}{count:>6}{total / 1000:>10.2f}{mean:>10.0f}{p95:>10.0f}{extra}")
+
+    table("node", "最慢節點")
+    table("llm", "LLM 呼叫")
+    table("tool", "工具呼叫")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機 trace 報表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="跨所有執行的最慢節點 / LLM / 工具")
+    rep.add_argument("--file", default=TRACE_FILE)
+    rep.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    report(args.file, args.top)